@@ -1,11 +1,13 @@
+import asyncio
 import random
 import discord
 import pathlib
 from . import constants
-from .solvertools.anagram import anagrams
-from .solvertools.wordlist import cromulence
+from .solvertools.anagram import anagram_stream, SearchDeadline
+from .solvertools.wordlist import cromulence, cromulence_batch
 from .utils import ciphers, external_api
 from .utils.registrar import WORD_SET_TESTS
+from .utils.workers import WorkerPool
 
 from redbot.core import commands
 
@@ -13,12 +15,40 @@ from redbot.core import commands
 
 COMMAND_KEYWORDS = {}
 
+# How many seconds commands can take before we give up on them. Anagramming
+# stops itself a bit earlier than its timeout, and reports what it's found.
+SOLVER_TIMEOUT = 60
+ANAGRAM_TIMEOUT = 120
+ANAGRAM_TIME_LIMIT = 100
+API_TIMEOUT = 30
+
+# How often, in seconds, to update the message showing anagram results
+ANAGRAM_UPDATE_INTERVAL = 5
+
+# How many anagrams to search for, and how many of the best to show. The
+# search stops after finding several times its count, so searching for
+# fewer than the usual 100 would find worse anagrams to show.
+ANAGRAM_SEARCH_COUNT = 100
+ANAGRAM_SHOWN = 15
+
 def random_nature_emoji():
     return random.choice(constants.NATURE_EMOJIS)
 
 class HypeBot(commands.Cog):
     def __init__(self):
         self.path = pathlib.Path(__file__).parent.resolve() / "images"
+        # Solvers and web requests run here, so that one slow command doesn't
+        # hold up all the others.
+        self.workers = WorkerPool()
+
+    def cog_unload(self):
+        self.workers.shutdown()
+
+    async def cog_command_error(self, ctx, error):
+        if isinstance(getattr(error, 'original', None), asyncio.TimeoutError):
+            await ctx.send(f'Sorry, that took too long {random_nature_emoji()}')
+        else:
+            await ctx.bot.on_command_error(ctx, error, unhandled_by_cog=True)
     
     def images_path(self, ext):
         return self.path / ext
@@ -229,8 +259,10 @@ class HypeBot(commands.Cog):
         msg = ' '.join(tokens) if tokens[0] != 'shift' else ' '.join(tokens[1:])
 
         shifts = [ciphers.caesar_shift(msg, i) for i in range(26)]
-        best_cromulence = max(enumerate(shifts), key=lambda k: cromulence(k[1])[0])
-        cromulence_idx = best_cromulence[0] if cromulence(best_cromulence[1])[0] > 0 else -1
+        scores, _ = await self.workers.run_cpu(
+            cromulence_batch, shifts, timeout=SOLVER_TIMEOUT)
+        best_idx = int(scores.argmax())
+        cromulence_idx = best_idx if scores[best_idx] > 0 else -1
 
         await channel.send('```\n' +
             '\n'.join([f'{shifts[i]} (+{i})' + (' *' if i == cromulence_idx else '') for i in range(26)]) +
@@ -245,11 +277,25 @@ class HypeBot(commands.Cog):
 
         msg = ''.join(tokens)
 
-        results = anagrams(msg)
-
-        await channel.send('Anagrams for ' + msg + ':\n```\n' +
-            '\n'.join([f'{r[1]} ({r[0]})' for r in results[:15]]) +
-        '\n```')
+        # Post the best anagrams as soon as there are some, and edit the
+        # message as better ones turn up.
+        deadline = SearchDeadline(ANAGRAM_TIME_LIMIT, event=self.workers.event())
+        message = None
+        try:
+            async for results in self.workers.stream_cpu(
+                    anagram_stream, msg, count=ANAGRAM_SEARCH_COUNT,
+                    interval=ANAGRAM_UPDATE_INTERVAL, deadline=deadline,
+                    timeout=ANAGRAM_TIMEOUT):
+                content = ('Anagrams for ' + msg + ':\n```\n' +
+                    '\n'.join([f'{r[1]} ({r[0]})' for r in results[:ANAGRAM_SHOWN]]) +
+                '\n```')
+                if message is None:
+                    message = await channel.send(content)
+                else:
+                    await message.edit(content=content)
+        finally:
+            # If we gave up waiting, stop the search too.
+            deadline.cancel()
 
 
     #################
@@ -261,7 +307,8 @@ class HypeBot(commands.Cog):
     async def cromulence(self, ctx,*args):
         content = ''.join(args)
 
-        response = cromulence(content)
+        response = await self.workers.run_cpu(
+            cromulence, content, timeout=SOLVER_TIMEOUT)
         await ctx.send(response)
 
 
@@ -269,7 +316,8 @@ class HypeBot(commands.Cog):
     async def onelook(self, ctx, *tokens):
         content = ' '.join(tokens)
 
-        url, results = external_api.onelook(content)
+        url, results = await self.workers.run_io(
+            external_api.onelook, content, timeout=API_TIMEOUT)
         if len(results) == 0:
             await ctx.send('<' + url + '>\nNothing found')
             return
@@ -315,7 +363,8 @@ class HypeBot(commands.Cog):
         if dictionary == 'onelook':
             content = content.replace(' ', '_').replace('$', ' ')
 
-        url, results = external_api.regex(content, dictionary)
+        url, results = await self.workers.run_io(
+            external_api.regex, content, dictionary, timeout=API_TIMEOUT)
         if len(results) == 0:
             await ctx.send('(via <' + url + '>)\nNothing found')
             return
@@ -339,7 +388,8 @@ class HypeBot(commands.Cog):
 
         content = ' '.join(tokens)
 
-        url, response = external_api.crossword(content)
+        url, response = await self.workers.run_io(
+            external_api.crossword, content, timeout=API_TIMEOUT)
 
         max_answer_length = max([len(row[1]) for row in response])
         response_str = '\n'.join(_print_row(row, max_answer_length) for row in response)
@@ -351,7 +401,8 @@ class HypeBot(commands.Cog):
     async def synonym(self, ctx, *tokens):
         content = ' '.join(tokens)
 
-        response = external_api.synonyms(content)
+        response = await self.workers.run_io(
+            external_api.synonyms, content, timeout=API_TIMEOUT)
         response = '`' + ' '.join(response)[:1350] + '`'
         await ctx.send(response)
 
@@ -361,7 +412,8 @@ class HypeBot(commands.Cog):
     async def antonym(self, ctx, *tokens):
         content = ' '.join(tokens)
 
-        response = external_api.antonyms(content)
+        response = await self.workers.run_io(
+            external_api.antonyms, content, timeout=API_TIMEOUT)
         response = '`' + ' '.join(response)[:1350] + '`'
         await ctx.send(response)
 
@@ -370,7 +422,8 @@ class HypeBot(commands.Cog):
     async def nutrimatic(self, ctx, *tokens):
         content = ''.join(tokens)
 
-        url, results = external_api.nutrimatic(content)
+        url, results = await self.workers.run_io(
+            external_api.nutrimatic, content, timeout=API_TIMEOUT)
         await ctx.send('<' + url +
                                 '>\n```\n' +
                                 '\n'.join(results) + '```')
@@ -380,7 +433,8 @@ class HypeBot(commands.Cog):
     @commands.command(aliases=['v', 'vignere'])
     async def vigenere(self, ctx, *args):
         tokens = ' '.join(args)
-        key, decoded = external_api.solve_vigenere(tokens)
+        key, decoded = await self.workers.run_io(
+            external_api.solve_vigenere, tokens, timeout=API_TIMEOUT)
         response = f'{decoded}\n(key: {key})'
         await ctx.send(response)
 
@@ -390,7 +444,8 @@ class HypeBot(commands.Cog):
     async def cryptogram(self, ctx, *args):
         tokens = ' '.join(args)
 
-        responses = external_api.solve_cryptogram(tokens)
+        responses = await self.workers.run_io(
+            external_api.solve_cryptogram, tokens, timeout=API_TIMEOUT)
         response = '```\n' + '\n'.join(
                 [f'({k["logp"]:.2f}) {k["plaintext"]}  | KEY: {k["key"]}'
                 for k in responses[:8]]) + '\n```'
@@ -401,7 +456,8 @@ class HypeBot(commands.Cog):
     async def qat(self, ctx, *args):
         content = ''.join(args)
 
-        url, results = external_api.qat(content)
+        url, results = await self.workers.run_io(
+            external_api.qat, content, timeout=API_TIMEOUT)
         url_r = '<' + url + '>\n'
         response = ''
         joiner = ' ' if ';' not in content else '\n'
@@ -447,7 +503,8 @@ class HypeBot(commands.Cog):
     async def wolframalpha(self, ctx, *args):
         if len(args) > 0:
             words = ' '.join(args)
-            out = external_api.wolfram_alpha(words)
+            out = await self.workers.run_io(
+                external_api.wolfram_alpha, words, timeout=API_TIMEOUT)
             while sum(map(len, out)) > 2000:
                 out.pop()
             await ctx.send(''.join(out))
@@ -1,22 +1,147 @@
 """
 This anagrammer is pretty cool.
 
-It can probably still be improved, possibly by actually using priority
-queues with a search strategy instead of all these iterator shenanigans.
+`anagrams` is made of iterator shenanigans that interleave all the
+possibilities, which searches them in a breadth-first sort of order. It also
+does the work of `anagram_single` and `anagram_double`.
+
+The generators produce each anagram as a tuple of the slugs it's made of,
+so it can be scored from its pieces without working out its spacing from
+scratch.
+
+Anagramming can take forever, so every search can be given a SearchDeadline,
+which the generators check as they go. `anagram_stream` reports the best
+results so far at intervals, for callers that want to show something before
+the search is done.
+
+Searches that `anagram_stream` finishes are kept in the wordlist's result
+cache, so asking for the same anagrams again, even after a restart, doesn't
+search again.
+
+`anagrams` and `anagram_double` can also split a search across several
+processes. Each process takes a shard of the choices for the first piece of
+the anagram, and sends its anagrams back, labeled with the choice they came
+from. The process that started the search lays out the same choices, in the
+same order, and interleaves what the shards send exactly as a search in one
+process would, so it gets the same results.
 """
 import itertools
+import multiprocessing
+import queue as queue_module
 import time
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
-from .wordlist import WORDS
+from .wordlist import WORDS, Wordlist
+from ..utils.cache import LRUCache
 from ..utils.normalize import slugify
 from ..utils.string import (
-    alphagram, alphabytes, alphabytes_to_alphagram, anagram_diff, anahash,
-    anagram_cost
+    alphagram, anahash, anagram_cost,
+    letters_to_vec, letterbag_contains, letterbag_from_vec, letterbag_to_vec,
+    multiset_combinations, vec_diff, vec_to_alphagram
 )
 
 
 LETTERS_TO_TRY = 'etaoinshrdlucympbgfvxwkjzq'
 
+# How many candidate anagrams to score at a time in eval_anagrams
+EVAL_BATCH_SIZE = 50
+
+# How often, in seconds, a SearchDeadline looks at its cancellation event,
+# which may live in another process
+CANCEL_POLL_INTERVAL = 0.1
+
+# How many remaining sets of letters the search remembers the
+# anagrams of, and how many anagrams it remembers for each one
+REMAINDER_MEMO_SIZE = 2000
+REMAINDER_MEMO_ITEMS = 1000
+
+# How many anagrams a shard of a parallel search collects before sending
+# them back, and the longest it waits to send them, in seconds
+SHARD_BATCH_SIZE = 50
+SHARD_BATCH_INTERVAL = 0.1
+
+# How many batches a shard can send before the search has read them. This
+# keeps the shards from getting far ahead of what the search needs.
+SHARD_QUEUE_BATCHES = 4
+
+# What a shard of a parallel search sends back when it's done, when one of
+# its generators of anagrams is done, and when there are no more generators
+# for one choice of the first piece
+_END_OF_SHARD = '__end_of_shard__'
+_END_OF_LEAF = '__end_of_leaf__'
+_NO_LEAF = '__no_leaf__'
+
+# Process pools for parallel searches, by number of processes, the Manager
+# that their queues and events belong to, and the wordlists that have been
+# opened in this process to search shards with
+_shard_pools = {}
+_shard_manager = None
+_shard_wordlists = {}
+
+
+class SearchStopped(Exception):
+    """
+    Raised inside an anagram search when its deadline passes or it's
+    cancelled. eval_anagrams catches it and returns what's been found.
+    """
+    pass
+
+
+class SearchDeadline:
+    """
+    Tells an anagram search when to give up: when `time_limit` seconds have
+    passed, or when it's cancelled, whichever comes first.
+
+    The generators that make up a search call `check()` in their loops, so a
+    search stops promptly even when it's stuck in a part of the search space
+    that isn't producing any anagrams.
+
+    To cancel a search running in another process, pass an `event` that can
+    be shared with that process, such as one from a multiprocessing Manager,
+    and set it. The time limit is measured on the wall clock for the same
+    reason.
+    """
+    def __init__(self, time_limit=None, event=None):
+        if time_limit is None:
+            self.end_time = None
+        else:
+            self.end_time = time.time() + time_limit
+        self.event = event
+        self.cancelled = False
+        self._next_poll = 0.
+
+    def cancel(self):
+        self.cancelled = True
+        if self.event is not None:
+            self.event.set()
+
+    def expired(self):
+        if self.cancelled:
+            return True
+        now = time.time()
+        if self.end_time is not None and now >= self.end_time:
+            return True
+        if self.event is not None and now >= self._next_poll:
+            self._next_poll = now + CANCEL_POLL_INTERVAL
+            self.cancelled = self.event.is_set()
+        return self.cancelled
+
+    def shared(self, event):
+        """
+        Make a deadline with the same time limit as this one, which is also
+        cancelled by `event`, for a part of the search in another process.
+        """
+        deadline = SearchDeadline(event=event)
+        deadline.end_time = self.end_time
+        return deadline
+
+    def check(self):
+        "Raise SearchStopped if the search should stop."
+        if self.expired():
+            raise SearchStopped
+
 
 def interleave(iteriter):
     """
@@ -49,71 +174,248 @@ def interleave(iteriter):
                 del seen_iters[i]        
 
 
-def eval_anagrams(gen, wordlist, count, quiet=False, time_limit=None):
+def eval_anagrams(gen, wordlist, count, quiet=False, time_limit=None,
+                  deadline=None):
     """
     The final step in anagramming. Given a generator of anagrams, `gen`,
-    extract their readable text with spaces, get a reasonable number of
+    as tuples of the slugs that make them up, extract their readable text
+    with spaces, get a reasonable number of
     results that aren't just shuffling the words of other results, and
     sort them by their cromulence (see wordlist.py).
 
     The results are printed as they are encountered, and at the end, the top
-    `count` are returned from best to worst.
+    `count` are returned from best to worst. If the search runs for more
+    than `time_limit` seconds, or the `deadline` passes first, the best
+    results found so far are returned.
     """
-    start_time = time.monotonic()
+    if deadline is None:
+        deadline = SearchDeadline(time_limit)
+    results = []
+    for results in _eval_anagram_snapshots(gen, wordlist, count, quiet, deadline):
+        pass
+    return results
+
+
+def _eval_anagram_snapshots(gen, wordlist, count, quiet, deadline, interval=None):
+    """
+    Do the work of eval_anagrams, yielding the current top `count` results
+    every `interval` seconds when they've changed, and once more at the end
+    if they've changed since then. With no `interval`, only the final results
+    are yielded.
+    """
+    if deadline is None:
+        deadline = SearchDeadline()
     results = []
     used = set()
     best_logprob = -1000
-    for slug in gen:
-        logprob, text = wordlist.text_logprob(slug)
-        textblob = ''.join(sorted(text.split(' ')))
-        if textblob not in used:
-            if not quiet:
-                if logprob > best_logprob:
-                    best_logprob = logprob
-                    print("%4.4f\t%s" % (logprob, text))
-            cromulence = wordlist.logprob_to_cromulence(logprob, len(slug))
-            results.append((cromulence, logprob, text))
-            if len(results) >= count * 5:
-                break
-            if time_limit and (time.monotonic() - start_time > time_limit):
+    snapshot = None
+    next_snapshot_time = None
+    if interval is not None:
+        next_snapshot_time = time.monotonic() + interval
+    finished = False
+    while not finished:
+        # Take candidates in batches, so that they can be scored together
+        # with a few database queries.
+        batch, finished = _take_anagram_batch(gen, deadline, next_snapshot_time)
+        logprobs, texts = wordlist.pieces_logprob_batch(batch)
+        for pieces, logprob, text in zip(batch, logprobs.tolist(), texts):
+            textblob = ''.join(sorted(text.split(' ')))
+            if textblob not in used:
+                if not quiet:
+                    if logprob > best_logprob:
+                        best_logprob = logprob
+                        print("%4.4f\t%s" % (logprob, text))
+                length = sum(len(piece) for piece in pieces)
+                cromulence = wordlist.logprob_to_cromulence(logprob, length)
+                results.append((cromulence, logprob, text))
+                if len(results) >= count * 5:
+                    finished = True
+                    break
+                used.add(textblob)
+        if next_snapshot_time is not None and time.monotonic() >= next_snapshot_time:
+            next_snapshot_time = time.monotonic() + interval
+            new_snapshot = _top_anagrams(results, count)
+            if new_snapshot != snapshot:
+                snapshot = new_snapshot
+                yield snapshot
+    new_snapshot = _top_anagrams(results, count)
+    if new_snapshot != snapshot:
+        yield new_snapshot
+
+
+def _take_anagram_batch(gen, deadline, until=None):
+    """
+    Take up to EVAL_BATCH_SIZE anagrams from `gen`, stopping early at the
+    monotonic time `until`. Returns the batch, and whether the search is
+    finished because `gen` ran out or the deadline passed.
+    """
+    batch = []
+    try:
+        while len(batch) < EVAL_BATCH_SIZE:
+            deadline.check()
+            if until is not None and batch and time.monotonic() >= until:
                 break
-            used.add(textblob)
-    results.sort(reverse=True)
-    return [(cromulence, text) for (cromulence, logprob, text) in results[:count]]
+            batch.append(next(gen))
+    except (StopIteration, SearchStopped):
+        return batch, True
+    return batch, False
+
+
+def _top_anagrams(results, count):
+    top = sorted(results, reverse=True)[:count]
+    return [(cromulence, text) for (cromulence, logprob, text) in top]
+
+
+def _each_leaf(shard, group, items, make_leaves):
+    """
+    Make the generators of anagrams that a list of choices for the first
+    piece of an anagram lead to. `make_leaves(item)` makes the generators
+    for one item, and the caller interleaves them; `group` names the list
+    among the others in the search.
+
+    With no shard, this is every item's generators. A _SearchShard only
+    makes the generators for the items it owns, and a _ShardMerger stands
+    in for every item's generators with ones that read what the shard that
+    owns it sends back.
+    """
+    if shard is None:
+        for item in items:
+            yield from make_leaves(item)
+    else:
+        yield from shard.leaves(group, items, make_leaves)
+
+
+def _item_keys(group, items):
+    """
+    Label each item of a list of choices with a key that's the same in
+    every process: its group, its first piece, and how many times that
+    first piece has come up in the list before.
+    """
+    seen = defaultdict(int)
+    for item in items:
+        yield (group, item[0], seen[item[0]]), item
+        seen[item[0]] += 1
+
+
+def _key_owner(key, count):
+    "Which of `count` shards owns the item with this key."
+    return zlib.crc32(repr(key).encode('utf-8')) % count
+
+
+class _SearchShard:
+    """
+    The part of a parallel search that one worker process does: the
+    `index`th of `count` shards. It makes the generators for the items it
+    owns, and labels what they generate with the item's key and the
+    generator's number, so that the process that started the search can put
+    it in order.
+    """
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def leaves(self, group, items, make_leaves):
+        for key, item in _item_keys(group, items):
+            if _key_owner(key, self.count) == self.index:
+                number = -1
+                for number, leaf in enumerate(make_leaves(item)):
+                    yield _labeled_leaf(key + (number,), leaf)
+                yield iter([(key + (number + 1,), _NO_LEAF)])
+
+
+def _labeled_leaf(key, leaf):
+    for pieces in leaf:
+        yield key, pieces
+    yield key, _END_OF_LEAF
+
+
+class _ShardMerger:
+    """
+    Puts the anagrams from the shards of a parallel search in the order a
+    search in one process would generate them. It lays out the same choices
+    of first pieces, and stands in for each one's generators with ones that
+    read from the shard that owns it. Whatever a shard sends for other
+    generators in the meantime waits in a buffer.
+    """
+    def __init__(self, streams):
+        self.streams = streams
+        self.buffers = defaultdict(deque)
+
+    def leaves(self, group, items, make_leaves):
+        for key, item in _item_keys(group, items):
+            owner = _key_owner(key, len(self.streams))
+            for number in itertools.count():
+                leaf_key = key + (number,)
+                if self._peek(leaf_key, owner) == _NO_LEAF:
+                    self.buffers.pop(leaf_key, None)
+                    break
+                yield self._leaf(leaf_key, owner)
+
+    def _peek(self, key, owner):
+        """
+        Get the next thing the shard sent for a generator, without taking
+        it. If the shard stopped before sending it, that's _NO_LEAF.
+        """
+        buffer = self.buffers[key]
+        while not buffer:
+            try:
+                other_key, value = next(self.streams[owner])
+            except StopIteration:
+                return _NO_LEAF
+            self.buffers[other_key].append(value)
+        return buffer[0]
 
+    def _leaf(self, key, owner):
+        while self._peek(key, owner) not in (_END_OF_LEAF, _NO_LEAF):
+            yield self.buffers[key].popleft()
+        self.buffers.pop(key, None)
 
-def anagram_single(text, wildcards=0, wordlist=WORDS, count=10, quiet=True):
+
+def anagram_single(text, wildcards=0, wordlist=WORDS, count=10, quiet=True,
+                   time_limit=None, deadline=None):
     """
     Search for anagrams that appear directly in the wordlist.
     """
+    if deadline is None:
+        deadline = SearchDeadline(time_limit)
+    alpha = alphagram(slugify(text))
     return eval_anagrams(
-        _anagram_single(alphagram(slugify(text)), wildcards, wordlist),
-        wordlist, count, quiet=quiet
+        _anagram_single(alpha, wildcards, wordlist, deadline),
+        wordlist, count, quiet=quiet, deadline=deadline
     )
 
 
-def _anagram_single(alpha, wildcards, wordlist):
+def _anagram_single(alpha, wildcards, wordlist, deadline):
     if len(alpha) == 0:
         # don't make anything out of *just* wildcards
         return
     if len(alpha) == 1 and wildcards == 0:
         # short circuit
-        yield alpha
+        yield (alpha,)
         return
     if wildcards == 0:
-        yield from wordlist.find_by_alphagram_raw(alpha)
+        for slug in wordlist.find_by_alphagram_raw(alpha):
+            yield (slug,)
     elif wildcards > 0:
-        for seq in itertools.combinations(LETTERS_TO_TRY, wildcards):
-            newalpha = alphagram(alpha + ''.join(seq))
-            yield from wordlist.find_by_alphagram_raw(newalpha)
+        # Look up every way of filling in the wildcards at once.
+        newalphas = [
+            alphagram(alpha + ''.join(seq))
+            for seq in itertools.combinations(LETTERS_TO_TRY, wildcards)
+        ]
+        found = wordlist.find_by_alphagram_raw_many(newalphas)
+        for newalpha in newalphas:
+            deadline.check()
+            for slug in found[newalpha]:
+                yield (slug,)
     elif wildcards < 0:
         selection_size = len(alpha) + wildcards
         if selection_size == 0:
-            yield ''
+            yield ()
         elif selection_size >= 0:
-            for newalpha_seq in itertools.combinations(alpha, selection_size):
-                newalpha = ''.join(newalpha_seq)
-                yield from _anagram_single(newalpha, 0, wordlist)
+            # Each distinct set of letters to keep only needs to be tried once.
+            for newalpha in multiset_combinations(alpha, selection_size):
+                deadline.check()
+                yield from _anagram_single(newalpha, 0, wordlist, deadline)
 
 
 def adjusted_anagram_cost(item):
@@ -125,91 +427,384 @@ def adjusted_anagram_cost(item):
     return anagram_cost(letters) / (max(0, wildcards) + 1) * (index + 2)
 
 
-def anagram_double(text, wildcards=0, wordlist=WORDS, count=100, quiet=False):
+def anagram_double(text, wildcards=0, wordlist=WORDS, count=100, quiet=False,
+                   time_limit=None, deadline=None, processes=1):
     """
     Search for anagrams that can be made of two words or phrases from the
     wordlist.
+
+    With more than one of `processes`, the search is split between that many
+    worker processes, as in `anagrams`.
     """
+    if deadline is None:
+        deadline = SearchDeadline(time_limit)
+    if processes > 1:
+        return _anagram_parallel(
+            'double', text, wildcards, wordlist, count, quiet, deadline,
+            processes
+        )
+    alpha = alphagram(slugify(text))
     return eval_anagrams(
-        _anagram_double(alphagram(slugify(text)), wildcards, wordlist),
-        wordlist, count, quiet=quiet
+        _anagram_double(alpha, wildcards, wordlist, deadline),
+        wordlist, count, quiet=quiet, deadline=deadline
     )
 
 
-def _anagram_double(alpha, wildcards, wordlist):
-    yield from _anagram_single(alpha, wildcards, wordlist)
-    yield from interleave(_anagram_double_2(alpha, wildcards, wordlist))
+def _anagram_double(alpha, wildcards, wordlist, deadline, shard=None):
+    # The single-word anagrams all come from one shard.
+    singles = _each_leaf(
+        shard, 'single', [(alpha,)],
+        lambda item: [_anagram_single(alpha, wildcards, wordlist, deadline)]
+    )
+    for leaf in singles:
+        yield from leaf
+    yield from interleave(_anagram_double_2(alpha, wildcards, wordlist, deadline, shard))
 
 
-def _anagram_double_2(alpha, wildcards, wordlist):
+def _anagram_double_2(alpha, wildcards, wordlist, deadline, shard=None):
     if len(alpha) >= 25:
         return
+    alpha_vec = letters_to_vec(alpha)
     sub_anas = [
-        (sub, adiff, wildcards - wildcards_used, index)
+        (sub, vec_to_alphagram(remaining), wildcards - wildcards_used, index)
         for index, sub in enumerate(wordlist.find_sub_alphagrams(alpha, wildcard=(wildcards > 0)))
-        for adiff, wildcards_used in [anagram_diff(alpha, alphabytes_to_alphagram(sub))]
+        for remaining, wildcards_used in [
+            vec_diff(alpha_vec, letters_to_vec(sub))
+        ]
         if wildcards >= wildcards_used or (wildcards < 0 and wildcards_used == 0)
     ]
 
     # sub_anas.sort(key=adjusted_anagram_cost)
-    for abytes, alpha2, wildcards_remaining, index in sub_anas:
-        alpha1 = alphabytes_to_alphagram(abytes)
-        for slug1 in _anagram_single(alpha1, 0, wordlist):
-            yield _anagram_double_piece(slug1, alpha2, wildcards_remaining, wordlist)
+    def make_leaves(item):
+        alpha1, alpha2, wildcards_remaining, index = item
+        deadline.check()
+        for pieces1 in _anagram_single(alpha1, 0, wordlist, deadline):
+            yield _anagram_double_piece(
+                pieces1, alpha2, wildcards_remaining, wordlist, deadline
+            )
+
+    yield from _each_leaf(shard, 'double', sub_anas, make_leaves)
 
 
-def _anagram_double_piece(slug1, alpha2, wildcards_remaining, wordlist):
-    for slug2 in _anagram_single(alpha2, wildcards_remaining, wordlist):
-        yield slug1 + slug2
+def _anagram_double_piece(pieces1, alpha2, wildcards_remaining, wordlist, deadline):
+    for pieces in _anagram_single(alpha2, wildcards_remaining, wordlist, deadline):
+        yield pieces1 + pieces
 
 
-def anagrams(text, wildcards=0, wordlist=WORDS, count=100, quiet=False, time_limit=None):
+def anagrams(text, wildcards=0, wordlist=WORDS, count=100, quiet=False,
+             time_limit=None, deadline=None, processes=1):
     """
     Search for anagrams that are made of an arbitrary number of pieces from the
     wordlist.
+
+    The search stops after `time_limit` seconds, or when `deadline` says to,
+    and returns the best anagrams it's found.
+
+    With more than one of `processes`, the choices for the first piece of
+    the anagram are divided between that many worker processes, each of
+    which opens the wordlist read-only and searches its own shard until the
+    deadline. If the search finishes before the deadline, the results are
+    the same as a search in one process. This only saves time on a machine
+    with cores to spare.
     """
-    return eval_anagrams(
-        _anagram_recursive(alphagram(slugify(text)), wildcards, wordlist),
-        wordlist, count, quiet=quiet, time_limit=time_limit
-    )
+    if deadline is None:
+        deadline = SearchDeadline(time_limit)
+    if processes > 1:
+        return _anagram_parallel(
+            'multi', text, wildcards, wordlist, count, quiet, deadline,
+            processes
+        )
+    gen = _anagram_generator(text, wildcards, wordlist, deadline)
+    return eval_anagrams(gen, wordlist, count, quiet=quiet, deadline=deadline)
+
+
+def anagram_stream(text, wildcards=0, wordlist=WORDS, count=100, interval=5,
+                   time_limit=None, deadline=None):
+    """
+    Search for anagrams like `anagrams`, but yield the best results so far
+    every `interval` seconds, whenever they've changed. The last thing
+    yielded is the final result.
+
+    This is what chat commands call, so it's where searches are cached: a
+    search that finished before the deadline is kept in the wordlist's
+    result cache, and asking for it again yields the final result right away.
+
+    It also turns on the wordlist's in-memory alphagram index, which the
+    worker process that runs the command keeps for the searches after this
+    one. Other processes, such as the shards of a parallel search, look up
+    alphagrams in SQLite instead of each building their own copy.
+    """
+    if deadline is None:
+        deadline = SearchDeadline(time_limit)
+    wordlist.use_alphagram_index = True
+    key = ('anagrams', alphagram(slugify(text)), wildcards, count)
+    cached = wordlist.get_cached_result(key)
+    if cached is not None:
+        yield cached
+        return
+    gen = _anagram_generator(text, wildcards, wordlist, deadline)
+    snapshot = None
+    for snapshot in _eval_anagram_snapshots(
+        gen, wordlist, count, quiet=True, deadline=deadline, interval=interval
+    ):
+        yield snapshot
+    if not deadline.expired():
+        wordlist.cache_result(key, snapshot)
+
+
+def _anagram_generator(text, wildcards, wordlist, deadline, shard=None):
+    alpha = alphagram(slugify(text))
+    memo = LRUCache(REMAINDER_MEMO_SIZE)
+    return _anagram_recursive(alpha, wildcards, wordlist, deadline, memo, shard)
+
+
+def _anagram_parallel(kind, text, wildcards, wordlist, count, quiet, deadline,
+                      processes):
+    """
+    Run a search of the given `kind` ('double' or 'multi') as `processes`
+    shards in a pool of worker processes, and evaluate their anagrams here.
+
+    The anagrams are put back in the order that a search in one process
+    would generate them, so eval_anagrams stops at the same point and
+    returns the same results. The shards still search in their own order,
+    so the results can take longer to arrive than a search in one process
+    would take, and running more processes than there are cores only makes
+    the search slower.
+
+    When the evaluation is done, the shards are told to stop.
+    """
+    pool = _get_shard_pool(processes)
+    manager = _get_shard_manager()
+    stop = manager.Event()
+    queues = [manager.Queue(SHARD_QUEUE_BATCHES) for index in range(processes)]
+    wordlist_spec = (wordlist.name, wordlist.backend)
+    futures = [
+        pool.submit(
+            _anagram_shard, kind, text, wildcards, wordlist_spec,
+            deadline.shared(stop), (index, processes), queues[index]
+        )
+        for index in range(processes)
+    ]
+    merger = _ShardMerger([_read_shard(queue, deadline) for queue in queues])
+    if kind == 'double':
+        alpha = alphagram(slugify(text))
+        gen = _anagram_double(alpha, wildcards, wordlist, deadline, merger)
+    else:
+        gen = _anagram_generator(text, wildcards, wordlist, deadline, merger)
+    try:
+        return eval_anagrams(gen, wordlist, count, quiet=quiet, deadline=deadline)
+    finally:
+        stop.set()
+        # Raise any exception from the shards.
+        for future in futures:
+            future.result()
+
+
+def _get_shard_pool(processes):
+    """
+    Get a pool of `processes` worker processes for parallel searches. Like
+    the pools in utils/workers.py, they're started with 'spawn', so each
+    one opens its own copy of the wordlist.
+    """
+    if processes not in _shard_pools:
+        _shard_pools[processes] = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _shard_pools[processes]
+
 
+def _get_shard_manager():
+    global _shard_manager
+    if _shard_manager is None:
+        _shard_manager = multiprocessing.get_context('spawn').Manager()
+    return _shard_manager
 
-def _anagram_recursive(alpha, wildcards, wordlist):
+
+def _read_shard(queue, deadline):
+    """
+    Yield the labeled anagrams that a shard sends back, until it's
+    done. Waiting for them checks the deadline as it goes.
+    """
+    while True:
+        deadline.check()
+        try:
+            batch = queue.get(timeout=CANCEL_POLL_INTERVAL)
+        except queue_module.Empty:
+            continue
+        for item in batch:
+            if item == _END_OF_SHARD:
+                return
+            yield item
+
+
+def _anagram_shard(kind, text, wildcards, wordlist_spec, deadline, shard, queue):
+    """
+    Search one shard of a parallel search, in a worker process, sending its
+    labeled anagrams back through `queue` in batches. The `shard` is an
+    (index, count) pair saying which of `count` shards this is.
+    """
+    wordlist = _shard_wordlist(*wordlist_spec)
+    shard = _SearchShard(*shard)
+    if kind == 'double':
+        alpha = alphagram(slugify(text))
+        gen = _anagram_double(alpha, wildcards, wordlist, deadline, shard)
+    else:
+        gen = _anagram_generator(text, wildcards, wordlist, deadline, shard)
+    batch = []
+    send_time = time.monotonic() + SHARD_BATCH_INTERVAL
+    try:
+        for item in gen:
+            batch.append(item)
+            if len(batch) >= SHARD_BATCH_SIZE or time.monotonic() >= send_time:
+                _send_batch(queue, batch, deadline)
+                batch = []
+                send_time = time.monotonic() + SHARD_BATCH_INTERVAL
+    except SearchStopped:
+        pass
+    finally:
+        batch.append(_END_OF_SHARD)
+        try:
+            _send_batch(queue, batch, deadline)
+        except SearchStopped:
+            pass
+
+
+def _send_batch(queue, batch, deadline):
+    """
+    Put a batch on a shard's queue, waiting while it's full. If the search
+    stops first, nothing will read the batch, so this raises SearchStopped.
+    """
+    while True:
+        try:
+            queue.put(batch, timeout=CANCEL_POLL_INTERVAL)
+            return
+        except queue_module.Full:
+            deadline.check()
+
+
+def _shard_wordlist(name, backend):
+    """
+    Open a wordlist read-only in a worker process, the first time one of
+    its shards is searched there. It doesn't use the in-memory alphagram
+    index, which would be built again in every process.
+    """
+    key = (name, backend)
+    if key not in _shard_wordlists:
+        _shard_wordlists[key] = Wordlist(name, backend=backend, read_only=True)
+    return _shard_wordlists[key]
+
+
+def _anagram_recursive(alpha, wildcards, wordlist, deadline, memo, shard=None):
     if len(alpha) <= 10:
-        return _anagram_double(alpha, wildcards, wordlist)
+        return _anagram_double(alpha, wildcards, wordlist, deadline, shard)
     else:
-        return _anagram_recursive_2(alpha, wildcards, wordlist)
+        return _anagram_recursive_2(alpha, wildcards, wordlist, deadline, memo, shard)
 
 
-def _anagram_recursive_2(alpha, wildcards, wordlist):
+def _anagram_recursive_2(alpha, wildcards, wordlist, deadline, memo, shard=None):
     return interleave([
-        _anagram_double(alpha, wildcards, wordlist),
-        interleave(_anagram_recursive_pieces(alpha, wildcards, wordlist))
+        _anagram_double(alpha, wildcards, wordlist, deadline, shard),
+        interleave(_anagram_recursive_pieces(
+            alpha, wildcards, wordlist, deadline, memo, shard
+        ))
     ])
 
 
-def _anagram_recursive_pieces(alpha, wildcards, wordlist):
-    for ahash in subsequences(anahash(alpha), 4):
-        yield interleave(_anagram_recursive_piece_1(alpha, wildcards, wordlist, ahash))
+def _anagram_recursive_pieces(alpha, wildcards, wordlist, deadline, memo, shard=None):
+    for number, ahash in enumerate(subsequences(anahash(alpha), 4)):
+        deadline.check()
+        yield interleave(_anagram_recursive_piece_1(
+            alpha, wildcards, wordlist, ahash, deadline, memo, shard, number
+        ))
+
+
+def _anagram_recursive_piece_1(alpha, wildcards, wordlist, ahash, deadline, memo,
+                               shard=None, number=0):
+    alpha_vec = letters_to_vec(alpha)
+    subs = wordlist.find_by_anahash_letterbags(ahash)
+    if wildcards <= 0:
+        # Without wildcards to spend, most of these words won't fit, and a
+        # letterbag can rule them out in a few integer operations. The
+        # letters that remain are then just the difference of the letterbags.
+        alpha_bag = letterbag_from_vec(alpha_vec)
+        subs = [(sub, bag) for sub, bag in subs if letterbag_contains(alpha_bag, bag)]
+        sub_anas = [
+            (sub, vec_to_alphagram(letterbag_to_vec(alpha_bag - bag)), wildcards, index)
+            for index, (sub, bag) in enumerate(subs)
+        ]
+    else:
+        sub_anas = [
+            (sub, vec_to_alphagram(remaining), wildcards - wildcards_used, index)
+            for index, (sub, bag) in enumerate(subs)
+            for remaining, wildcards_used in [vec_diff(alpha_vec, letterbag_to_vec(bag))]
+            if wildcards >= wildcards_used
+        ]
+    sub_anas.sort(key=adjusted_anagram_cost)
 
+    def make_leaves(item):
+        slug1, alpha2, wildcards_remaining, index = item
+        deadline.check()
+        yield _anagram_recursive_piece_2(
+            slug1, alpha2, wildcards_remaining, wordlist, deadline, memo
+        )
+
+    yield from _each_leaf(shard, ('multi', number), sub_anas, make_leaves)
 
-def _anagram_recursive_piece_1(alpha, wildcards, wordlist, ahash):
-    sub_anas = [
-        (sub, adiff, wildcards - wildcards_used, index)
-        for index, sub in enumerate(wordlist.find_by_anahash_raw(ahash))
-        for adiff, wildcards_used in [anagram_diff(alpha, alphagram(sub))]
-        if wildcards >= wildcards_used or (wildcards < 0 and wildcards_used == 0)
-    ]
-    sub_anas.sort(key=adjusted_anagram_cost)
 
-    for slug1, alpha2, wildcards_remaining, index in sub_anas:
-        alpha1 = alphagram(slug1)
-        yield _anagram_recursive_piece_2(slug1, alpha2, wildcards_remaining, wordlist)
+def _anagram_recursive_piece_2(slug1, alpha, wildcards, wordlist, deadline, memo):
+    for pieces in _anagram_remainder(alpha, wildcards, wordlist, deadline, memo):
+        yield (slug1,) + pieces
 
 
-def _anagram_recursive_piece_2(slug1, alpha, wildcards, wordlist):
-    for slug2 in _anagram_recursive(alpha, wildcards, wordlist):
-        yield slug1 + slug2
+class _SharedCompletions:
+    """
+    The anagrams of a remaining set of letters, which many branches of the
+    'interleave' search can need: every first word that uses the same
+    letters leaves the same remainder to anagram.
+
+    The first branch to need the remainder's anagrams starts generating
+    them, and every branch reads them from the same list, which grows as
+    far as any branch has read. Only the first `max_items` are kept; a
+    branch that gets past those carries on with a search of its own.
+    """
+    def __init__(self, restart, max_items=REMAINDER_MEMO_ITEMS):
+        self.restart = restart
+        self.max_items = max_items
+        self.items = []
+        self.gen = restart()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index < len(self.items):
+                yield self.items[index]
+                index += 1
+            elif self.gen is None:
+                return
+            elif index >= self.max_items:
+                yield from itertools.islice(self.restart(), index, None)
+                return
+            else:
+                try:
+                    self.items.append(next(self.gen))
+                except StopIteration:
+                    self.gen = None
+
+
+def _anagram_remainder(alpha, wildcards, wordlist, deadline, memo):
+    """
+    Generate the anagrams of the letters left over after the first piece of
+    an anagram, sharing them with other branches that leave the same letters.
+    """
+    key = (alpha, wildcards)
+    shared = memo.get(key)
+    if shared is None:
+        shared = _SharedCompletions(
+            lambda: _anagram_recursive(alpha, wildcards, wordlist, deadline, memo)
+        )
+        memo[key] = shared
+    return iter(shared)
 
 
 def subsequences(seq, depth=None):
@@ -0,0 +1,383 @@
+"""
+Build and update `data/db/search.db`, the database of clues that
+`search.db_rank` searches.
+
+The clues come from corpus files: the Mystery Hunt answer lists in
+`data/corpora/answers`, and any CSV or TSV files of clues and answers in
+`data/corpora/clues`. Each file is a source, and the database remembers a
+hash of each source it has read, along with the range of rows it added.
+Updating the database only reads the sources that are new or have changed,
+so a large index can be refreshed without rebuilding it from scratch:
+
+    python -m hypebot.solvertools.clue_db
+"""
+import csv
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+
+from .clue_text import fts_phrase, keyword_parts, length_token, table_columns
+from ..utils.path import corpus_path, db_path, data_path
+
+
+# How FTS5 splits clue text into tokens: Unicode-aware, ignoring accents,
+# so that a clue for 'CAFE' can be found by searching for 'café'
+CLUE_TOKENIZER = 'unicode61 remove_diacritics 2'
+
+# How many clues to insert with each statement
+INSERT_BATCH_SIZE = 10000
+
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS clues USING fts5(
+        keyword, text, lengths, tokenize='%s'
+    )
+    """ % CLUE_TOKENIZER,
+    """
+    CREATE TABLE IF NOT EXISTS sources (
+        path TEXT PRIMARY KEY,
+        hash TEXT,
+        first_rowid INT,
+        last_rowid INT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS keyword_parts (
+        keyword TEXT, slug TEXT, weight REAL, length INT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS keyword_parts_keyword ON keyword_parts (keyword, length)",
+]
+
+YEAR_RE = re.compile(r'(\d{4})')
+WORD_RE = re.compile(r'[^\W_]')
+
+
+def clue_sources():
+    """
+    Find the corpus files that clues are read from.
+    """
+    paths = sorted(glob.glob(corpus_path('answers/*.txt')))
+    for extension in ('csv', 'tsv'):
+        paths.extend(sorted(glob.glob(corpus_path('clues/*.' + extension))))
+    return paths
+
+
+def file_hash(path):
+    "Get the SHA-1 hash of a file's contents, as a hex string."
+    sha = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_clues(path):
+    """
+    Iterate the (keyword, text) pairs of a source file.
+
+    A .txt file is a list of Mystery Hunt answers, one per line, followed
+    by a comma and the type of puzzle. Its clue text says which Hunt and
+    which type of puzzle the answer is from.
+
+    A .csv or .tsv file has a clue and its answer on each line. If the
+    first line is a header with columns named 'clue' and 'answer' (or
+    'keyword'), those columns are used; otherwise the answer comes first
+    and the clue second.
+    """
+    if path.endswith('.txt'):
+        yield from _read_answer_list(path)
+    else:
+        yield from _read_clue_table(path, '\t' if path.endswith('.tsv') else ',')
+
+
+def _read_answer_list(path):
+    match = YEAR_RE.search(os.path.basename(path))
+    hunt = 'Mystery Hunt %s' % match.group(1) if match else 'Mystery Hunt'
+    with open(path, encoding='utf-8') as infile:
+        for line in infile:
+            if ',' not in line:
+                continue
+            answer, kind = line.rstrip().rsplit(',', 1)
+            answer = answer.strip()
+            if answer:
+                yield answer, '%s %s answer' % (hunt, kind.strip())
+
+
+def _read_clue_table(path, delimiter):
+    with open(path, encoding='utf-8', newline='') as infile:
+        reader = csv.reader(infile, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [column.strip().lower() for column in header]
+        answer_column = None
+        for name in ('answer', 'keyword'):
+            if name in columns:
+                answer_column = columns.index(name)
+        if 'clue' in columns and answer_column is not None:
+            clue_column = columns.index('clue')
+        else:
+            answer_column, clue_column = 0, 1
+            reader = _prepend(header, reader)
+        for row in reader:
+            if len(row) > max(answer_column, clue_column):
+                answer = row[answer_column].strip()
+                clue = row[clue_column].strip()
+                if answer and clue:
+                    yield answer, clue
+
+
+def _prepend(item, iterator):
+    yield item
+    yield from iterator
+
+
+def get_db(path=None):
+    """
+    Open the clue database for writing, creating its tables if they don't
+    exist.
+    """
+    if path is None:
+        path = db_path('search.db')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    # A clues table from before it had a `lengths` column is copied into a
+    # new one that has it, and a keyword_parts table from before it had a
+    # `length` column is built again from the clues.
+    clue_columns = table_columns(db, 'clues')
+    clues_outdated = bool(clue_columns) and 'lengths' not in clue_columns
+    part_columns = table_columns(db, 'keyword_parts')
+    parts_outdated = bool(clue_columns) and 'length' not in part_columns
+    with db:
+        if clues_outdated:
+            db.execute("ALTER TABLE clues RENAME TO old_clues")
+        if parts_outdated:
+            db.execute("DROP TABLE IF EXISTS keyword_parts")
+        for statement in SCHEMA:
+            db.execute(statement)
+        if clues_outdated:
+            _copy_clues(db, 'old_clues')
+            db.execute("DROP TABLE old_clues")
+        if parts_outdated:
+            build_keyword_parts(db)
+    return db
+
+
+def _copy_clues(db, table):
+    """
+    Copy the clues from an older table, which has no `lengths` column, into
+    the `clues` table, keeping their rowids so that the ranges of rows in
+    `sources` still point at them.
+    """
+    print("Adding lengths to clues")
+    lengths_by_keyword = {}
+    batch = []
+    for rowid, keyword, text in db.execute(
+        "SELECT rowid, keyword, text FROM %s ORDER BY rowid" % table
+    ):
+        if keyword not in lengths_by_keyword:
+            lengths_by_keyword[keyword] = keyword_lengths(keyword)
+        batch.append((rowid, keyword, text, lengths_by_keyword[keyword]))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            _insert_batch(db, batch)
+            batch = []
+            print("\t%s" % keyword)
+    _insert_batch(db, batch)
+
+
+def update_search_db(paths=None, db=None, rebuild=False, optimize=True):
+    """
+    Add the clues from new or changed source files to the clue database.
+
+    A source whose hash hasn't changed is skipped. A source that has
+    changed has its old clues deleted and is read again, and the keyword
+    parts of keywords that no clue has anymore are deleted too. Sources
+    that have gone away are left in the database, so they can be kept
+    there after the original files are deleted. With `rebuild`, the tables are made
+    again from scratch and every source is read again.
+
+    Each source is added in one transaction, so an interrupted update
+    leaves each source either completely added or not added at all. At
+    the end, the full-text index is optimized, merging the pieces that the
+    inserts left it in.
+
+    A database whose clues weren't added by this module doesn't know which
+    sources they came from, so it's rebuilt.
+    """
+    if paths is None:
+        paths = clue_sources()
+    if db is None:
+        db = get_db()
+    if not rebuild and _has_untracked_clues(db):
+        print("The clues in this database have no sources, so it's being rebuilt")
+        rebuild = True
+    if rebuild:
+        # Start with new tables, in case the schema has changed.
+        with db:
+            for table in ('clues', 'sources', 'keyword_parts'):
+                db.execute("DROP TABLE IF EXISTS %s" % table)
+            for statement in SCHEMA:
+                db.execute(statement)
+
+    changed = False
+    for path in paths:
+        name = os.path.relpath(path, data_path(''))
+        digest = file_hash(path)
+        found = db.execute(
+            "SELECT hash, first_rowid, last_rowid FROM sources WHERE path=?",
+            (name,)
+        ).fetchone()
+        if found is not None and found[0] == digest:
+            continue
+        print("Reading %s" % name)
+        with db:
+            old_keywords = []
+            if found is not None:
+                old_keywords = [row[0] for row in db.execute(
+                    "SELECT DISTINCT keyword FROM clues WHERE rowid BETWEEN ? AND ?",
+                    (found[1], found[2])
+                )]
+                db.execute(
+                    "DELETE FROM clues WHERE rowid BETWEEN ? AND ?",
+                    (found[1], found[2])
+                )
+            first_rowid, last_rowid = _insert_clues(db, read_clues(path))
+            _delete_unused_keyword_parts(db, old_keywords)
+            db.execute(
+                "INSERT OR REPLACE INTO sources (path, hash, first_rowid, last_rowid) "
+                "VALUES (?, ?, ?, ?)",
+                (name, digest, first_rowid, last_rowid)
+            )
+        print("\tAdded %d clues" % (last_rowid - first_rowid + 1))
+        changed = True
+
+    if changed and optimize:
+        print("Optimizing")
+        with db:
+            db.execute("INSERT INTO clues (clues) VALUES ('optimize')")
+    return db
+
+
+def _has_untracked_clues(db):
+    "Does the database have clues, but no record of where they came from?"
+    has_clues = db.execute("SELECT 1 FROM clues LIMIT 1").fetchone() is not None
+    has_sources = db.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is not None
+    return has_clues and not has_sources
+
+
+def _insert_clues(db, clues):
+    """
+    Insert clues in batches, with consecutive rowids after the existing
+    ones, and add the keyword parts of any new keywords. Returns the first
+    and last rowids that were used.
+
+    Each clue's `lengths` column lists the lengths of its keyword's parts,
+    as tokens that a search for answers of a particular length can match.
+    """
+    last = db.execute("SELECT rowid FROM clues ORDER BY rowid DESC LIMIT 1").fetchone()
+    first_rowid = 1 if last is None else last[0] + 1
+    rowid = first_rowid
+    lengths_by_keyword = {}
+    batch = []
+    for keyword, text in clues:
+        if keyword not in lengths_by_keyword:
+            lengths_by_keyword[keyword] = keyword_lengths(keyword)
+        batch.append((rowid, keyword, text, lengths_by_keyword[keyword]))
+        rowid += 1
+        if len(batch) >= INSERT_BATCH_SIZE:
+            _insert_batch(db, batch)
+            batch = []
+            print("\t%s" % keyword)
+    _insert_batch(db, batch)
+    keywords = set(lengths_by_keyword)
+
+    known = set()
+    for keyword in keywords:
+        if db.execute(
+            "SELECT 1 FROM keyword_parts WHERE keyword=? LIMIT 1", (keyword,)
+        ).fetchone() is not None:
+            known.add(keyword)
+    add_keyword_parts(db, sorted(keywords - known))
+    return first_rowid, rowid - 1
+
+
+def keyword_lengths(keyword):
+    """
+    Get the `lengths` column of the clues for a keyword: the tokens for the
+    lengths of its parts.
+    """
+    lengths = sorted({len(slug) for slug in keyword_parts(keyword)})
+    return ' '.join(length_token(length) for length in lengths)
+
+
+def _delete_unused_keyword_parts(db, keywords):
+    """
+    Delete the keyword parts of any of these keywords that no clue has
+    anymore. Each keyword is looked up in the full-text index of the
+    `keyword` column, and the matches are checked for the exact keyword.
+    """
+    unused = []
+    for keyword in keywords:
+        if WORD_RE.search(keyword):
+            rows = db.execute(
+                "SELECT keyword FROM clues WHERE clues MATCH ?",
+                ('keyword : %s' % fts_phrase(keyword),)
+            )
+            used = any(row[0] == keyword for row in rows)
+        else:
+            # A keyword with no tokens can't be found in the index.
+            used = db.execute(
+                "SELECT 1 FROM clues WHERE keyword=? LIMIT 1", (keyword,)
+            ).fetchone() is not None
+        if not used:
+            unused.append((keyword,))
+    db.executemany("DELETE FROM keyword_parts WHERE keyword=?", unused)
+    if unused:
+        print("\tDeleted the parts of %d unused keywords" % len(unused))
+
+
+def build_keyword_parts(db):
+    """
+    Tokenize every keyword in the `clues` table once, storing the results
+    in the `keyword_parts` table, so that ranking clues doesn't have to.
+    """
+    print("Building keyword parts")
+    keywords = [row[0] for row in db.execute("SELECT DISTINCT keyword FROM clues")]
+    add_keyword_parts(db, keywords)
+
+
+def add_keyword_parts(db, keywords):
+    "Add the parts of some new keywords to the `keyword_parts` table."
+    for i, keyword in enumerate(keywords):
+        db.executemany(
+            "INSERT INTO keyword_parts (keyword, slug, weight, length) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (keyword, slug, weight, len(slug))
+                for slug, weight in keyword_parts(keyword).items()
+            ]
+        )
+        if i % 10000 == 0:
+            print("\t%s" % keyword)
+
+
+def _insert_batch(db, batch):
+    db.executemany(
+        "INSERT INTO clues (rowid, keyword, text, lengths) VALUES (?, ?, ?, ?)",
+        batch
+    )
+
+
+def build_search_db():
+    """
+    Build the clue database from all the sources, from scratch.
+    """
+    update_search_db(rebuild=True)
+
+
+if __name__ == '__main__':
+    update_search_db()
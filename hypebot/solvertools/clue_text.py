@@ -0,0 +1,43 @@
+"""
+How the clue database stores clues and keywords, shared by `clue_db.py`,
+which builds it, and `search.py`, which searches it.
+
+This module is kept light: building the database shouldn't have to load
+the wordlist or the word vectors that searching uses.
+"""
+from collections import Counter
+
+from wordfreq import tokenize
+
+from ..utils.normalize import slugify
+
+
+def table_columns(db, table):
+    "Get the names of the columns of a table, or [] if it doesn't exist."
+    return [row[1] for row in db.execute("PRAGMA table_info(%s)" % table)]
+
+
+def length_token(length):
+    """
+    The token in the `lengths` column of a clue that says one of its
+    keyword's parts has this length.
+    """
+    return 'len%d' % length
+
+
+def keyword_parts(keyword):
+    """
+    Get the slugs that a keyword gives credit to, with their weights, as a
+    dictionary: the whole keyword gets a weight of 1, and its tokens split
+    another 1 between them.
+    """
+    parts = Counter({slugify(keyword): 1.})
+    tokens = tokenize(keyword, 'en')
+    for token in tokens:
+        parts[slugify(token)] += 1. / len(tokens)
+    return parts
+
+
+def fts_phrase(word):
+    "Quote a word so that FTS5 matches it literally."
+    return '"%s"' % word.replace('"', '""')
@@ -1,5 +1,26 @@
+"""
+Word vectors from ConceptNet Numberbatch, for finding related terms.
+
+The vectors are kept in a VectorStore, which memory-maps the matrix
+instead of reading it all in, so loading it is quick and every process that
+uses it shares the same pages. The matrix can also be stored quantized, as
+float16, or as int8 with a scale for each row, which makes it a half or a
+quarter of the size.
+
+Similar terms are found by cosine similarity, which is just a dot product
+when the vectors have been normalized to unit length. A normalized copy of
+the matrix is written once, offline, with
+`write_numberbatch(normalized=True)`, so that it can be memory-mapped like
+the original.
+
+Comparing a vector against every row takes a few milliseconds. A
+VectorIndex, built offline with `write_vector_index`, clusters the rows
+with k-means, so that a search only has to compare against the rows in the
+few clusters nearest to it:
+
+    python -m hypebot.solvertools.conceptnet_numberbatch
+"""
 import re
-import pandas as pd
 import numpy as np
 from ..utils.normalize import alphanumeric
 from ..utils.path import data_path
@@ -8,6 +29,21 @@ from ..utils.path import data_path
 DOUBLE_DIGIT_RE = re.compile(r'[0-9][0-9]')
 DIGIT_RE = re.compile(r'[0-9]')
 
+# How many rows of the matrix to convert to float32 at a time, when it's
+# stored quantized
+CHUNK_ROWS = 16384
+
+# The ways the matrix can be stored besides float32
+QUANTIZATIONS = ('float16', 'int8')
+
+# How many clusters of the vector index a search looks in
+INDEX_PROBES = 8
+
+# How many rows k-means clustering is trained on, and for how many
+# iterations, when building the vector index
+INDEX_SAMPLE_SIZE = 50000
+INDEX_ITERATIONS = 10
+
 
 def replace_numbers(s):
     """
@@ -22,39 +58,327 @@ def replace_numbers(s):
         return s
 
 
-def load_labels_and_npy(label_file, npy_file):
-    labels = [line.rstrip('\n') for line in open(label_file, encoding='utf-8')]
-    npy = np.load(npy_file)
-    return pd.DataFrame(npy, index=labels)
+class VectorStore:
+    """
+    A matrix with a vector for each of a list of labels.
+
+    The matrix is usually a read-only memory map. If it's quantized as
+    int8, `scales` has the number to multiply each row by to get its
+    values back. Vectors always come out as float32, whatever the matrix
+    is stored as. `normalized` says whether the vectors all have unit
+    length.
+    """
+    def __init__(self, labels, matrix, scales=None, normalized=False):
+        if len(labels) != matrix.shape[0]:
+            raise ValueError(
+                "There are %d labels for %d vectors" % (len(labels), matrix.shape[0])
+            )
+        self.labels = labels
+        self.index = {label: row for (row, label) in enumerate(labels)}
+        self.matrix = matrix
+        self.scales = scales
+        self.normalized = normalized
+
+    @classmethod
+    def load(cls, label_file, npy_file, scales_file=None, normalized=False):
+        """
+        Load the labels from a text file with one label per line, and
+        memory-map the matrix (and its scales, if it has them) from .npy
+        files.
+        """
+        with open(label_file, encoding='utf-8') as infile:
+            labels = [line.rstrip('\n') for line in infile]
+        matrix = np.load(npy_file, mmap_mode='r')
+        scales = None
+        if scales_file is not None:
+            scales = np.load(scales_file, mmap_mode='r')
+        return cls(labels, matrix, scales, normalized)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    @property
+    def dimensions(self):
+        return self.matrix.shape[1]
+
+    def vector(self, label):
+        """
+        Get the vector for a label, or None if it isn't in the store.
+        """
+        row = self.index.get(label)
+        if row is None:
+            return None
+        return self.rows(row, row + 1)[0]
+
+    def rows(self, start, stop):
+        "Get a range of rows of the matrix, as float32."
+        rows = np.asarray(self.matrix[start:stop], dtype='f')
+        if self.scales is not None:
+            rows = rows * self.scales[start:stop, np.newaxis]
+        return rows
+
+    def take(self, row_numbers):
+        """
+        Get the rows with the given numbers, as float32. They're read most
+        quickly from a memory map if the numbers are in increasing order.
+        """
+        rows = np.asarray(self.matrix[row_numbers], dtype='f')
+        if self.scales is not None:
+            rows = rows * self.scales[row_numbers, np.newaxis]
+        return rows
+
+    def dot(self, vecs):
+        """
+        Get the dot product of every row with a vector, or with each row
+        of a matrix of vectors. The result has a row for each row of the
+        store, and a column for each vector.
+        """
+        vecs = np.asarray(vecs, dtype='f')
+        if self.matrix.dtype == np.float32 and self.scales is None:
+            return np.asarray(self.matrix.dot(vecs.T))
+        result = np.empty((len(self),) + vecs.shape[:-1], dtype='f')
+        for start in range(0, len(self), CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, len(self))
+            result[start:stop] = self.rows(start, stop).dot(vecs.T)
+        return result
 
 
-def load_numberbatch():
-    return load_labels_and_npy(data_path('vectors/english.labels.txt'), data_path('vectors/english.npy'))
+class VectorIndex:
+    """
+    An approximate nearest-neighbor index of the rows of a normalized
+    VectorStore, which splits them into clusters that can be searched
+    separately (an "inverted file" index).
+
+    `centroids` has the normalized center of each cluster. `row_numbers`
+    lists the rows of the store, grouped by cluster, with the rows of
+    cluster `i` at `row_numbers[offsets[i]:offsets[i + 1]]`. `vectors` has
+    the vectors of those rows in the same order, as float32, so that each
+    cluster's vectors can be read all in one piece.
+    """
+    def __init__(self, centroids, row_numbers, offsets, vectors):
+        if len(offsets) != len(centroids) + 1:
+            raise ValueError(
+                "There are %d offsets for %d clusters" % (len(offsets), len(centroids))
+            )
+        self.centroids = centroids
+        self.row_numbers = row_numbers
+        self.offsets = offsets
+        self.vectors = vectors
+
+    @classmethod
+    def load(cls, arrays_file, vectors_file):
+        """
+        Load an index that was saved with `save`, memory-mapping its
+        vectors.
+        """
+        with np.load(arrays_file) as arrays:
+            centroids = arrays['centroids']
+            row_numbers = arrays['row_numbers']
+            offsets = arrays['offsets']
+        return cls(centroids, row_numbers, offsets, np.load(vectors_file, mmap_mode='r'))
+
+    def save(self, arrays_file, vectors_file):
+        np.savez(
+            arrays_file, centroids=self.centroids, row_numbers=self.row_numbers,
+            offsets=self.offsets
+        )
+        np.save(vectors_file, self.vectors)
 
+    def __len__(self):
+        return len(self.centroids)
 
-def get_vector(frame, label):
+    def similarity(self, vecs, probes=INDEX_PROBES):
+        """
+        Compare a matrix of vectors with the rows in the `probes` clusters
+        nearest to each of them. Returns the numbers of the rows that were
+        compared, and their dot products with each vector, with a row for
+        each row and a column for each vector.
+        """
+        vecs = np.asarray(vecs, dtype='f')
+        probes = min(probes, len(self))
+        nearest = np.argpartition(-self.centroids.dot(vecs.T), probes - 1, axis=0)[:probes]
+        clusters = np.unique(nearest)
+        starts = self.offsets[clusters]
+        stops = self.offsets[clusters + 1]
+        row_numbers = np.concatenate([
+            self.row_numbers[start:stop] for (start, stop) in zip(starts, stops)
+        ])
+        similarity = np.concatenate([
+            np.asarray(self.vectors[start:stop]).dot(vecs.T)
+            for (start, stop) in zip(starts, stops)
+        ])
+        return row_numbers, similarity
+
+
+def build_vector_index(store, clusters=None, iterations=INDEX_ITERATIONS,
+                       sample_size=INDEX_SAMPLE_SIZE, seed=0):
     """
-    Returns the row of a vector-space DataFrame `frame` corresponding
-    to the text `label`.
+    Cluster the rows of a VectorStore by their direction, with k-means on a
+    sample of the rows, and make a VectorIndex of the clusters. There are
+    about as many clusters as the square root of the number of rows, unless
+    `clusters` says otherwise.
     """
-    label = alphanumeric(label)
-    try:
-        return frame.loc[label]
-    except KeyError:
-        # Return a vector of all NaNs
-        return pd.Series(index=frame.columns)
+    if not store.normalized:
+        raise ValueError("The vector index has to be built from normalized vectors")
+    if clusters is None:
+        clusters = int(round(len(store) ** .5))
+    clusters = max(1, min(clusters, len(store)))
+    rng = np.random.RandomState(seed)
+    sample_size = max(clusters, min(sample_size, len(store)))
+    sample = store.take(np.sort(rng.choice(len(store), sample_size, replace=False)))
+    centroids = sample[rng.choice(sample_size, clusters, replace=False)]
+    for iteration in range(iterations):
+        print("\tIteration %d of %d" % (iteration + 1, iterations))
+        assignments = _nearest_centroids(sample, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums
+        # Start each empty cluster again from a random row.
+        centroids[~nonempty] = sample[rng.choice(sample_size, (~nonempty).sum())]
+        norms = np.sqrt(np.einsum('ij,ij->i', centroids, centroids))
+        norms[norms == 0] = 1
+        centroids /= norms[:, np.newaxis]
+
+    print("\tAssigning rows to clusters")
+    assignments = np.empty(len(store), dtype=np.int32)
+    for start in range(0, len(store), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(store))
+        assignments[start:stop] = _nearest_centroids(store.rows(start, stop), centroids)
+    row_numbers = np.argsort(assignments, kind='stable').astype(np.int32)
+    offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(assignments, minlength=clusters))]
+    ).astype(np.int64)
+    vectors = np.empty((len(store), store.dimensions), dtype='f')
+    for start in range(0, len(store), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(store))
+        vectors[start:stop] = store.take(row_numbers[start:stop])
+    return VectorIndex(centroids, row_numbers, offsets, vectors)
+
+
+def _nearest_centroids(rows, centroids):
+    return np.argmax(rows.dot(centroids.T), axis=1).astype(np.int32)
+
+
+def numberbatch_paths(quantization=None, normalized=False):
+    """
+    Get the paths of the Numberbatch labels, matrix, and scales (or None),
+    for a matrix stored with the given `quantization`, and normalized or
+    not.
+    """
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError("Unknown quantization: %r" % quantization)
+    name = 'english'
+    if normalized:
+        name += '.normalized'
+    if quantization is not None:
+        name += '.' + quantization
+    scales = None
+    if quantization == 'int8':
+        scales = data_path('vectors/%s.scales.npy' % name)
+    return (
+        data_path('vectors/english.labels.txt'), data_path('vectors/%s.npy' % name),
+        scales
+    )
+
+
+def vector_index_paths():
+    """
+    Get the paths of the arrays and the vectors of the vector index that
+    `write_vector_index` writes.
+    """
+    return data_path('vectors/english.index.npz'), data_path('vectors/english.index.npy')
+
+
+def load_numberbatch(quantization=None, normalized=False):
+    """
+    Open the Numberbatch vectors as a VectorStore. With a `quantization`,
+    open the quantized matrix that `write_numberbatch` wrote.
+
+    With `normalized`, open the normalized matrix that
+    `write_numberbatch(normalized=True)` wrote.
+    """
+    label_file, npy_file, scales_file = numberbatch_paths(quantization, normalized)
+    return VectorStore.load(label_file, npy_file, scales_file, normalized)
+
+
+def load_vector_index():
+    "Load the vector index that `write_vector_index` wrote."
+    return VectorIndex.load(*vector_index_paths())
+
+
+def write_numberbatch(quantization=None, normalized=False):
+    """
+    Write a copy of the Numberbatch matrix, quantized and/or normalized,
+    which can then be loaded with `load_numberbatch(quantization,
+    normalized)`.
+
+    'float16' halves the size of the matrix. 'int8' quarters it, storing
+    each row as integers from -127 to 127 along with the scale that turns
+    them back into its values.
+    """
+    if quantization is None and not normalized:
+        raise ValueError("The original matrix is already float32 and unnormalized")
+    label_file, npy_file, scales_file = numberbatch_paths(quantization, normalized)
+    source = load_numberbatch()
+    shape = (len(source), source.dimensions)
+    dtype = np.float32 if quantization is None else np.dtype(quantization)
+    matrix = np.lib.format.open_memmap(npy_file, mode='w+', dtype=dtype, shape=shape)
+    scales = None
+    if quantization == 'int8':
+        scales = np.empty(shape[0], dtype='f')
+    for start in range(0, shape[0], CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, shape[0])
+        rows = source.rows(start, stop)
+        if normalized:
+            norms = np.sqrt(np.einsum('ij,ij->i', rows, rows))
+            norms[norms == 0] = 1
+            rows = rows / norms[:, np.newaxis]
+        if quantization == 'int8':
+            row_scales = np.abs(rows).max(axis=1) / 127
+            row_scales[row_scales == 0] = 1
+            matrix[start:stop] = np.round(rows / row_scales[:, np.newaxis])
+            scales[start:stop] = row_scales
+        else:
+            matrix[start:stop] = rows
+    matrix.flush()
+    del matrix
+    if scales is not None:
+        np.save(scales_file, scales)
+
+
+def write_vector_index(clusters=None):
+    """
+    Build a VectorIndex of the Numberbatch vectors, and save it where
+    `load_vector_index` will find it.
+    """
+    print("Building the vector index")
+    index = build_vector_index(load_numberbatch(normalized=True), clusters)
+    index.save(*vector_index_paths())
+
+
+def get_vector(store, label):
+    """
+    Returns the vector in a VectorStore corresponding to the text `label`,
+    or a vector of zeros if there isn't one.
+    """
+    vec = store.vector(alphanumeric(label))
+    if vec is None:
+        return np.zeros(store.dimensions, dtype='f')
+    return vec
 
 
 def normalize_vec(vec):
     """
-    L2-normalize a single vector, as a 1-D ndarray or a Series.
+    L2-normalize a single vector.
     """
-    if isinstance(vec, pd.Series):
-        vals = vec.values
-    else:
-        vals = vec
-    vec = vec.astype('f')
-    norm = vals.dot(vals) ** .5
+    vec = np.asarray(vec, dtype='f')
+    norm = vec.dot(vec) ** .5
     return vec / (norm + 1e-6)
 
 
@@ -67,32 +391,93 @@ def cosine_similarity(vec1, vec2):
     return normalize_vec(vec1).dot(normalize_vec(vec2))
 
 
-def similar_to_term(frame, term, limit=50):
-    vec = get_vector(frame, term)
-    most_similar = similar_to_vec(frame, vec, limit)
-    if len(most_similar):
-        max_val = most_similar.iloc[0]
-        most_similar /= max_val
-    return most_similar ** 3
+def similar_to_term(store, term, limit=50, index=None):
+    """
+    Find the labels most similar to a term, as a list of (label, similarity)
+    pairs, best first. The similarities are scaled so that the best is 1,
+    and then cubed, so that they fall off quickly.
+
+    In a normalized store, they're scaled cosine similarities. Otherwise
+    they're scaled dot products.
+    """
+    return similar_to_terms(store, [term], limit, index)[0]
+
+
+def similar_to_terms(store, terms, limit=50, index=None):
+    """
+    Find the labels most similar to each of a list of terms, like
+    `similar_to_term`, comparing them all against the store at once.
+    """
+    vecs = np.array([get_vector(store, term) for term in terms], dtype='f')
+    results = []
+    for most_similar in similar_to_vecs(store, vecs, limit, index):
+        if most_similar:
+            max_val = most_similar[0][1]
+            most_similar = [(label, sim / max_val) for (label, sim) in most_similar]
+        results.append([(label, sim ** 3) for (label, sim) in most_similar])
+    return results
+
+
+def similar_to_vec(store, vec, limit=50, index=None):
+    """
+    Find the `limit` labels whose vectors have the largest dot products
+    with `vec`, as a list of (label, dot product) pairs, best first.
 
+    With a VectorIndex of the store, `vec` is only compared with the
+    normalized rows in the clusters nearest to it, which is much faster
+    but might miss some.
+    """
+    return similar_to_vecs(store, [vec], limit, index)[0]
 
-def similar_to_vec(frame, vec, limit=50):
-    sqnorm = vec.dot(vec)
-    if sqnorm == 0.:
-        return pd.Series(data=[], index=[], dtype='f')
-    similarity = frame.dot(vec.astype('f'))
-    return similarity.dropna().nlargest(limit)
+
+def similar_to_vecs(store, vecs, limit=50, index=None):
+    """
+    Find the labels with the largest dot products with each of a list of
+    vectors, like `similar_to_vec`, with one matrix product for all of
+    them.
+    """
+    vecs = np.array(vecs, dtype='f').reshape(-1, store.dimensions)
+    sqnorms = np.einsum('ij,ij->i', vecs, vecs)
+    usable = (sqnorms != 0.) & ~np.isnan(sqnorms)
+    results = [[] for vec in vecs]
+    if not usable.any():
+        return results
+    if index is None:
+        row_numbers = None
+        similarity = store.dot(vecs[usable])
+    else:
+        row_numbers, similarity = index.similarity(vecs[usable])
+    limit = min(limit, similarity.shape[0])
+    if limit <= 0:
+        return results
+    top = np.argpartition(-similarity, limit - 1, axis=0)[:limit]
+    for column, i in enumerate(np.flatnonzero(usable)):
+        scores = similarity[top[:, column], column]
+        order = top[np.argsort(-scores, kind='stable'), column]
+        rows = order if row_numbers is None else row_numbers[order]
+        results[i] = [
+            (store.labels[row], float(similarity[pos, column]))
+            for (row, pos) in zip(rows, order)
+        ]
+    return results
 
 
-def weighted_average(frame, weight_series):
-    if isinstance(weight_series, list):
-        weight_dict = dict(weight_series)
-        weight_series = pd.Series(weight_dict)
-    vec = np.zeros(frame.shape[1], dtype='f')
+def weighted_average(store, weights):
+    """
+    Add up the vectors for some labels, each multiplied by its weight, from
+    a dictionary or a list of (label, weight) pairs. Labels that aren't in
+    the store are skipped.
+    """
+    if isinstance(weights, dict):
+        weights = weights.items()
+    vec = np.zeros(store.dimensions, dtype='f')
+    for label, weight in weights:
+        label_vec = store.vector(label)
+        if label_vec is not None:
+            vec += weight * label_vec
+    return vec
 
-    for label in weight_series.index:
-        if label in frame.index:
-            val = weight_series.loc[label]
-            vec += val * frame.loc[label].values
 
-    return pd.Series(data=vec, index=frame.columns, dtype='f')
+if __name__ == '__main__':
+    write_numberbatch(normalized=True)
+    write_vector_index()
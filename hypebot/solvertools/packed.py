@@ -0,0 +1,238 @@
+"""
+A read-only, memory-mapped form of a wordlist's `words` table.
+
+The file contains the slugs in sorted order, front-coded in blocks: the first
+slug of each block is stored in full, and each following slug is stored as
+the length of the prefix it shares with the previous slug plus the rest of
+its letters. Parallel arrays give each slug's frequency and the offset of its
+text. Looking up a slug is a binary search over the first slugs of the
+blocks, followed by decoding a single block.
+
+Because the file is memory-mapped, it costs no memory of its own beyond the
+operating system's page cache, and that page cache is shared by every process
+that opens the same file.
+
+The layout is (all integers little-endian):
+
+    header        MAGIC, then the fields of HEADER_FORMAT
+    block index   uint32 offset of each block
+    freqs         uint64 frequency of each slug
+    text offsets  uint32 start of each text, plus a final end offset
+    blocks        for the first slug of a block: uint16 length, letters;
+                  for the others: uint16 shared prefix length,
+                  uint16 suffix length, suffix letters
+    texts         the UTF-8 texts, concatenated
+"""
+import mmap
+import struct
+from bisect import bisect_right
+
+
+MAGIC = b'HBWORDS\x00'
+VERSION = 1
+# version, word count, block size, block count, and the offsets of the
+# block index, freqs, text offsets, blocks, and texts sections
+HEADER_FORMAT = '<IIII5Q'
+BLOCK_SIZE = 16
+
+LENGTH = struct.Struct('<H')
+PREFIX_AND_LENGTH = struct.Struct('<HH')
+
+
+class PackedWordTable:
+    def __init__(self, path):
+        """
+        Open a packed word table that was written by `write_packed_table`.
+        """
+        with open(path, 'rb') as openfile:
+            self.mm = mmap.mmap(openfile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a packed word table" % path)
+        header = struct.unpack_from(HEADER_FORMAT, self.mm, len(MAGIC))
+        (version, self.num_words, self.block_size, self.num_blocks,
+         index_offset, freqs_offset, text_offsets_offset, blocks_offset,
+         texts_offset) = header
+        if version != VERSION:
+            raise ValueError(
+                "%s has version %d of the packed format, but we can only "
+                "read version %d" % (path, version, VERSION)
+            )
+        view = memoryview(self.mm)
+        self._block_index = view[index_offset:freqs_offset].cast('I')
+        self._freqs = view[freqs_offset:text_offsets_offset].cast('Q')
+        self._text_offsets = view[text_offsets_offset:blocks_offset].cast('I')
+        self._texts_offset = texts_offset
+        self._heads = None
+
+    def __len__(self):
+        return self.num_words
+
+    def _block_head(self, block):
+        pos = self._block_index[block]
+        length, = LENGTH.unpack_from(self.mm, pos)
+        pos += LENGTH.size
+        return self.mm[pos:pos + length]
+
+    def _find_block(self, key):
+        """
+        Find the last block whose first slug is less than or equal to `key`,
+        or -1 if `key` sorts before every slug.
+        """
+        if self._heads is None:
+            # Keep just the first slug of each block in memory, so the
+            # binary search can run in C.
+            self._heads = [self._block_head(block) for block in range(self.num_blocks)]
+        return bisect_right(self._heads, key) - 1
+
+    def _iter_block(self, block):
+        """
+        Decode the slugs in a block, yielding each one (as bytes) with its
+        index in the table.
+        """
+        mm = self.mm
+        pos = self._block_index[block]
+        first = block * self.block_size
+        last = min(first + self.block_size, self.num_words)
+        length, = LENGTH.unpack_from(mm, pos)
+        pos += LENGTH.size
+        slug = mm[pos:pos + length]
+        pos += length
+        yield first, slug
+        for index in range(first + 1, last):
+            prefix_length, length = PREFIX_AND_LENGTH.unpack_from(mm, pos)
+            pos += PREFIX_AND_LENGTH.size
+            slug = slug[:prefix_length] + mm[pos:pos + length]
+            pos += length
+            yield index, slug
+
+    def _text(self, index):
+        start = self._texts_offset + self._text_offsets[index]
+        end = self._texts_offset + self._text_offsets[index + 1]
+        return self.mm[start:end].decode('utf-8')
+
+    def lookup(self, slug):
+        """
+        Find a slug in the table, returning its frequency and text, or None
+        if it isn't there. This is a drop-in replacement for querying the
+        `words` table.
+        """
+        key = slug.encode('ascii')
+        block = self._find_block(key)
+        if block < 0:
+            return None
+        if self._heads[block] == key:
+            index = block * self.block_size
+            return self._freqs[index], self._text(index)
+
+        # Walk through the rest of the block. Because of the front coding,
+        # we only need to compare the suffix of each slug, and only when it
+        # shares exactly as much of a prefix with the previous slug as the
+        # key does.
+        mm = self.mm
+        head = self._heads[block]
+        shared = _shared_prefix_length(head, key)
+        pos = self._block_index[block] + LENGTH.size + len(head)
+        first = block * self.block_size
+        last = min(first + self.block_size, self.num_words)
+        for index in range(first + 1, last):
+            prefix_length, length = PREFIX_AND_LENGTH.unpack_from(mm, pos)
+            pos += PREFIX_AND_LENGTH.size
+            if prefix_length < shared:
+                # This slug diverges from the key earlier than the previous
+                # one did, so it's past the key.
+                return None
+            elif prefix_length == shared:
+                suffix = mm[pos:pos + length]
+                rest = key[shared:]
+                if suffix == rest:
+                    return self._freqs[index], self._text(index)
+                elif suffix > rest:
+                    return None
+                shared += _shared_prefix_length(suffix, rest)
+            pos += length
+        return None
+
+    def iter_slugs(self):
+        """
+        Iterate over all the slugs in the table, in sorted order.
+        """
+        for block in range(self.num_blocks):
+            for index, slug in self._iter_block(block):
+                yield slug.decode('ascii')
+
+
+def _shared_prefix_length(a, b):
+    limit = min(len(a), len(b))
+    length = 0
+    while length < limit and a[length] == b[length]:
+        length += 1
+    return length
+
+
+def _align(out, alignment=8):
+    padding = -out.tell() % alignment
+    out.write(b'\x00' * padding)
+    return out.tell()
+
+
+def write_packed_table(path, rows, block_size=BLOCK_SIZE):
+    """
+    Write a packed word table, given an iterable of (slug, freq, text) rows.
+    The rows will be sorted by slug.
+    """
+    rows = sorted(
+        (slug.encode('ascii'), freq, text.encode('utf-8'))
+        for slug, freq, text in rows
+    )
+    num_words = len(rows)
+    num_blocks = (num_words + block_size - 1) // block_size
+
+    blocks = bytearray()
+    block_index = []
+    prev = b''
+    for index, (slug, freq, text) in enumerate(rows):
+        if index % block_size == 0:
+            block_index.append(len(blocks))
+            blocks += LENGTH.pack(len(slug))
+            blocks += slug
+        else:
+            shared = _shared_prefix_length(prev, slug)
+            suffix = slug[shared:]
+            blocks += PREFIX_AND_LENGTH.pack(shared, len(suffix))
+            blocks += suffix
+        prev = slug
+
+    text_offsets = [0]
+    for slug, freq, text in rows:
+        text_offsets.append(text_offsets[-1] + len(text))
+
+    header_size = len(MAGIC) + struct.calcsize(HEADER_FORMAT)
+    with open(path, 'wb') as out:
+        out.write(b'\x00' * header_size)
+        index_offset = _align(out)
+        out.write(struct.pack('<%dI' % num_blocks, *block_index))
+        freqs_offset = _align(out)
+        out.write(struct.pack('<%dQ' % num_words, *[row[1] for row in rows]))
+        text_offsets_offset = _align(out)
+        out.write(struct.pack('<%dI' % len(text_offsets), *text_offsets))
+        blocks_offset = _align(out)
+        # The block index was measured from the start of the blocks section;
+        # now that we know where it starts, make the offsets absolute.
+        out.seek(index_offset)
+        out.write(struct.pack(
+            '<%dI' % num_blocks,
+            *[offset + blocks_offset for offset in block_index]
+        ))
+        out.seek(blocks_offset)
+        out.write(blocks)
+        texts_offset = out.tell()
+        for slug, freq, text in rows:
+            out.write(text)
+
+        out.seek(0)
+        out.write(MAGIC)
+        out.write(struct.pack(
+            HEADER_FORMAT, VERSION, num_words, block_size, num_blocks,
+            index_offset, freqs_offset, text_offsets_offset, blocks_offset,
+            texts_offset
+        ))
@@ -1,12 +1,12 @@
 import csv
 import re
-from itertools import permutations
+from itertools import islice, permutations
 from natsort import natsorted
 
 from .wordlist import WORDS
-from ..utils.normalize import slugify, alphanumeric
+from ..utils.normalize import slugify, alphanumeric, unspaced_lower
 from ..utils.path import data_path
-from ..utils.regex import regex_index, regex_len
+from ..utils.regex import is_exact, regex_index, regex_len
 
 
 class RegexClue:
@@ -61,6 +61,9 @@ class RegexClue:
 
 ANY = RegexClue('.+')
 
+# How many permutations brute_force_diagonalize scores at once
+DIAGONAL_BATCH_SIZE = 1000
+
 
 def parse_cell(cell):
     """
@@ -131,25 +134,52 @@ def brute_force_diagonalize(answers, wordlist=WORDS, quiet=False):
 
     Of course we were looking for the famous red herring "BE NOISY", but
     "RUN EAST" sounds like a good way to find the coin also.
+
+    Trying every order takes a while, so the results are kept in the
+    wordlist's result cache.
     """
+    results = wordlist.cached_result(
+        ('diagonalize',) + tuple(answers),
+        lambda: _brute_force_diagonals(answers, wordlist, quiet)
+    )
+    return wordlist.show_best_results(results)
+
+
+def _brute_force_diagonals(answers, wordlist, quiet):
     results = []
     seen = set()
     answers = [parse_cell(word) for word in answers]
-    for i, permutation in enumerate(permutations(answers)):
-        if not quiet and i > 0 and i % 10000 == 0:
-            print("Tried %d permutations" % i)
-        try:
-            diag = diagonalize(permutation)
-        except IndexError:
-            continue
-        found = wordlist.search(diag, count=1, use_cromulence=True)
-        if found:
-            logprob, text = found[0]
-            slug = slugify(text)
-            if slug not in seen:
-                results.append((logprob, text, None))
-                seen.add(slug)
-    return wordlist.show_best_results(results)
+    numbered_permutations = enumerate(permutations(answers))
+    while True:
+        batch = list(islice(numbered_permutations, DIAGONAL_BATCH_SIZE))
+        if not batch:
+            break
+        diags = []
+        for i, permutation in batch:
+            if not quiet and i > 0 and i % 10000 == 0:
+                print("Tried %d permutations" % i)
+            try:
+                diags.append(diagonalize(permutation))
+            except IndexError:
+                continue
+
+        # Diagonals made of known letters can all be scored at once. The ones
+        # that involve regexes have to be searched for individually.
+        exact = [diag for diag in diags if is_exact(unspaced_lower(diag))]
+        scores, texts = wordlist.cromulence_batch(exact)
+        scored = dict(zip(exact, zip(scores.tolist(), texts)))
+        for diag in diags:
+            if diag in scored:
+                found = [scored[diag]]
+            else:
+                found = wordlist.search(diag, count=1, use_cromulence=True)
+            if found:
+                logprob, text = found[0]
+                slug = slugify(text)
+                if slug not in seen:
+                    results.append((logprob, text, None))
+                    seen.add(slug)
+    return results
 
 
 def resolve(item):
@@ -1,77 +1,314 @@
+"""
+Search for words and phrases by pattern and by clue.
+
+Clues are looked up in `data/db/search.db`, which has an FTS5 table of
+clues, `clues (keyword, text, lengths)`, and a table of the slugs that each
+keyword gives credit to, `keyword_parts (keyword, slug, weight, length)`:
+the slug of the whole keyword, with a weight of 1, and the slug of each of
+its tokens, with the weight divided among them. The `lengths` of a clue are
+tokens for the lengths of its keyword's parts.
+
+A clue is ranked with one SQL query. It matches the whole clue against the
+clue text, and each word of the clue on its own, with rarer words counting
+for more. The scores for each keyword are spread over its parts and added
+up in SQLite, which returns the best slugs.
+
+A length or a pattern that the answer has to match is also part of the
+query: the length is matched in the full-text index, so only clues for
+answers of that length are scored, and the pattern is checked with GLOB or
+a REGEXP function when the parts are added up.
+
+A database built before there was a `keyword_parts` table can still be
+searched, but only the whole keyword of each clue gets credit, until it's
+updated by `python -m hypebot.solvertools.clue_db`.
+
+Optionally, each word of a clue is also expanded into the terms most
+similar to it in ConceptNet Numberbatch, and clues that match those count
+for a fraction of what the word's own matches do. This needs the normalized
+vectors and their index, which are built offline by
+`python -m hypebot.solvertools.conceptnet_numberbatch`; without them, the
+words are searched for on their own.
+
+The database is built and updated by `clue_db.py`.
+"""
+import logging
+import os
 import re
 import sqlite3
-from collections import defaultdict
-from operator import itemgetter
+from collections import Counter
 
 from wordfreq import tokenize
 
+from .clue_text import fts_phrase, length_token, table_columns
 from .conceptnet_numberbatch import (load_numberbatch,
-                                                get_vector,
-                                                similar_to_term)
-from .wordlist import WORDS
+                                                load_vector_index,
+                                                numberbatch_paths,
+                                                similar_to_terms,
+                                                vector_index_paths)
+from .wordlist import WORDS, search as wordlist_search
 from ..utils.normalize import slugify, sanitize
 from ..utils.path import data_path, db_path
+from ..utils.regex import regex_glob, regex_len
 
 
+logger = logging.getLogger(__name__)
+
 NUMBERBATCH = None
+NUMBERBATCH_INDEX = None
 DB = None
 
+# The columns of each table of the database, which is checked when it's
+# opened. Databases built by older versions of clue_db.py are missing some.
+DB_COLUMNS = {}
 
-def query_expand(word):
-    global NUMBERBATCH
+# How many of the best-ranked clues are used for each part of a clue search
+MATCH_LIMIT = 10000
+
+# How much a match for the whole clue counts, and how much a match for one
+# word counts, before it's multiplied by how rare the word is
+CLUE_MATCH_WEIGHT = 1000.
+WORD_MATCH_WEIGHT = 10.
+
+# The most that a word's rarity can multiply its matches by
+MAX_RARE_BOOST = 25.
+
+# How many terms similar to each word of a clue are searched for, how
+# similar they have to be (as a cubed similarity, relative to the most
+# similar term), and how much their matches count compared to the word's own
+EXPANSION_LIMIT = 25
+EXPANSION_MIN_SIMILARITY = 0.2
+EXPANSION_WEIGHT = 0.25
+
+# One part of a clue search: the best MATCH_LIMIT clues matching a query,
+# and their scores, multiplied by a weight
+_MATCH_SQL = """
+    SELECT keyword, -rank * ? AS score FROM (
+        SELECT keyword, rank FROM clues
+        WHERE clues MATCH ?
+        ORDER BY rank LIMIT ?
+    )
+"""
+
+# The same, only for clues whose lengths match a second query. It's a
+# separate query so that the length doesn't add to the bm25 score.
+_LENGTH_MATCH_SQL = """
+    SELECT keyword, -rank * ? AS score FROM (
+        SELECT keyword, rank FROM clues
+        WHERE clues MATCH ?
+        AND rowid IN (SELECT rowid FROM clues WHERE clues MATCH ?)
+        ORDER BY rank LIMIT ?
+    )
+"""
+
+# Add up the scores of the matches for all parts of a clue search, spread
+# over the parts of their keywords that meet the conditions, and take the
+# best slugs
+_RANK_SQL = """
+    SELECT parts.slug, SUM(matches.score * parts.weight) AS total
+    FROM (%s) AS matches
+    JOIN keyword_parts AS parts ON parts.keyword = matches.keyword
+    WHERE %s
+    GROUP BY parts.slug
+    ORDER BY total DESC
+    LIMIT ?
+"""
+
+# The same, for a database with no `keyword_parts` table: each clue's score
+# only goes to the slug of its whole keyword
+_WHOLE_KEYWORD_RANK_SQL = """
+    SELECT parts.slug, SUM(parts.score) AS total
+    FROM (
+        SELECT slugify(keyword) AS slug, LENGTH(slugify(keyword)) AS length, score
+        FROM (%s)
+    ) AS parts
+    WHERE %s
+    GROUP BY parts.slug
+    ORDER BY total DESC
+    LIMIT ?
+"""
+
+
+def get_numberbatch():
+    """
+    Load the normalized Numberbatch vectors and their vector index, or
+    return (None, None) if they haven't been built.
+    """
+    global NUMBERBATCH, NUMBERBATCH_INDEX
     if NUMBERBATCH is None:
-        NUMBERBATCH = load_numberbatch()
+        paths = [numberbatch_paths(normalized=True)[1]] + list(vector_index_paths())
+        if not all(os.path.exists(path) for path in paths):
+            return None, None
+        NUMBERBATCH_INDEX = load_vector_index()
+        NUMBERBATCH = load_numberbatch(normalized=True)
+    return NUMBERBATCH, NUMBERBATCH_INDEX
+
+
+def expansion_terms(words):
+    """
+    Find the terms similar to each of a list of words, using ConceptNet
+    Numberbatch, as a dictionary from each word to a list of terms. The
+    dictionary is empty if the vectors aren't available.
+    """
+    store, index = get_numberbatch()
+    expansions = {}
+    if store is None:
+        return expansions
+    for word, similar in zip(words, similar_to_terms(store, words, EXPANSION_LIMIT, index)):
+        expansions[word] = [
+            term for (term, sim) in similar
+            if sim >= EXPANSION_MIN_SIMILARITY and term != word
+        ]
+    return expansions
 
-    similar = similar_to_term(NUMBERBATCH, word, limit=25)
-    sim_words = [word2.replace('"','') for word2, sim in similar.items() if sim >= 0.2]
-    parts = [word] + [word2 for word2 in sim_words if word2 != word]
-    query = ' OR '.join('"%s"' % word2 for word2 in parts)
-    return '(%s)' % query
 
+def query_expand(word):
+    """
+    Make an FTS5 query that matches a word or any of the terms similar to
+    it.
+    """
+    parts = [word] + expansion_terms([word]).get(word, [])
+    return '(%s)' % ' OR '.join(fts_phrase(part) for part in parts)
+
+
+def get_db():
+    """
+    Connect to the clue search database.
 
-def db_search(query, limit=10000):
+    Searches work best with an up-to-date `keyword_parts` table, which
+    clue_db.py builds; a search never builds it, because that would take
+    minutes. Without it, searches fall back on giving credit only to whole
+    keywords.
+    """
     global DB
     if DB is None:
-        DB = sqlite3.connect(db_path("search.db"), check_same_thread=False)
+        db = sqlite3.connect(db_path("search.db"), check_same_thread=False)
+        db.create_function('regexp', 2, sql_regexp)
+        db.create_function('slugify', 1, slugify)
+        for table in ('clues', 'keyword_parts'):
+            DB_COLUMNS[table] = table_columns(db, table)
+        if 'length' not in DB_COLUMNS['keyword_parts']:
+            logger.warning(
+                "search.db has no up-to-date keyword_parts table, so clue "
+                "searches only credit whole keywords. Update it with "
+                "`python -m hypebot.solvertools.clue_db`."
+            )
+        DB = db
+    return DB
 
-    cur = DB.cursor()
-    results = defaultdict(float)
-    for (keyword, negscore) in cur.execute("SELECT keyword, bm25(clues) AS score FROM clues WHERE text MATCH ? LIMIT ?", (query, limit)):
-        assert negscore < 0
-        results[keyword] -= negscore
-    return results
 
+def db_has_lengths():
+    """
+    Does the `clues` table have a `lengths` column, so that searches can be
+    limited to answers of a length in the full-text index?
+    """
+    get_db()
+    return 'lengths' in DB_COLUMNS['clues']
 
-def db_rank(clue):
-    scores = defaultdict(float)
-    for match, score in db_search(clue).items():
-        scores[slugify(match)] += score * 1000
-        parts = tokenize(match, 'en')
-        for part in parts:
-            scores[slugify(part)] += score * 1000 / len(parts)
 
-    for word in tokenize(clue, 'en'):
-        logprob_result = WORDS.segment_logprob(slugify(word))
-        if logprob_result is not None:
-            logprob, _ = logprob_result
-        else:
-            logprob = -1000.
-        rare_boost = min(25., -logprob)
-        for match, score in db_search(word).items():
-            scores[slugify(match)] += rare_boost * score * 10
-            parts = tokenize(match, 'en')
-            for part in parts:
-                scores[slugify(part)] += rare_boost * score * 10 / len(parts)
+def db_has_keyword_parts():
+    "Does the database have an up-to-date `keyword_parts` table?"
+    get_db()
+    return 'length' in DB_COLUMNS['keyword_parts']
+
+
+def sql_regexp(pattern, text):
+    """
+    The REGEXP function for SQLite: does `text` match all of `pattern`?
+    """
+    return re.fullmatch(pattern, text) is not None
+
+
+def rare_boost(word):
+    """
+    How much more a match for `word` counts, because it's a rare word.
+    """
+    logprob_result = WORDS.segment_logprob(slugify(word))
+    if logprob_result is not None:
+        logprob, _ = logprob_result
+    else:
+        logprob = -1000.
+    return min(MAX_RARE_BOOST, -logprob)
+
 
-        # ConceptNet not included for now since quality is poor
-        # query = query_expand(word)
-        # for match, score in db_search(query).items():
-        #     scores[slugify(match)] += rare_boost * score
-        #     parts = tokenize(match, 'en')
-        #     for part in parts:
-        #         scores[slugify(part)] += rare_boost * score / len(parts)
+def clue_match(query, weight=1., length=None, limit=MATCH_LIMIT):
+    """
+    Make the SQL for one part of a clue search, and its parameters: the best
+    `limit` clues whose text matches the FTS5 query `query`, with their bm25
+    scores multiplied by `weight`. If the database can tell, only clues for
+    an answer of the given `length` are matched.
+    """
+    match = 'text : (%s)' % query
+    if length is not None and db_has_lengths():
+        return _LENGTH_MATCH_SQL, [
+            weight, match, 'lengths : %s' % fts_phrase(length_token(length)), limit
+        ]
+    return _MATCH_SQL, [weight, match, limit]
+
+
+def db_search(query, limit=MATCH_LIMIT):
+    """
+    Find the keywords of the clues that best match an FTS5 query, and add
+    up their bm25 scores.
+    """
+    results = Counter()
+    sql, params = clue_match(query, limit=limit)
+    for keyword, score in get_db().execute(sql, params):
+        results[keyword] += score
+    return results
 
-    return scores
+
+def db_rank(clue, limit=None, length=None, pattern=None, expand=False):
+    """
+    Rank the slugs that might be answers to a clue, returning the best
+    `limit` of them (or all of them) as (slug, score) pairs, best first.
+
+    Only slugs of the given `length`, and that entirely match the regex
+    `pattern`, are ranked. With `expand`, clues that contain terms similar
+    to the words of the clue count too, for less. It's off by default,
+    because the quality of ConceptNet's similar terms is poor.
+    """
+    words = Counter(tokenize(clue, 'en'))
+    if not words:
+        return []
+    expansions = {}
+    if expand:
+        expansions = expansion_terms(list(words))
+    matches = [clue_match(
+        ' '.join(fts_phrase(word) for word in words.elements()),
+        CLUE_MATCH_WEIGHT, length
+    )]
+    for word, word_count in words.items():
+        weight = rare_boost(word) * WORD_MATCH_WEIGHT * word_count
+        matches.append(clue_match(fts_phrase(word), weight, length))
+        if expansions.get(word):
+            matches.append(clue_match(
+                ' OR '.join(fts_phrase(term) for term in expansions[word]),
+                weight * EXPANSION_WEIGHT, length
+            ))
+    selects = [sql for sql, match_params in matches]
+    params = [param for sql, match_params in matches for param in match_params]
+
+    conditions = ['1']
+    if length is not None:
+        conditions.append('parts.length = ?')
+        params.append(length)
+    if pattern is not None:
+        # A GLOB can use the simplest patterns directly. Anything else
+        # needs the REGEXP function.
+        glob = regex_glob(pattern)
+        if glob is not None:
+            conditions.append('parts.slug GLOB ?')
+            params.append(glob)
+        else:
+            conditions.append('parts.slug REGEXP ?')
+            params.append(pattern)
+    if db_has_keyword_parts():
+        rank_sql = _RANK_SQL
+    else:
+        rank_sql = _WHOLE_KEYWORD_RANK_SQL
+    sql = rank_sql % (' UNION ALL '.join(selects), ' AND '.join(conditions))
+    params.append(-1 if limit is None else limit)
+    return get_db().execute(sql, params).fetchall()
 
 
 def search(pattern=None, clue=None, length=None, count=20):
@@ -90,19 +327,21 @@ def search(pattern=None, clue=None, length=None, count=20):
         if pattern is None:
             return []
         else:
-            return WORDS.search(pattern, count=count, use_cromulence=True)
+            return wordlist_search(pattern, count=count, use_cromulence=True)
 
     if pattern is not None:
         pattern = pattern.lstrip('^').rstrip('$').lower()
-        pattern = re.compile('^' + pattern + '$')
+        # A pattern that can only match one length says what the length is.
+        minlen, maxlen = regex_len(pattern)
+        if minlen == maxlen:
+            if length is not None and length != minlen:
+                return []
+            length = minlen
 
-    raw_matches = sorted(db_rank(clue).items(), key=itemgetter(1), reverse=True)
+    survivors = db_rank(clue, count, length, pattern)
+    WORDS.prefetch_segments([slug for slug, score in survivors])
     matches = {}
-    for slug, score in raw_matches:
-        if length is None or length == len(slug):
-            if pattern is None or pattern.match(slug):
-                crom, text = WORDS.cromulence(slug)
-                matches[text] = score
-        if len(matches) >= count:
-            break
+    for slug, score in survivors:
+        crom, text = WORDS.cromulence(slug)
+        matches[text] = score
     return sorted([(score, text) for (text, score) in matches.items()], reverse=True)
@@ -0,0 +1,71 @@
+"""
+A compact prefix trie over the slugs of a wordlist.
+
+Instead of a tree of nodes, the trie is stored implicitly as a sorted list of
+slugs. All the slugs that start with a given prefix form a contiguous range
+of that list, so descending one level of the trie is a matter of narrowing
+the range with two binary searches. This takes a small fraction of the memory
+of a node-based trie, and it's fast to build from a database that's already
+indexed by slug.
+"""
+from bisect import bisect_left
+
+
+# A character that sorts after every lowercase letter, used to find the end
+# of the range of slugs that start with a prefix
+AFTER_Z = '{'
+
+
+class SlugTrie:
+    def __init__(self, slugs):
+        """
+        Make a trie from an iterable of slugs. The empty slug, which
+        wordlists use to store their total frequency, is left out.
+        """
+        self.slugs = [slug for slug in slugs if slug]
+        self.slugs.sort()
+
+    def __len__(self):
+        return len(self.slugs)
+
+    def __contains__(self, slug):
+        index = bisect_left(self.slugs, slug)
+        return index < len(self.slugs) and self.slugs[index] == slug
+
+    def prefix_range(self, prefix):
+        """
+        Find the range of indices into `self.slugs` of the slugs that start
+        with `prefix`. The range is empty if there aren't any.
+        """
+        lo = bisect_left(self.slugs, prefix)
+        hi = bisect_left(self.slugs, prefix + AFTER_Z, lo)
+        return lo, hi
+
+    def prefix_ends(self, text, start=0, resume=None):
+        """
+        Find the words that appear in `text` starting at position `start`.
+        Yields each position `end` such that `text[start:end]` is a slug in
+        the trie, in increasing order.
+
+        The search stops as soon as no slug in the trie could continue the
+        text, so the work is proportional to the prefixes that actually
+        exist, not to the length of the text.
+
+        If part of the text has already been searched, `resume` can be a
+        tuple of (end, lo, hi), where `lo` and `hi` are the `prefix_range`
+        of `text[start:end]`. The search picks up from there, yielding only
+        the positions after `end`.
+        """
+        slugs = self.slugs
+        if resume is None:
+            resumed_end, lo, hi = start, 0, len(slugs)
+        else:
+            resumed_end, lo, hi = resume
+        for end in range(resumed_end + 1, len(text) + 1):
+            prefix = text[start:end]
+            lo = bisect_left(slugs, prefix, lo, hi)
+            hi = bisect_left(slugs, prefix + AFTER_Z, lo, hi)
+            if lo == hi:
+                return
+            if slugs[lo] == prefix:
+                yield end
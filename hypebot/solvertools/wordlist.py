@@ -1,18 +1,27 @@
+import heapq
 import logging
 import mmap
 import os
+import pathlib
 import re
 import sqlite3
+import zlib
 from collections import defaultdict, Counter
 from itertools import islice
 from math import log, exp
 from pprint import pprint
 
+import numpy as np
+
+from .packed import PackedWordTable, write_packed_table
+from .trie import SlugTrie
+from ..utils.cache import DiskCache, LRUCache
 from ..utils.normalize import slugify, unspaced_lower
 from ..utils.path import db_path, data_path, wordlist_path, corpus_path
-from ..utils.regex import is_exact, regex_len, regex_slice
+from ..utils.regex import is_exact, regex_len, regex_indices, regex_positions
 from ..utils.string import (
-    alphagram, anahash, consonantcy, alphabytes, random_letters
+    alphagram, anahash, consonantcy, random_letters, ASCII_a,
+    letters_to_vec, letterbag, LETTERBAG_MAX_COUNT
 )
 
 logger = logging.getLogger(__name__)
@@ -29,6 +38,16 @@ logger = logging.getLogger(__name__)
 NULL_HYPOTHESIS_ENTROPY = -3.5
 DECIBEL_SCALE = 20 / log(10)
 
+# The first line of a version 2 greppable file, which includes the text of
+# each word as well as its frequency
+GREPPABLE_V2_HEADER = b'#greppable 2\n'
+
+# Returned by Wordlist._cache_get when the database has to be consulted
+NOT_CACHED = object()
+
+# How big the cache of results in data/db/results.db can get, in bytes
+RESULT_CACHE_MAX_BYTES = 256 * 2 ** 20
+
 
 class Wordlist:
     schema = [
@@ -50,17 +69,79 @@ class Wordlist:
         "CREATE INDEX wordplay_consonantcy on wordplay (consonantcy)",
     ]
     max_indexed_length = 25
-
-    def __init__(self, name):
+    # SQLite limits the number of parameters in a single statement, so batched
+    # lookups are split into chunks of this size.
+    max_query_params = 500
+
+    def __init__(self, name, cache_size=100000, negative_cache_size=100000,
+                 segment_cache_size=1000, piece_cache_size=10000,
+                 search_cache_size=1000, anahash_cache_size=10000,
+                 backend='sqlite', alphagram_index=False, read_only=False,
+                 result_cache=None):
         """
         Load a wordlist, given its name.
+
+        The `backend` determines where words are looked up. 'sqlite' uses the
+        `words` table of the SQLite database. 'packed' uses the read-only,
+        memory-mapped table written by `write_packed_table`, which avoids the
+        overhead of SQL queries and whose memory is shared between processes.
+        Either way, the other tables still come from SQLite.
+
+        Rows that have been looked up are kept in a least-recently-used cache
+        of `cache_size` entries. Slugs that turned out not to be in the
+        wordlist are remembered separately, in a cache of
+        `negative_cache_size` entries, so that lookups of non-words can't
+        crowd out the real words. Either size can be None to never evict.
+
+        `search` also caches the results of grepping for the segments of
+        patterns it searches for, keeping `segment_cache_size` of them, and
+        its own results, keeping `search_cache_size` of them.
+        `find_by_anahash_letterbags` keeps the letterbags of the words with
+        `anahash_cache_size` anahashes.
+        `pieces_logprob_batch` caches how to segment `piece_cache_size` of
+        the pieces it's given.
+
+        If `alphagram_index` is True, the first anagram lookup loads the whole
+        `wordplay` table into dictionaries, so that looking up alphagrams and
+        anahashes doesn't need SQL queries. This takes a few seconds and
+        about 90 MB, so it's off by default, and it can be turned on later
+        with `use_alphagram_index` in the one process that anagrams most.
+
+        If `read_only` is True, the database is opened read-only, which is
+        how worker processes that search the wordlist in parallel open it.
+
+        A `result_cache` is a DiskCache that keeps the results of slow
+        commands that use this wordlist, such as `anagram_stream` and the
+        module-level `cromulence` and `search`, across restarts. Methods like
+        `Wordlist.search` only cache in memory, because they're called in
+        loops where a database write each time would cost more than it saves.
         """
         self.name = name
-        self.db = wordlist_db_connection(name + '.wl.db')
-        self._word_cache = {}
+        self.backend = backend
+        self.read_only = read_only
+        self.db = wordlist_db_connection(name + '.wl.db', read_only=read_only)
+        if backend == 'packed':
+            self.packed = PackedWordTable(packed_table_path(name))
+        elif backend == 'sqlite':
+            self.packed = None
+        else:
+            raise ValueError("Unknown wordlist backend: %r" % backend)
+        self._word_cache = LRUCache(cache_size)
+        self._negative_cache = LRUCache(negative_cache_size)
+        self._segment_cache = LRUCache(segment_cache_size)
+        self._piece_cache = LRUCache(piece_cache_size)
+        self._search_cache = LRUCache(search_cache_size)
+        self._anahash_bag_cache = LRUCache(anahash_cache_size)
         self._grep_maps = {}
-        self._alpha_maps = {}
+        self._grep_indexes = {}
+        self._letterbags = None
+        self.use_alphagram_index = alphagram_index
+        self._alphagram_index = None
+        self._anahash_index = None
+        self._trie = None
         self.logtotal = None
+        self.result_cache = result_cache
+        self._build_version = None
 
     def __contains__(self, word):
         """
@@ -79,37 +160,215 @@ class Wordlist:
         database. If there is such a row, return its unscaled frequency and
         its text (including spaces). If not, return None.
         """
-        if slug in self._word_cache:
-            return self._word_cache[slug]
-        c = self.db.cursor()
-        c.execute("SELECT freq, text FROM words WHERE slug=?", (slug,))
-        result = c.fetchone()
-        self._word_cache[slug] = result
+        cached = self._cache_get(slug)
+        if cached is not NOT_CACHED:
+            return cached
+        if self.packed is not None:
+            result = self.packed.lookup(slug)
+        else:
+            c = self.db.cursor()
+            c.execute("SELECT freq, text FROM words WHERE slug=?", (slug,))
+            result = c.fetchone()
+        self._cache_put(slug, result)
         return result
 
-    def segment_logprob(self, slug):
+    def _cache_get(self, slug):
         """
-        If this slug appears directly in the word list, return its log
-        probability and its text. Otherwise, return None.
+        Look for a slug in the caches. Returns its row, None if it's known
+        not to be in the wordlist, or NOT_CACHED if we don't know yet.
+        """
+        found = self._word_cache.get(slug, NOT_CACHED)
+        if found is NOT_CACHED and self._negative_cache.get(slug, False):
+            return None
+        return found
+
+    def _cache_put(self, slug, row):
+        if row is None:
+            self._negative_cache[slug] = True
+        else:
+            self._word_cache[slug] = row
+
+    def cache_stats(self):
+        """
+        Get the counters for this wordlist's caches.
+
+        Every lookup checks the 'words' cache first; the ones it misses go on
+        to the 'negative' cache, and the ones that miss both go to the
+        database. The 'segments' cache holds grep results for `search`, the
+        'searches' cache holds the results of `search` itself, and the
+        'pieces' cache holds segmentations for `pieces_logprob_batch`.
+        """
+        stats = {
+            'words': self._word_cache.stats(),
+            'negative': self._negative_cache.stats(),
+            'segments': self._segment_cache.stats(),
+            'searches': self._search_cache.stats(),
+            'pieces': self._piece_cache.stats(),
+        }
+        if self.result_cache is not None:
+            stats['results'] = self.result_cache.stats()
+        return stats
+
+    def build_version(self):
+        """
+        Identify the current build of this wordlist, so that results cached
+        from an earlier build aren't used. Rebuilding the wordlist rewrites
+        its database, which changes its modification time and size.
+        """
+        if self._build_version is None:
+            stat = os.stat(db_path(self.name + '.wl.db'))
+            self._build_version = '%d.%d' % (stat.st_mtime_ns, stat.st_size)
+        return self._build_version
+
+    def get_cached_result(self, key, default=None):
+        """
+        Get a result from the result cache, or `default` if it isn't there.
+
+        The `key` is a tuple that starts with the name of the command and
+        continues with its normalized arguments.
+        """
+        if self.result_cache is None:
+            return default
+        return self.result_cache.get(self.name, self.build_version(), key, default)
+
+    def cache_result(self, key, result):
+        "Put a result in the result cache, if there is one."
+        if self.result_cache is not None:
+            self.result_cache.put(self.name, self.build_version(), key, result)
+
+    def cached_result(self, key, compute):
+        """
+        Get a result from the result cache, or get it by calling `compute()`
+        and put it in the result cache.
+        """
+        result = self.get_cached_result(key)
+        if result is None:
+            result = compute()
+            self.cache_result(key, result)
+        return result
+
+    def _invalidate_results(self):
+        self._build_version = None
+        if self.result_cache is not None:
+            self.result_cache.invalidate(self.name)
+
+    def lookup_many(self, slugs):
+        """
+        Look up many slugs at once. Returns a dictionary mapping each slug to
+        what `lookup_slug` would return for it: its unscaled frequency and
+        text, or None.
+
+        Slugs that aren't in the caches are fetched with one query per chunk
+        of `max_query_params` slugs, instead of one query per slug, and the
+        results (including misses) are added to the caches.
+        """
+        results = {}
+        missing = []
+        for slug in set(slugs):
+            cached = self._cache_get(slug)
+            if cached is NOT_CACHED:
+                missing.append(slug)
+            else:
+                results[slug] = cached
+
+        if self.packed is not None:
+            for slug in missing:
+                results[slug] = self.packed.lookup(slug)
+                self._cache_put(slug, results[slug])
+            return results
+
+        c = self.db.cursor()
+        for start in range(0, len(missing), self.max_query_params):
+            chunk = missing[start:start + self.max_query_params]
+            for slug in chunk:
+                results[slug] = None
+            c.execute(
+                "SELECT slug, freq, text FROM words WHERE slug IN (%s)"
+                % ','.join('?' * len(chunk)),
+                chunk
+            )
+            for slug, freq, text in c.fetchall():
+                results[slug] = (freq, text)
+            for slug in chunk:
+                self._cache_put(slug, results[slug])
+        return results
+
+    def slug_trie(self):
+        """
+        Get a prefix trie of all the slugs in the wordlist, building it from
+        the database the first time it's needed.
+        """
+        if self._trie is None:
+            if self.packed is not None:
+                slugs = self.packed.iter_slugs()
+            else:
+                slugs = self._iter_singletons("SELECT slug FROM words ORDER BY slug")
+            self._trie = SlugTrie(slugs)
+        return self._trie
+
+    def find_segments(self, slug):
+        """
+        Find every word that appears in the slug, returning a list that
+        contains, for each start position, the list of end positions where a
+        word from the wordlist ends.
+        """
+        trie = self.slug_trie()
+        return [list(trie.prefix_ends(slug, start)) for start in range(len(slug))]
+
+    def prefetch_segments(self, slugs):
+        """
+        Make sure every word that appears inside the given slugs is cached, so
+        that segmenting them afterward doesn't need to query the database.
         """
+        trie = self.slug_trie()
+        self.lookup_many(
+            slug[left_edge:right_edge]
+            for slug in slugs
+            for left_edge in range(len(slug))
+            for right_edge in trie.prefix_ends(slug, left_edge)
+        )
+
+    def _load_logtotal(self):
         if self.logtotal is None:
             totalfreq, _ = self.lookup_slug('')
             self.logtotal = log(totalfreq)
+        return self.logtotal
+
+    def segment_logprob(self, slug):
+        """
+        If this slug appears directly in the word list, return its log
+        probability and its text. Otherwise, return None.
+        """
+        logtotal = self._load_logtotal()
         found = self.lookup_slug(slug)
         if found is None:
             return None
         freq, text = found
-        logprob = (log(freq) - self.logtotal)
+        logprob = (log(freq) - logtotal)
         return logprob, text
 
+    def segment_logprob_many(self, slugs):
+        """
+        The batched form of `segment_logprob`. Returns a dictionary mapping
+        each slug to its log probability and text, or to None if it doesn't
+        appear in the word list.
+        """
+        logtotal = self._load_logtotal()
+        results = {}
+        for slug, found in self.lookup_many(slugs).items():
+            if found is None:
+                results[slug] = None
+            else:
+                freq, text = found
+                results[slug] = (log(freq) - logtotal, text)
+        return results
+
     def freq(self, word):
         """
         Get the frequency of a single item in the wordlist.
         Always returns just a number, which is 0 if it's not found.
         """
-        if self.logtotal is None:
-            totalfreq, _ = self.lookup_slug('')
-            self.logtotal = log(totalfreq)
+        self._load_logtotal()
         found = self.lookup_slug(slugify(word))
         if found is None:
             return 0.
@@ -130,31 +389,170 @@ class Wordlist:
         """
         Get the log probability of this text, along with its most likely
         spacing, gluing it together with multiple "segments" if necessary.
+
+        The segmentation only considers the words that actually appear in
+        the text, which it finds by walking the wordlist's slug trie from
+        each position that some segmentation can reach.
         """
         slug = slugify(text)
-        n = len(slug)
-        best_partial_results = ['']
-        best_logprobs = [0.]
-        for right_edge in range(1, n + 1):
-            found = self.segment_logprob(slug[:right_edge])
-            if found:
-                rprob, rtext = found
-                best_partial_results.append(rtext)
-                best_logprobs.append(rprob)
+        spans = self.find_segments(slug)
+        segments = self.segment_logprob_many(
+            slug[left_edge:right_edge]
+            for left_edge in range(len(slug))
+            for right_edge in spans[left_edge]
+        )
+        return _best_segmentation(slug, spans, segments)
+
+    def text_logprob_batch(self, texts):
+        """
+        The batched form of `text_logprob`. Returns a NumPy array of the log
+        probabilities of the texts, and a list of their most likely spacings.
+
+        Each distinct slug is only segmented once, and the words in all of
+        them are looked up together, before any of them are segmented.
+        """
+        slugs = [slugify(text) for text in texts]
+        distinct = list(dict.fromkeys(slugs))
+        spans = {slug: self.find_segments(slug) for slug in distinct}
+        segments = self.segment_logprob_many(
+            slug[left_edge:right_edge]
+            for slug in distinct
+            for left_edge in range(len(slug))
+            for right_edge in spans[slug][left_edge]
+        )
+        found = {
+            slug: _best_segmentation(slug, spans[slug], segments)
+            for slug in distinct
+        }
+        logprobs = np.array([found[slug][0] for slug in slugs], dtype=float)
+        return logprobs, [found[slug][1] for slug in slugs]
+
+    def pieces_logprob_batch(self, candidates):
+        """
+        Like `text_logprob_batch`, for texts that are already divided into
+        pieces, such as anagrams made of words from the wordlist. Each
+        candidate is a tuple of slugs. Returns a NumPy array of the log
+        probabilities of the candidates, and a list of their most likely
+        spacings.
+
+        Pieces come up again and again in a batch of anagrams, so the words
+        inside each piece, and the best ways to space each piece on its own,
+        are worked out once and cached. The only new words in a candidate are
+        the ones that cross a boundary between its pieces.
+
+        The best spacing that keeps the pieces apart is just the best
+        spacings of the pieces, joined together. A spacing that uses a word
+        that crosses a boundary can only be better if that word, plus the
+        best that could come before and after it, beats that. Only then is
+        the whole candidate segmented again.
+        """
+        join_logprob = log(10)
+        distinct = list(dict.fromkeys(candidates))
+        pieces = self._piece_segmentations(
+            {piece for candidate in distinct for piece in candidate}
+        )
+        trie = self.slug_trie()
+        crossings = {
+            candidate: _crossing_spans(candidate, pieces, trie)
+            for candidate in distinct
+        }
+        segments = self.segment_logprob_many(
+            slug[left_edge:right_edge]
+            for slug, crossing in crossings.values()
+            for left_edge, right_edge in crossing
+        )
+
+        found = {}
+        for candidate in distinct:
+            slug, crossing = crossings[candidate]
+            logprob = (
+                sum(pieces[piece][5] for piece in candidate)
+                - join_logprob * max(len(candidate) - 1, 0)
+            )
+            if not any(
+                _crossing_bound(candidate, pieces, left_edge, right_edge,
+                                segments[slug[left_edge:right_edge]][0])
+                >= logprob
+                for left_edge, right_edge in crossing
+            ):
+                found[candidate] = (
+                    logprob, ' '.join(pieces[piece][6] for piece in candidate)
+                )
+                continue
+
+            spans = []
+            candidate_segments = {}
+            offset = 0
+            for piece in candidate:
+                for ends in pieces[piece][0]:
+                    spans.append([offset + end for end in ends])
+                candidate_segments.update(pieces[piece][1])
+                offset += len(piece)
+            for left_edge, right_edge in crossing:
+                spans[left_edge].append(right_edge)
+                word = slug[left_edge:right_edge]
+                candidate_segments[word] = segments[word]
+            found[candidate] = _best_segmentation(slug, spans, candidate_segments)
+        logprobs = np.array([found[candidate][0] for candidate in candidates], dtype=float)
+        return logprobs, [found[candidate][1] for candidate in candidates]
+
+    def _piece_segmentations(self, pieces):
+        """
+        Get what `pieces_logprob_batch` needs to know about each piece, from
+        the cache or by segmenting it. Returns a dictionary mapping each
+        piece to a tuple of:
+
+        - the end positions of words at each start position, as in
+          `find_segments`
+        - the log probability and text of each of those words
+        - the start positions where a word could begin that continues past
+          the end of the piece, each with the `prefix_range` in the slug trie
+          of the rest of the piece
+        - the log probability of the best spacing of each prefix of the piece
+        - the same for each suffix of the piece
+        - the log probability and text of the piece's best spacing
+        """
+        results = {}
+        missing = []
+        for piece in pieces:
+            cached = self._piece_cache.get(piece)
+            if cached is None:
+                missing.append(piece)
             else:
-                best_logprobs.append(-1000.)
-                best_partial_results.append(slug[:right_edge])
-            for left_edge in range(1, right_edge):
-                lprob = best_logprobs[left_edge]
-                found2 = self.segment_logprob(slug[left_edge:right_edge])
-                if found2:
-                    rprob, rtext = found2
-                    totalprob = lprob + rprob - log(10)
-                    if totalprob > best_logprobs[right_edge]:
-                        best_logprobs[right_edge] = totalprob
-                        ltext = best_partial_results[left_edge]
-                        best_partial_results[right_edge] = ltext + ' ' + rtext
-        return best_logprobs[-1], best_partial_results[-1]
+                results[piece] = cached
+
+        trie = self.slug_trie()
+        spans = {piece: self.find_segments(piece) for piece in missing}
+        segments = self.segment_logprob_many(
+            piece[left_edge:right_edge]
+            for piece in missing
+            for left_edge in range(len(piece))
+            for right_edge in spans[piece][left_edge]
+        )
+        for piece in missing:
+            piece_spans = spans[piece]
+            piece_segments = {
+                piece[left_edge:right_edge]: segments[piece[left_edge:right_edge]]
+                for left_edge in range(len(piece))
+                for right_edge in piece_spans[left_edge]
+            }
+            open_starts = []
+            for start in range(len(piece)):
+                lo, hi = trie.prefix_range(piece[start:])
+                if lo < hi:
+                    open_starts.append((start, lo, hi))
+            prefix_logprobs, prefix_texts = _segmentation_table(
+                piece, piece_spans, piece_segments
+            )
+            suffix_logprobs = _suffix_segmentation_logprobs(
+                piece, piece_spans, piece_segments
+            )
+            results[piece] = (
+                piece_spans, piece_segments, open_starts, prefix_logprobs,
+                suffix_logprobs, prefix_logprobs[-1], prefix_texts[-1]
+            )
+            self._piece_cache[piece] = results[piece]
+        return results
 
     def cromulence(self, text):
         """
@@ -169,6 +567,19 @@ class Wordlist:
         cromulence = round((entropy - NULL_HYPOTHESIS_ENTROPY) * DECIBEL_SCALE, 1)
         return cromulence, found_text
 
+    def cromulence_batch(self, texts):
+        """
+        The batched form of `cromulence`. Returns a NumPy array of the
+        cromulence of each text, and a list of their most likely spacings.
+        """
+        slugs = [slugify(text) for text in texts]
+        logprobs, found_texts = self.text_logprob_batch(slugs)
+        lengths = np.array([len(slug) for slug in slugs], dtype=float)
+        entropy = logprobs / (lengths + 1)
+        cromulences = np.round((entropy - NULL_HYPOTHESIS_ENTROPY) * DECIBEL_SCALE, 1)
+        cromulences[lengths == 0] = 0
+        return cromulences, found_texts
+
     def logprob_to_cromulence(self, logprob, length):
         """
         Convert a log probability to the 'cromulence' scale, which only
@@ -190,6 +601,92 @@ class Wordlist:
             if pattern in self:
                 yield self.segment_logprob(pattern)
             return
+
+        # Patterns made of single characters can be answered from the
+        # positional index, if it's been built for that length.
+        positions = regex_positions(pattern)
+
+        num_found = 0
+        for cur_length in self._grep_lengths(pattern, length):
+            mm = self._grep_map(cur_length)
+            for start in self._grep_lines(pattern, cur_length, positions):
+                num_found += 1
+                yield self._read_grep_line(mm, start)
+                if num_found >= count:
+                    return
+
+    def grep_top(self, pattern, length=None, count=10, use_cromulence=False):
+        """
+        Search the wordlist for the best `count` words matching a given
+        pattern. Yield them in descending order of log probability, or of
+        cromulence if `use_cromulence` is True.
+
+        Yields (logprob, text) for each match.
+
+        Each greppable file is (nearly) in descending order of frequency, so
+        instead of finding every match, this reads through the files for all
+        the lengths at once, merging their matches in order. It stops as soon
+        as no line that hasn't been read yet could be better than the matches
+        it has already yielded.
+        """
+        pattern = unspaced_lower(pattern)
+        if is_exact(pattern):
+            yield from self.grep(pattern)
+            return
+        positions = regex_positions(pattern)
+        logtotal = self._load_logtotal()
+
+        def score(freq, cur_length):
+            logprob = log(freq) - logtotal
+            if use_cromulence:
+                return logprob / (cur_length + 1)
+            return logprob
+
+        # `heads` holds the next unread match from each length, keyed by the
+        # best score that it or any later line of its file could have.
+        # `candidates` holds matches that have been read, keyed by their
+        # actual score. Both are min-heaps of negated scores.
+        heads = []
+        candidates = []
+
+        def push_head(cur_length, mm, lines):
+            start = next(lines, None)
+            if start is not None:
+                freq = int(self._read_grep_fields(mm, start)[1])
+                # The files are sorted by the integer part of
+                # freq / (length + 1), so later lines can have a frequency
+                # that's higher than this one, but only by a little.
+                bound = (freq // (cur_length + 1) + 1) * (cur_length + 1) - 1
+                heapq.heappush(heads, (
+                    -score(bound, cur_length), cur_length, start, freq, mm, lines
+                ))
+
+        for cur_length in self._grep_lengths(pattern, length):
+            push_head(
+                cur_length, self._grep_map(cur_length),
+                iter(self._grep_lines(pattern, cur_length, positions))
+            )
+
+        num_found = 0
+        while heads or candidates:
+            if candidates and (not heads or candidates[0][0] <= heads[0][0]):
+                _, cur_length, start, mm = heapq.heappop(candidates)
+                num_found += 1
+                yield self._read_grep_line(mm, start)
+                if num_found >= count:
+                    return
+            else:
+                _, cur_length, start, freq, mm, lines = heapq.heappop(heads)
+                heapq.heappush(candidates, (
+                    -score(freq, cur_length), cur_length, start, mm
+                ))
+                push_head(cur_length, mm, lines)
+
+    def _grep_lengths(self, pattern, length=None):
+        """
+        Get the range of lengths of greppable files that could contain
+        matches for a pattern.
+        """
         if length:
             minlen = maxlen = length
         else:
@@ -198,33 +695,127 @@ class Wordlist:
             minlen = 1
         if maxlen > self.max_indexed_length:
             maxlen = self.max_indexed_length
+        return range(minlen, maxlen + 1)
 
-        num_found = 0
-        for cur_length in range(minlen, maxlen + 1):
-            if cur_length not in self._grep_maps:
-                mm = self._open_mmap(
-                    wordlist_path_from_name(
-                        'greppable/%s.%d' % (self.name, cur_length)
-                    )
-                )
-                self._grep_maps[cur_length] = mm
+    def _grep_lines(self, pattern, length, positions):
+        """
+        Find the lines of the greppable file for a given length that match a
+        pattern, using the positional index if we can. Yields the offset
+        where each line starts, in the order of the file.
+        """
+        if positions is not None:
+            if len(positions) != length:
+                return
+            index = self._grep_index(length)
+            if index is not None:
+                yield from self._grep_indexed(index, positions)
+                return
+        yield from self._grep_scan(self._grep_map(length), pattern, length)
+
+    def _grep_map(self, length):
+        if length not in self._grep_maps:
+            self._grep_maps[length] = self._open_mmap(
+                wordlist_path_from_name('greppable/%s.%d' % (self.name, length))
+            )
+        return self._grep_maps[length]
+
+    def _grep_index(self, length):
+        """
+        Load the positional index of the greppable words of a given length,
+        or return None if it hasn't been built or was built from a different
+        version of the file, in which case grepping falls back on a scan.
+        """
+        if length not in self._grep_indexes:
+            index = None
+            path = grep_index_path(self.name, length)
+            if os.path.exists(path):
+                mm = self._grep_map(length)
+                with np.load(path) as data:
+                    if list(data['source']) == greppable_signature(mm):
+                        index = (data['bits'], line_starts(mm))
+                    else:
+                        logger.warning("Ignoring out-of-date grep index %s", path)
+            self._grep_indexes[length] = index
+        return self._grep_indexes[length]
+
+    def _grep_scan(self, mm, pattern, length):
+        """
+        Find the lines of a greppable file that match a regex, by running the
+        regex over the whole file. Yields the offset where each line starts.
+        """
+        pbytes = pattern.encode('ascii')
+        slug_regex = re.compile(pbytes)
+        if not is_greppable_v2(mm) and slug_regex.fullmatch(mm, 0, length):
+            yield 0
+
+        # The lookbehind makes the match end at the end of a slug, so that a
+        # pattern such as '.*' can't run on into the other fields of the line.
+        regex = re.compile(b'\n(?:' + pbytes + b')(?<=\n[a-z]{%d}),' % length)
+        pos = 0
+        while True:
+            match = regex.search(mm, pos)
+            if match is None:
+                return
+            start = match.start() + 1
+            if match.end() - start == length + 1:
+                yield start
+                pos = match.end()
             else:
-                mm = self._grep_maps[cur_length]
-            pbytes = pattern.encode('ascii')
-            pattern1 = b'^' + pbytes + b','
-            pattern2 = b'\n' + pbytes + b','
-            match = re.match(pattern1, mm)
-            if match:
-                found = mm[match.start():match.end() - 1].decode('ascii')
-                num_found += 1
-                yield self.segment_logprob(found)
-            for match in re.finditer(pattern2, mm):
-                found = mm[match.start() + 1:match.end() - 1].decode('ascii')
+                # A negated character class let the match run across lines,
+                # which may have hidden a match of the first line by itself.
+                if slug_regex.fullmatch(mm, start, start + length):
+                    yield start
+                pos = start
 
-                num_found += 1
-                yield self.segment_logprob(found)
-                if num_found >= count:
-                    return
+    def _grep_indexed(self, index, positions):
+        """
+        Find the lines of a greppable file that match a list of allowed
+        letters at each position, by intersecting the bitsets of lines that
+        have those letters in those positions. Yields the offset where each
+        line starts.
+        """
+        bits, starts = index
+        mask = None
+        for pos, letters in enumerate(positions):
+            if letters is None:
+                continue
+            rows = bits[pos, [ord(letter) - ASCII_a for letter in letters]]
+            allowed = np.bitwise_or.reduce(rows, axis=0)
+            if mask is None:
+                mask = allowed
+            else:
+                mask = mask & allowed
+        if mask is None:
+            line_numbers = range(len(starts))
+        else:
+            line_numbers = np.flatnonzero(np.unpackbits(mask)[:len(starts)])
+        for line_number in line_numbers:
+            yield starts[line_number]
+
+    def _read_grep_line(self, mm, start):
+        """
+        Get the log probability and text of the word on the line of a
+        greppable file that starts at `start`.
+
+        Version 2 files have the frequency and text right there on the line.
+        Version 1 files only have the slug and frequency, so the text has to
+        be looked up.
+        """
+        fields = self._read_grep_fields(mm, start)
+        if len(fields) < 3:
+            return self.segment_logprob(fields[0])
+        slug, freq, text = fields
+        return log(int(freq)) - self._load_logtotal(), text
+
+    def _read_grep_fields(self, mm, start):
+        """
+        Split the line of a greppable file that starts at `start` into its
+        fields.
+        """
+        end = mm.find(b'\n', start)
+        if end == -1:
+            end = len(mm)
+        return mm[start:end].decode('utf-8').split(',', 2)
 
     def grep_one(self, pattern, length=None):
         """
@@ -242,6 +833,14 @@ class Wordlist:
         If the length is known, it can be specified as an additional argument.
         """
         pattern = unspaced_lower(pattern)
+        key = (pattern, length, count, use_cromulence)
+        found = self._search_cache.get(key)
+        if found is None:
+            found = self._search(pattern, length, count, use_cromulence)
+            self._search_cache[key] = found
+        return found
+
+    def _search(self, pattern, length, count, use_cromulence):
         if is_exact(pattern):
             if use_cromulence:
                 return [self.cromulence(pattern)]
@@ -253,31 +852,52 @@ class Wordlist:
             # If there are variable-length matches, the dynamic programming
             # strategy won't work, so fall back on grepping for complete
             # matches in the wordlist.
-            items = list(self.grep(pattern, length=length))
-            items.sort(reverse=True)
-            found = items[:count]
+            found = list(self.grep_top(
+                pattern, length=length, count=count,
+                use_cromulence=use_cromulence
+            ))
         else:
             if length is not None and not (minlen <= length <= maxlen):
                 # This length is impossible, so there are no results.
                 return []
 
+            # Many slices of the pattern come out the same, so each distinct
+            # slice is only grepped once.
+            indices = regex_indices(pattern, maxlen)
+            found_by_segment = {}
+
+            def grep_slice(left_edge, right_edge):
+                segment = indices[left_edge:right_edge]
+                if None in segment:
+                    return []
+                segment = ''.join(segment)
+                if segment not in found_by_segment:
+                    found_by_segment[segment] = self._grep_segment(segment, count)
+                return found_by_segment[segment]
+
             best_partial_results = [[]]
             for right_edge in range(1, maxlen + 1):
-                segment = regex_slice(pattern, 0, right_edge)
-                results_this_step = list(islice(self.grep(segment), count))
+                top = []
+                for item in grep_slice(0, right_edge):
+                    _push_top(top, count, item)
 
                 for left_edge in range(1, right_edge):
                     if best_partial_results[left_edge]:
-                        segment = regex_slice(pattern, left_edge, right_edge)
-                        found = list(islice(self.grep(segment), count))
+                        found = grep_slice(left_edge, right_edge)
+                        if not found:
+                            continue
+                        # Both lists are sorted, best first, so we can stop
+                        # as soon as the combinations can't make the top.
                         for lprob, ltext in best_partial_results[left_edge]:
+                            if _below_top(top, count, lprob + found[0][0] - log(10)):
+                                break
                             for rprob, rtext in found:
-                                results_this_step.append((
-                                    lprob + rprob - log(10),
-                                    ltext + ' ' + rtext
-                                ))
-                results_this_step.sort(reverse=True)
-                best_partial_results.append(results_this_step[:count])
+                                logprob = lprob + rprob - log(10)
+                                if _below_top(top, count, logprob):
+                                    break
+                                _push_top(top, count, (logprob, ltext + ' ' + rtext))
+                top.sort(reverse=True)
+                best_partial_results.append(top)
             found = best_partial_results[-1]
 
         if not use_cromulence:
@@ -290,6 +910,19 @@ class Wordlist:
             results.sort(reverse=True)
             return results
 
+    def _grep_segment(self, segment, count):
+        """
+        Get the first `count` results of grepping for a fixed-length segment
+        of a pattern, sorted best first. The results are remembered in a
+        bounded cache, because the same segments come up again and again in
+        searches.
+        """
+        key = (segment, count)
+        found = self._segment_cache.get(key)
+        if found is None:
+            found = sorted(islice(self.grep(segment), count), reverse=True)
+            self._segment_cache[key] = found
+        return found
 
     def _iter_query(self, query, params=()):
         c = self.db.cursor()
@@ -329,29 +962,62 @@ class Wordlist:
             "SELECT slug, freq, text FROM words ORDER BY freq/(length(slug) + 1) DESC"
         )
 
-    def find_sub_alphagrams(self, alpha, wildcard=False):
+    def find_sub_alphagrams(self, alpha, wildcard=False, max_length=None):
+        """
+        Find the alphagrams of words in the wordlist (of at least 2 letters)
+        that can be made from the letters of `alpha`, yielding them in order
+        of the frequency of their most common word.
+
+        `wildcard` is the number of letters that can be used beyond those in
+        `alpha`; True means 1. The longest alphagrams found are 2 letters
+        shorter than the letters available, unless `max_length` is given.
+
+        This compares the letter counts of `alpha` against the whole table
+        from `write_letterbags` at once. The table is sorted by length, so
+        leaving out the long alphagrams is just a slice.
+        """
         if len(alpha) + wildcard < 2:
             return
-        abytes = alphabytes(alpha)
-        max_length = min(len(alpha) + wildcard - 2, self.max_indexed_length)
+        if max_length is None:
+            max_length = len(alpha) + wildcard - 2
+        max_length = min(max_length, self.max_indexed_length)
         if max_length < 2:
             max_length = 2
-        if max_length not in self._alpha_maps:
-            mm = self._open_mmap(
-                wordlist_path_from_name(
-                    'alphabytes/%s.%d' % (self.name, max_length)
-                )
-            )
-            self._alpha_maps[max_length] = mm
-        else:
-            mm = self._alpha_maps[max_length]
+        alphagrams, counts, ranks, length_starts = self.letterbag_table()
+        start = length_starts[2]
+        end = length_starts[max_length + 1]
+        rows = counts[start:end]
+        target = np.array(letters_to_vec(alpha), dtype=np.int16)
         if wildcard:
-            pattern = b'\n[' + abytes + b']*.[' + abytes + b']*\n'
+            excess = np.maximum(rows - target, 0).sum(axis=1)
+            fits = excess <= int(wildcard)
         else:
-            pattern = b'\n[' + abytes + b']+\n'
-        for match in re.finditer(pattern, mm):
-            found = mm[match.start() + 1:match.end() - 1]
-            yield found
+            fits = (rows <= target).all(axis=1)
+        found = np.flatnonzero(fits) + start
+        found = found[np.argsort(ranks[found], kind='stable')]
+        for found_alpha in alphagrams[found]:
+            yield found_alpha.decode('ascii')
+
+    def letterbag_table(self):
+        """
+        Load the table written by `write_letterbags`. Returns a tuple of
+        arrays, with a row for each distinct alphagram in the wordlist,
+        sorted by length:
+
+        - the alphagrams, as bytes
+        - their letter counts, with a row of 26 uint8 values for each one,
+          which is the letterbag of the alphagram (see utils.string)
+        - the rank of each alphagram by the frequency of its most common word
+        - the row where the alphagrams of each length start, indexed by
+          length, up to `max_indexed_length + 1`
+        """
+        if self._letterbags is None:
+            with np.load(letterbags_path(self.name)) as data:
+                self._letterbags = (
+                    data['alphagrams'], data['counts'], data['ranks'],
+                    data['length_starts']
+                )
+        return self._letterbags
 
     def find_by_alphagram(self, alphagram):
         return self._iter_query(
@@ -362,6 +1028,8 @@ class Wordlist:
         )
 
     def find_by_alphagram_raw(self, alphagram):
+        if self.use_alphagram_index:
+            return iter(self._load_anagram_indexes()[0].get(alphagram, ()))
         return self._iter_singletons(
             "SELECT w.slug from wordplay wp, words w "
             "WHERE wp.slug=w.slug and wp.alphagram=? "
@@ -369,7 +1037,37 @@ class Wordlist:
             (alphagram,)
         )
 
+    def find_by_alphagram_raw_many(self, alphagrams):
+        """
+        The batched form of `find_by_alphagram_raw`. Returns a dictionary
+        mapping each alphagram to a list of the slugs that have it, most
+        frequent first.
+        """
+        alphagrams = list(dict.fromkeys(alphagrams))
+        if self.use_alphagram_index:
+            index = self._load_anagram_indexes()[0]
+            return {
+                alphagram: list(index.get(alphagram, ()))
+                for alphagram in alphagrams
+            }
+        results = {alphagram: [] for alphagram in alphagrams}
+        c = self.db.cursor()
+        for chunk_start in range(0, len(alphagrams), self.max_query_params):
+            chunk = alphagrams[chunk_start:chunk_start + self.max_query_params]
+            c.execute(
+                "SELECT wp.alphagram, w.slug FROM wordplay wp, words w "
+                "WHERE wp.slug=w.slug and wp.alphagram IN (%s) "
+                "ORDER BY freq DESC"
+                % ','.join('?' * len(chunk)),
+                chunk
+            )
+            for alphagram, slug in c.fetchall():
+                results[alphagram].append(slug)
+        return results
+
     def find_by_anahash_raw(self, anahash):
+        if self.use_alphagram_index:
+            return iter(self._load_anagram_indexes()[1].get(anahash, ()))
         return self._iter_singletons(
             "SELECT w.slug from wordplay wp, words w "
             "WHERE wp.slug=w.slug and wp.anahash=? "
@@ -377,6 +1075,51 @@ class Wordlist:
             (anahash,)
         )
 
+    def find_by_anahash_letterbags(self, anahash):
+        """
+        Get the slugs with a given anahash, most frequent first, as a list of
+        (slug, letterbag) pairs, so that anagram searches that try the same
+        anahash again don't have to count the letters of its words again.
+
+        Slugs with too many of the same letter to fit in a letterbag are left
+        out, as they are from `write_letterbags`.
+        """
+        found = self._anahash_bag_cache.get(anahash)
+        if found is None:
+            found = []
+            for slug in self.find_by_anahash_raw(anahash):
+                try:
+                    found.append((slug, letterbag(slug)))
+                except ValueError:
+                    pass
+            self._anahash_bag_cache[anahash] = found
+        return found
+
+    def _load_anagram_indexes(self):
+        """
+        Load the in-memory indexes used when `alphagram_index` is on: two
+        dictionaries, mapping each alphagram and each anahash to a tuple of
+        the slugs that have it, most frequent first.
+        """
+        if self._alphagram_index is None:
+            by_alphagram = defaultdict(list)
+            by_anahash = defaultdict(list)
+            c = self.db.cursor()
+            c.execute(
+                "SELECT wp.alphagram, wp.anahash, w.slug FROM wordplay wp, words w "
+                "WHERE wp.slug=w.slug ORDER BY freq DESC"
+            )
+            for alphagram, anahash, slug in c:
+                by_alphagram[alphagram].append(slug)
+                by_anahash[anahash].append(slug)
+            self._alphagram_index = {
+                alphagram: tuple(slugs) for alphagram, slugs in by_alphagram.items()
+            }
+            self._anahash_index = {
+                anahash: tuple(slugs) for anahash, slugs in by_anahash.items()
+            }
+        return self._alphagram_index, self._anahash_index
+
     def find_by_consonantcy(self, consonants):
         return self._iter_query(
             "SELECT w.* from wordplay wp, words w "
@@ -392,7 +1135,7 @@ class Wordlist:
         return "Wordlist(%r)" % self.name
 
     def _open_mmap(self, path):
-        openfile = open(path, 'r+b')
+        openfile = open(path, 'rb')
         mm = mmap.mmap(openfile.fileno(), 0, access=mmap.ACCESS_READ)
         return mm
 
@@ -401,6 +1144,7 @@ class Wordlist:
         """
         Build a SQLite database from a flat wordlist file.
         """
+        self._invalidate_results()
         self.db.execute("DROP TABLE IF EXISTS words")
         for statement in self.schema:
             self.db.execute(statement)
@@ -427,7 +1171,18 @@ class Wordlist:
                 (total,)
             )
 
+    def write_packed_table(self):
+        """
+        Write the `words` table into a packed file that can be used with
+        `backend='packed'`.
+        """
+        write_packed_table(
+            packed_table_path(self.name),
+            self._iter_query("SELECT slug, freq, text FROM words")
+        )
+
     def build_wordplay(self):
+        self._invalidate_results()
         self.db.execute("DROP TABLE IF EXISTS wordplay")
         for statement in self.wordplay_schema:
             self.db.execute(statement)
@@ -448,53 +1203,106 @@ class Wordlist:
     def write_greppable_lists(self):
         """
         Separate the words by length and write them into separate files.
+
+        These are version 2 greppable files: they start with a header line,
+        and each line after that contains a slug, its frequency, and its
+        text, so that grepping needs no further lookups.
         """
         os.makedirs(wordlist_path('greppable'), exist_ok=True)
         length_files = {
             length: open(
                 wordlist_path_from_name(
                     'greppable/%s.%d' % (self.name, length)
-                ), 'w', encoding='ascii'
+                ), 'wb'
             )
             for length in range(1, self.max_indexed_length + 1)
         }
+        for out in length_files.values():
+            out.write(GREPPABLE_V2_HEADER)
         i = 0
         for slug, freq, text in self.iter_all_by_cromulence():
             length = len(slug)
             if 1 <= length <= self.max_indexed_length:
                 out = length_files[length]
-                print("%s,%d" % (slug, freq), file=out)
+                out.write(("%s,%d,%s\n" % (slug, freq, text)).encode('utf-8'))
             if i % 10000 == 0:
                 print("\t%s,%d" % (slug, freq))
             i += 1
         for file in length_files.values():
             file.close()
 
-    def write_alphabytes(self):
-        os.makedirs(wordlist_path('alphabytes'), exist_ok=True)
-        length_files = {
-            length: open(
-                wordlist_path_from_name(
-                    'alphabytes/%s.%d' % (self.name, length)
-                ), 'wb'
+    def write_grep_index(self):
+        """
+        Build a positional index for each greppable file. For each position
+        in the words and each letter, it stores a bitset of the lines that
+        have that letter in that position, so that patterns such as '.a.b.c..'
+        can be matched by intersecting bitsets instead of scanning the file.
+
+        The index also stores the size and checksum of the file it was built
+        from, so that it isn't used with a file that has changed since.
+        """
+        for length in range(1, self.max_indexed_length + 1):
+            mm = self._grep_map(length)
+            starts = line_starts(mm)
+            data = np.frombuffer(mm, dtype=np.uint8)
+            letters = data[starts[:, np.newaxis] + np.arange(length)] - ASCII_a
+            bits = np.zeros((length, 26, (len(starts) + 7) // 8), dtype=np.uint8)
+            for pos in range(length):
+                for letter in range(26):
+                    bits[pos, letter] = np.packbits(letters[:, pos] == letter)
+            np.savez(
+                grep_index_path(self.name, length), bits=bits,
+                source=np.array(greppable_signature(mm), dtype=np.int64)
             )
-            for length in range(2, self.max_indexed_length + 1)
-        }
-        i = 0
+            print("\t%d: %d words" % (length, len(starts)))
+
+    def write_letterbags(self):
+        """
+        Store the letter counts of every distinct alphagram in the wordlist,
+        so that anagram searches can test which words fit in a set of letters
+        without counting their letters again. The alphagrams are sorted by
+        length, and then by the frequency of their most common word.
+
+        A letterbag can hold at most LETTERBAG_MAX_COUNT of one letter, so
+        alphagrams with more than that are left out, and anagram searches
+        that use the letterbags won't find their words. The number of
+        alphagrams left out is printed.
+        """
+        os.makedirs(wordlist_path('letterbags'), exist_ok=True)
+        alphagrams = []
+        counts = []
         used = set()
+        dropped = 0
         for slug, freq, text in self.iter_all_by_freq():
-            if len(slug) >= 2:
-                maxlen = self.max_indexed_length
-                abytes = alphabytes(slug)
-                if abytes not in used:
-                    for length in range(len(slug), maxlen + 1):
-                        out = length_files[length]
-                        out.write(b'\n')
-                        out.write(abytes)
-                        used.add(abytes)
-        for file in length_files.values():
-            file.write(b'\n')
-            file.close()
+            if 1 <= len(slug) <= self.max_indexed_length:
+                alpha = alphagram(slug)
+                if alpha not in used:
+                    vec = letters_to_vec(alpha)
+                    if max(vec) <= LETTERBAG_MAX_COUNT:
+                        alphagrams.append(alpha.encode('ascii'))
+                        counts.append(vec)
+                    else:
+                        dropped += 1
+                    used.add(alpha)
+        alphagrams = np.array(alphagrams, dtype='S%d' % self.max_indexed_length)
+        counts = np.array(counts, dtype=np.uint8).reshape(-1, 26)
+        lengths = counts.sum(axis=1)
+        by_length = np.argsort(lengths, kind='stable')
+        np.savez_compressed(
+            letterbags_path(self.name),
+            alphagrams=alphagrams[by_length],
+            counts=counts[by_length],
+            ranks=by_length.astype(np.uint32),
+            length_starts=np.searchsorted(
+                lengths[by_length], np.arange(self.max_indexed_length + 2)
+            )
+        )
+        print("\t%d alphagrams" % len(alphagrams))
+        if dropped:
+            print(
+                "\tLeft out %d alphagrams with more than %d of one letter"
+                % (dropped, LETTERBAG_MAX_COUNT)
+            )
 
     def test_cromulence(self):
         """
@@ -564,6 +1372,131 @@ class Wordlist:
         return results[:count]
 
 
+def _best_segmentation(slug, spans, segments):
+    """
+    Find the most likely way to divide a slug into words, given the end
+    positions of the words at each start position (`spans`) and the log
+    probability and text of each of those words (`segments`). Returns the
+    log probability and the spaced text.
+
+    If no sequence of words covers a prefix of the text, that prefix gets a
+    log probability of -1000 and is left unspaced.
+    """
+    best_logprobs, best_partial_results = _segmentation_table(slug, spans, segments)
+    return best_logprobs[-1], best_partial_results[-1]
+
+
+def _segmentation_table(slug, spans, segments):
+    """
+    Do the work of `_best_segmentation`, returning lists of the log
+    probability and text of the best spacing of every prefix of the slug.
+    """
+    n = len(slug)
+    best_partial_results = [''] + [slug[:right_edge] for right_edge in range(1, n + 1)]
+    best_logprobs = [0.] + [-1000.] * n
+    reachable = [True] + [False] * n
+    for left_edge in range(n):
+        if not reachable[left_edge]:
+            # Nothing that follows an unreachable prefix can beat -1000.
+            continue
+        lprob = best_logprobs[left_edge]
+        ltext = best_partial_results[left_edge]
+        for right_edge in spans[left_edge]:
+            rprob, rtext = segments[slug[left_edge:right_edge]]
+            reachable[right_edge] = True
+            if left_edge == 0:
+                best_logprobs[right_edge] = rprob
+                best_partial_results[right_edge] = rtext
+            else:
+                totalprob = lprob + rprob - log(10)
+                if totalprob > best_logprobs[right_edge]:
+                    best_logprobs[right_edge] = totalprob
+                    best_partial_results[right_edge] = ltext + ' ' + rtext
+    return best_logprobs, best_partial_results
+
+
+def _suffix_segmentation_logprobs(slug, spans, segments):
+    """
+    Find the log probability of the best spacing of every suffix of a slug,
+    like `_segmentation_table` working backwards. Suffixes that can't be
+    divided into words get -1000.
+    """
+    n = len(slug)
+    best_logprobs = [-1000.] * n + [0.]
+    for left_edge in reversed(range(n)):
+        for right_edge in spans[left_edge]:
+            logprob = segments[slug[left_edge:right_edge]][0]
+            if right_edge < n:
+                logprob += best_logprobs[right_edge] - log(10)
+            if logprob > best_logprobs[left_edge]:
+                best_logprobs[left_edge] = logprob
+    return best_logprobs
+
+
+def _crossing_spans(candidate, pieces, trie):
+    """
+    Find the words in a candidate made of pieces that start in one piece and
+    end in a later one. Returns the candidate's slug, and a list of the
+    (start, end) positions of those words.
+    """
+    slug = ''.join(candidate)
+    crossing = []
+    boundary = 0
+    for piece in candidate[:-1]:
+        piece_start = boundary
+        boundary += len(piece)
+        for start, lo, hi in pieces[piece][2]:
+            resume = (boundary, lo, hi)
+            for end in trie.prefix_ends(slug, piece_start + start, resume):
+                crossing.append((piece_start + start, end))
+    return slug, crossing
+
+
+def _crossing_bound(candidate, pieces, left_edge, right_edge, word_logprob):
+    """
+    Find an upper bound on the log probability of any spacing of a candidate
+    made of pieces that includes the word from `left_edge` to `right_edge`.
+
+    If the text before the word is all in the first piece, the best it can
+    do is that piece's best spacing of it; if the text after the word is all
+    in the last piece, likewise. Otherwise all we know is that every word has
+    a log probability of at most 0.
+    """
+    bound = word_logprob
+    first = candidate[0]
+    last = candidate[-1]
+    n = sum(len(piece) for piece in candidate)
+    if left_edge > 0:
+        bound -= log(10)
+        if left_edge <= len(first):
+            bound += pieces[first][3][left_edge]
+    if right_edge < n:
+        bound -= log(10)
+        last_start = n - len(last)
+        if right_edge >= last_start:
+            bound += pieces[last][4][right_edge - last_start]
+    return bound
+
+
+def _push_top(heap, count, item):
+    """
+    Add an item to a min-heap that keeps only the `count` largest items
+    that are added to it.
+    """
+    if len(heap) < count:
+        heapq.heappush(heap, item)
+    elif count > 0 and item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def _below_top(heap, count, logprob):
+    """
+    Is the heap full of results that are all better than this log
+    probability, so that nothing with it could be added?
+    """
+    return len(heap) >= count and (count == 0 or logprob < heap[0][0])
+
+
 def wordlist_path_from_name(name):
     """
     Get the path to the plain-text form of a wordlist.
@@ -571,11 +1504,69 @@ def wordlist_path_from_name(name):
     return wordlist_path(name + '.txt')
 
 
-def wordlist_db_connection(filename):
+def grep_index_path(name, length):
+    """
+    Get the path to the positional index of the greppable words of a given
+    length.
+    """
+    return wordlist_path('greppable/%s.%d.bits.npz' % (name, length))
+
+
+def letterbags_path(name):
+    """
+    Get the path to the table of letter counts of a wordlist's alphagrams.
+    """
+    return wordlist_path('letterbags/%s.npz' % name)
+
+
+def is_greppable_v2(mm):
+    """
+    Is this memory-mapped greppable file in version 2 of the format?
+    """
+    return mm[:len(GREPPABLE_V2_HEADER)] == GREPPABLE_V2_HEADER
+
+
+def greppable_signature(mm):
+    """
+    Get the size and CRC-32 checksum of a memory-mapped greppable file, which
+    its positional index records to show which version of the file it's for.
+    """
+    return [len(mm), zlib.crc32(mm)]
+
+
+def line_starts(mm):
+    """
+    Get the offsets where the lines of words start in a memory-mapped
+    greppable file, as an array. The header line of a version 2 file is
+    skipped.
+    """
+    data = np.frombuffer(mm, dtype=np.uint8)
+    starts = np.concatenate([[0], np.flatnonzero(data == ord('\n')) + 1])
+    starts = starts[starts < len(data)]
+    if is_greppable_v2(mm):
+        starts = starts[1:]
+    return starts
+
+
+def packed_table_path(name):
+    """
+    Get the path to the packed form of a wordlist's table of words, which
+    lives next to its SQLite database.
+    """
+    return db_path(name + '.wl.packed')
+
+
+def wordlist_db_connection(filename, read_only=False):
     """
     Get a SQLite DB connection for a wordlist. (The DB must previously
     have been built.)
+
+    A read-only connection can't change the DB, and fails if the DB doesn't
+    exist yet instead of creating an empty one.
     """
+    if read_only:
+        uri = pathlib.Path(db_path(filename)).resolve().as_uri() + '?mode=ro'
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
     os.makedirs(db_path(''), exist_ok=True)
     return sqlite3.connect(db_path(filename), check_same_thread=False)
 
@@ -641,22 +1632,52 @@ def build_extras(name):
     """
     Load a wordlist with a particular name, and create additional files that
     enable more operations on the wordlist -- a file that can be mmapped and
-    grepped quickly, a file of 'alphabytes' that can be mmapped and grepped to
-    find anagrams, and a database of 'wordplay' properties of words.
+    grepped quickly, a table of the letter counts of its alphagrams for
+    finding anagrams, a database of 'wordplay' properties of words, and a
+    packed table of words for memory-mapped lookups.
     """
     dbw = Wordlist(name)
     dbw.build_db()
+    dbw.write_packed_table()
     dbw.write_greppable_lists()
-    dbw.write_alphabytes()
+    dbw.write_grep_index()
+    dbw.write_letterbags()
     dbw.build_wordplay()
 
 
-WORDS = Wordlist('wordfreq-1.6-en')
-SCRAB = Wordlist('scrab')
+RESULTS = DiskCache(db_path('results.db'), max_bytes=RESULT_CACHE_MAX_BYTES)
+WORDS = Wordlist(
+    'wordfreq-1.6-en', cache_size=200000, negative_cache_size=100000,
+    result_cache=RESULTS
+)
+SCRAB = Wordlist(
+    'scrab', cache_size=20000, negative_cache_size=20000, result_cache=RESULTS
+)
 
 
 def cromulence(text):
-    return WORDS.cromulence(text)
+    """
+    Get the cromulence of a text in the main wordlist. This is what the !crom
+    command calls, so the results are kept in the result cache.
+    """
+    return WORDS.cached_result(
+        ('cromulence', slugify(text)), lambda: WORDS.cromulence(text)
+    )
+
+
+def search(pattern, length=None, count=10, use_cromulence=False):
+    """
+    Search the main wordlist for a pattern, like `Wordlist.search`, keeping
+    the results in the result cache.
+    """
+    key = ('search', unspaced_lower(pattern), length, count, use_cromulence)
+    return WORDS.cached_result(
+        key, lambda: WORDS.search(pattern, length, count, use_cromulence)
+    )
+
+
+def cromulence_batch(texts):
+    return WORDS.cromulence_batch(texts)
 
 
 def find_by_alphagram(text):
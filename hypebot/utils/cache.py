@@ -0,0 +1,286 @@
+"""
+Caches with bounded size: LRUCache, in memory, and DiskCache, which keeps
+results in a SQLite file so they last across processes and restarts.
+"""
+import os
+import pickle
+import sqlite3
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+# A cache hit only records that its entry was used if the last record is
+# older than this many seconds, so that repeated hits don't all write.
+LAST_USED_RESOLUTION = 60.
+
+
+class LRUCache:
+    """
+    A dictionary-like cache that holds at most `maxsize` items. When it's
+    full, adding an item evicts the item that was least recently used.
+    A `maxsize` of None makes the cache unbounded.
+
+    The cache counts its hits, misses, and evictions, so you can tell how
+    many lookups it's actually serving.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Get the value for a key, marking it as recently used. Returns
+        `default` if the key isn't cached.
+        """
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if self.maxsize == 0:
+            return
+        items = self._items
+        if key in items:
+            items.move_to_end(key)
+        items[key] = value
+        if self.maxsize is not None and len(items) > self.maxsize:
+            items.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        # This doesn't count as a use of the key, or as a hit or miss.
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self):
+        """
+        Get the counters describing how this cache has been used.
+        """
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __repr__(self):
+        return "LRUCache(maxsize=%r, size=%d)" % (self.maxsize, len(self._items))
+
+
+class DiskCache:
+    """
+    A cache of results in a SQLite database at `path`, which can be shared
+    by several processes and survives restarts. When the pickled keys and
+    values add up to more than `max_bytes`, the least recently used entries
+    are evicted, down to `low_water` of that size.
+
+    Every entry belongs to a `namespace` with a `version`, such as the name
+    of a wordlist and the version of its build. The first time a namespace
+    is used with a new version, its entries from other versions are
+    dropped, because they may no longer be right.
+
+    Each write is one `BEGIN IMMEDIATE` transaction, which takes the write
+    lock before reading anything, so two processes can't both read the
+    total size and then both update it. The database is opened the first
+    time the cache is used. The cache counts its hits and misses, in total
+    and for each kind of key, which is the first element of the key tuple.
+    """
+    schema = [
+        """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            namespace TEXT,
+            version TEXT,
+            value BLOB,
+            size INT,
+            last_used REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)",
+        "CREATE INDEX IF NOT EXISTS results_namespace ON results (namespace, version)",
+        "CREATE TABLE IF NOT EXISTS total_size (size INT)",
+    ]
+
+    def __init__(self, path, max_bytes, low_water=0.9):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._db = None
+        self._versions_checked = set()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+
+    def _get_db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Transactions are started explicitly, by _writing.
+            db = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False,
+                isolation_level=None
+            )
+            # Let other processes read while one is writing, without
+            # waiting for every write to reach the disk.
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with self._writing(db):
+                for statement in self.schema:
+                    db.execute(statement)
+                if db.execute("SELECT COUNT(*) FROM total_size").fetchone()[0] == 0:
+                    db.execute("INSERT INTO total_size (size) VALUES (0)")
+            self._db = db
+        return self._db
+
+    @contextmanager
+    def _writing(self, db):
+        """
+        Run the statements in a `with` block as one transaction that holds
+        the write lock from the start.
+        """
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _check_version(self, namespace, version):
+        if (namespace, version) not in self._versions_checked:
+            self.invalidate(namespace, keep_version=version)
+            self._versions_checked.add((namespace, version))
+
+    def get(self, namespace, version, key, default=None):
+        """
+        Get the cached value for a key, marking it as recently used. Returns
+        `default` if the key isn't cached.
+        """
+        db = self._get_db()
+        self._check_version(namespace, version)
+        db_key = repr((namespace, version) + tuple(key))
+        row = db.execute(
+            "SELECT value, last_used FROM results WHERE key=?", (db_key,)
+        ).fetchone()
+        if row is None:
+            self.misses[key[0]] += 1
+            return default
+        value, last_used = row
+        now = time.time()
+        if now - last_used > LAST_USED_RESOLUTION:
+            with self._writing(db):
+                db.execute(
+                    "UPDATE results SET last_used=? WHERE key=?", (now, db_key)
+                )
+        self.hits[key[0]] += 1
+        return pickle.loads(value)
+
+    def put(self, namespace, version, key, value):
+        """
+        Cache a value for a key, evicting old entries if the cache is full.
+        """
+        db = self._get_db()
+        self._check_version(namespace, version)
+        db_key = repr((namespace, version) + tuple(key))
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(db_key) + len(blob)
+        if size > self.max_bytes:
+            return
+        with self._writing(db):
+            old = db.execute(
+                "SELECT size FROM results WHERE key=?", (db_key,)
+            ).fetchone()
+            old_size = 0 if old is None else old[0]
+            db.execute(
+                "INSERT OR REPLACE INTO results "
+                "(key, namespace, version, value, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (db_key, namespace, version, blob, size, time.time())
+            )
+            db.execute("UPDATE total_size SET size = size + ?", (size - old_size,))
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT size FROM total_size").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * self.low_water
+        evicted = []
+        for db_key, size in db.execute(
+            "SELECT key, size FROM results ORDER BY last_used"
+        ):
+            if total <= target:
+                break
+            evicted.append((db_key,))
+            total -= size
+        db.executemany("DELETE FROM results WHERE key=?", evicted)
+        db.execute("UPDATE total_size SET size=?", (total,))
+        self.evictions += len(evicted)
+
+    def invalidate(self, namespace, keep_version=None):
+        """
+        Drop the entries in a namespace, except the ones for `keep_version`.
+        """
+        db = self._get_db()
+        with self._writing(db):
+            freed = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results "
+                "WHERE namespace=? AND version IS NOT ?",
+                (namespace, keep_version)
+            ).fetchone()[0]
+            db.execute(
+                "DELETE FROM results WHERE namespace=? AND version IS NOT ?",
+                (namespace, keep_version)
+            )
+            db.execute("UPDATE total_size SET size = size - ?", (freed,))
+        self._versions_checked = {
+            checked for checked in self._versions_checked
+            if checked[0] != namespace
+        }
+
+    def clear(self):
+        db = self._get_db()
+        with self._writing(db):
+            db.execute("DELETE FROM results")
+            db.execute("UPDATE total_size SET size=0")
+        self._versions_checked.clear()
+
+    def stats(self):
+        """
+        Get the counters describing how this cache has been used by this
+        process, and how big it is.
+        """
+        db = self._get_db()
+        entries = db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        size = db.execute("SELECT size FROM total_size").fetchone()[0]
+        hits = sum(self.hits.values())
+        misses = sum(self.misses.values())
+        by_kind = {}
+        for kind in set(self.hits) | set(self.misses):
+            by_kind[kind] = {'hits': self.hits[kind], 'misses': self.misses[kind]}
+        return {
+            'size': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.,
+            'evictions': self.evictions,
+            'by_kind': by_kind,
+        }
+
+    def __repr__(self):
+        return "DiskCache(%r, max_bytes=%r)" % (self.path, self.max_bytes)
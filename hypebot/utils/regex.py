@@ -5,8 +5,8 @@ import re
 from sre_parse import parse, CATEGORIES, SPECIAL_CHARS, SubPattern
 from sre_constants import MAXREPEAT   # this is a quantity, not an enum
 from sre_constants import (
-    MAX_REPEAT, LITERAL, IN, CATEGORY, ANY, SUBPATTERN, BRANCH,
-    AT_BEGINNING, AT_END
+    MAX_REPEAT, LITERAL, NOT_LITERAL, IN, RANGE, NEGATE, CATEGORY, ANY,
+    SUBPATTERN, BRANCH, AT, AT_BEGINNING, AT_END
 )
 
 
@@ -16,6 +16,8 @@ for key, value in CATEGORIES.items():
 
 REGEX_RE = re.compile(r"[\[\]+.(){}|]")
 
+LETTERS = frozenset('abcdefghijklmnopqrstuvwxyz')
+
 
 def regex_sequence(strings):
     """
@@ -105,7 +107,7 @@ def _regex_len_pattern(pattern):
     assert isinstance(pattern, (list, SubPattern)), type(pattern)
     lo = hi = 0
     for op, data in pattern:
-        if op in (LITERAL, IN, CATEGORY, ANY):
+        if op in (LITERAL, NOT_LITERAL, IN, CATEGORY, ANY):
             sub_lo = sub_hi = 1
         elif op == SUBPATTERN:
             sub_lo, sub_hi = _regex_len_pattern(data[-1])
@@ -187,7 +189,7 @@ def _regex_index(struct, index):
         return _regex_index_pattern(struct, index)
     else:
         opcode, data = struct
-        if opcode in (LITERAL, IN, CATEGORY, ANY):
+        if opcode in (LITERAL, NOT_LITERAL, IN, CATEGORY, ANY):
             if index == 0:
                 return [[struct]]
             else:
@@ -221,23 +223,127 @@ def regex_slice(expr, start, end):
     """
     if start < 0 or end < 0:
         raise NotImplementedError("Can't take negative slices of a regex yet")
+    indices = regex_indices(expr, end)
     result = ''
     for index in range(start, end):
-        choices = _regex_index_pattern(parse(expr), index)
-        if len(choices) == 0:
+        if indices[index] is None:
             return None
+        result += indices[index]
+    return result
+
+
+def regex_indices(expr, length):
+    """
+    Get the regexes for indices 0 through `length - 1` of a regex, parsing it
+    only once. An index where nothing can match is given as None.
+
+    Joining a range of these gives the same result as regex_slice, so this is
+    the way to take many slices of the same regex.
+
+        >>> regex_indices('t?est', 3)
+        ['[te]', '[es]', '[st]']
+        >>> regex_indices('ab', 3)
+        ['a', 'b', None]
+
+    """
+    struct = parse(expr)
+    result = []
+    for index in range(length):
+        choices = _regex_index_pattern(struct, index)
+        if len(choices) == 0:
+            result.append(None)
         elif len(choices) == 1:
-            regex = unparse(choices[0])
-            result += regex
+            result.append(unparse(choices[0]))
         else:
             regex = round_trip(unparse((BRANCH, (None, choices))))
             if '|' in regex:
-                result += '(%s)' % (regex,)
+                result.append('(%s)' % (regex,))
             else:
-                result += regex
+                result.append(regex)
     return result
 
 
+def regex_positions(regex):
+    """
+    If a regex is a fixed-length sequence of single characters -- literals,
+    '.', and character classes -- return a list of the lowercase letters it
+    allows at each position, as alphabetized strings, with None standing for
+    "any letter". If the regex has any other structure, return None.
+
+        >>> regex_positions('.a[cb]')
+        [None, 'a', 'bc']
+        >>> regex_positions('[^a-x]')
+        ['yz']
+        >>> regex_positions('ab*') is None
+        True
+    """
+    positions = []
+    for op, data in parse(regex):
+        if op == ANY:
+            positions.append(None)
+            continue
+        elif op == LITERAL:
+            letters = {chr(data)} & LETTERS
+        elif op == NOT_LITERAL:
+            letters = LETTERS - {chr(data)}
+        elif op == IN:
+            letters = _regex_class_letters(data)
+            if letters is None:
+                return None
+        else:
+            return None
+        positions.append(''.join(sorted(letters)))
+    return positions
+
+
+def regex_glob(regex):
+    """
+    Convert a regex to a SQLite GLOB pattern that matches the same
+    lowercase strings, if it's simple enough: a fixed-length sequence of
+    single characters, as `regex_positions` describes. Otherwise, return
+    None.
+
+        >>> regex_glob('.a[cb]')
+        '?a[bc]'
+        >>> regex_glob('ab*') is None
+        True
+    """
+    positions = regex_positions(regex)
+    if positions is None:
+        return None
+    glob = []
+    for letters in positions:
+        if letters is None:
+            glob.append('?')
+        elif len(letters) == 0:
+            return None
+        elif len(letters) == 1:
+            glob.append(letters)
+        else:
+            glob.append('[%s]' % letters)
+    return ''.join(glob)
+
+
+def _regex_class_letters(items):
+    "Get the set of letters matched by the contents of a [character class]."
+    letters = set()
+    negated = False
+    for op, data in items:
+        if op == NEGATE:
+            negated = True
+        elif op == LITERAL:
+            letters.add(chr(data))
+        elif op == RANGE:
+            start, end = data
+            letters.update(chr(code) for code in range(start, end + 1))
+        else:
+            return None
+    if negated:
+        return LETTERS - letters
+    else:
+        return letters & LETTERS
+
+
 def _regex_index_branch(branches, index):
     choices = []
     for branch in branches:
@@ -272,10 +378,10 @@ def _regex_index_pattern(pattern, index):
         if index < lo_counter:
             break
         elif lo_counter <= index < next_hi:
-            for offset in range(lo_counter, hi_counter+1):
-                sub_index = index - offset
-                if sub_index >= 0:
-                    choices.extend(_regex_index(sub, sub_index))
+            # After an unbounded repeat, hi_counter is huge, but offsets past
+            # the index can't matter.
+            for offset in range(lo_counter, min(hi_counter, index) + 1):
+                choices.extend(_regex_index(sub, index - offset))
         lo_counter, hi_counter = next_lo, next_hi
     
     # if any of the choices is 'any', it overrules everything else.
@@ -283,7 +389,7 @@ def _regex_index_pattern(pattern, index):
         # make sure our choices are single characters
         assert len(choice) == 1
         op, data = choice[0]
-        if op == 'any':
+        if op == ANY:
             return [choice]
     return choices
 
@@ -314,6 +420,14 @@ def _unparse_literal(data):
         return char
 
 
+def _unparse_not_literal(data):
+    return '[^' + _unparse_literal(data) + ']'
+
+
+def _unparse_negate(data):
+    return '^'
+
+
 def _unparse_any(data):
     return '.'
 
@@ -25,6 +25,14 @@ LETTER_FREQS = [
     0.00303336
 ]
 
+# A 'letterbag' is a multiset of letters packed into an integer, with a byte
+# for the count of each letter, 'a' in the lowest byte. The high bit of each
+# byte is kept clear, so counts can go up to 127, and subtracting one
+# letterbag from another can only borrow from the guard bits -- which tells
+# us whether one contains the other, all at once.
+LETTERBAG_MAX_COUNT = 127
+LETTERBAG_GUARDS = int.from_bytes(b'\x80' * 26, 'little')
+
 # Loaded only if needed.
 # Use 'get_bigram_freqs' and 'get_trigram_freqs' to access these.
 BIGRAM_FREQS = []
@@ -44,58 +52,121 @@ def letters_to_vec(letters):
     return vec
 
 
-def to_proportion(vec):
+def vec_to_alphagram(vec):
     """
-    Convert a vector that counts occurrences to a vector of proportions
-    (whose sum is 1).
+    Convert a length-26 vector of letter counts back into an alphagram.
     """
-    vecsum = sum(vec)
-    return [value / vecsum for value in vec]
+    return ''.join(ALPHABET[index] * count for index, count in enumerate(vec))
 
 
-def alphagram(slug):
+def vec_diff(vec1, vec2):
     """
-    Given text in 'slug' form, return its alphagram, which is the string of
-    its letters sorted in alphabetical order.
+    Subtract one vector of letter counts from another. Returns a pair
+    containing:
+
+    - the vector of letters in vec1 that remain
+    - the number of letters in vec2 that aren't in vec1
     """
-    return ''.join(sorted(slug))
+    remaining = [n1 - n2 if n1 > n2 else 0 for n1, n2 in zip(vec1, vec2)]
+    missing = sum([n2 - n1 for n1, n2 in zip(vec1, vec2) if n2 > n1])
+    return remaining, missing
 
 
-def alphabytes(slug):
+def multiset_combinations(letters, size):
     """
-    This representation is used internally to Solvertools. It's like an
-    alphagram, but represents up to 7 occurrences of a letter as unique bytes
-    that can be searched for in a specially-prepared word list.
+    Yield every distinct alphagram of `size` letters that can be taken from
+    `letters`, in alphabetical order. Unlike `itertools.combinations`, this
+    yields each multiset of letters once, no matter how many times its
+    letters are repeated in `letters`.
 
-    This allows simple regexes to match "a word with at most two e's and at
-    most three t's", a search which would be very complex and inefficient in
-    the usual string representation.
+        >>> list(multiset_combinations('eeer', 2))
+        ['ee', 'er']
     """
-    alpha = alphagram(slug)
-    current_letter = None
-    rank = 0
-    bytenums = []
-    for letter in alpha:
-        if letter == current_letter:
-            rank += 1
-        else:
-            rank = 0
-        if rank < 6:
-            num = ord(letter) - 96 + (rank + 2) * 32
-        else:
-            num = ord(letter) - 96
-        bytenums.append(num)
-        current_letter = letter
-    return bytes(bytenums)
+    counts = [
+        (ALPHABET[index], count)
+        for index, count in enumerate(letters_to_vec(letters))
+        if count
+    ]
+    # How many letters are available from each position in `counts` onward
+    available = [0] * (len(counts) + 1)
+    for index in reversed(range(len(counts))):
+        available[index] = available[index + 1] + counts[index][1]
+    if 0 <= size <= available[0]:
+        yield from _multiset_combinations(counts, available, 0, size, '')
+
+
+def _multiset_combinations(counts, available, index, size, prefix):
+    if size == 0:
+        yield prefix
+        return
+    letter, count = counts[index]
+    # Taking more of an earlier letter comes first alphabetically.
+    most = min(count, size)
+    least = max(0, size - available[index + 1])
+    for taken in range(most, least - 1, -1):
+        yield from _multiset_combinations(
+            counts, available, index + 1, size - taken, prefix + letter * taken
+        )
+
+
+def letterbag(letters):
+    """
+    Pack an iterator of lowercase letters into a letterbag.
+
+        >>> letterbag('abba') == 2 + (2 << 8)
+        True
+    """
+    return letterbag_from_vec(letters_to_vec(letters))
 
 
-def alphabytes_to_alphagram(abytes):
+def letterbag_from_vec(vec):
     """
-    Convert the specialized 'alphabytes' form described above to an ordinary,
-    printable alphagram.
+    Pack a length-26 vector of letter counts, such as a row of a NumPy
+    array of uint8, into a letterbag.
     """
-    letters = [chr(96 + byte % 32) for byte in abytes]
-    return ''.join(letters)
+    bag = int.from_bytes(bytes(vec), 'little')
+    if bag & LETTERBAG_GUARDS:
+        raise ValueError(
+            "A letterbag can't hold more than %d of the same letter"
+            % LETTERBAG_MAX_COUNT
+        )
+    return bag
+
+
+def letterbag_to_vec(bag):
+    """
+    Unpack a letterbag into a length-26 list of letter counts.
+    """
+    return list(bag.to_bytes(26, 'little'))
+
+
+def letterbag_contains(bag, sub):
+    """
+    Can the letters of letterbag `sub` all be taken from letterbag `bag`?
+
+        >>> letterbag_contains(letterbag('letters'), letterbag('sell'))
+        False
+        >>> letterbag_contains(letterbag('letters'), letterbag('tels'))
+        True
+    """
+    return ((bag | LETTERBAG_GUARDS) - sub) & LETTERBAG_GUARDS == LETTERBAG_GUARDS
+
+
+def to_proportion(vec):
+    """
+    Convert a vector that counts occurrences to a vector of proportions
+    (whose sum is 1).
+    """
+    vecsum = sum(vec)
+    return [value / vecsum for value in vec]
+
+
+def alphagram(slug):
+    """
+    Given text in 'slug' form, return its alphagram, which is the string of
+    its letters sorted in alphabetical order.
+    """
+    return ''.join(sorted(slug))
 
 
 def anagram_diff(a1, a2):
@@ -109,18 +180,8 @@ def anagram_diff(a1, a2):
     - the number of letters in a2 that are not found in a1, which is the number
       of "wildcards" to consume
     """
-    adiff = ''
-    wildcards_used = 0
-    for letter in set(a2) - set(a1):
-        diff = a2.count(letter) - a1.count(letter)
-        wildcards_used += diff
-    for letter in sorted(set(a1)):
-        diff = (a1.count(letter) - a2.count(letter))
-        if diff < 0:
-            wildcards_used -= diff
-        else:
-            adiff += letter * diff
-    return adiff, wildcards_used
+    remaining, wildcards_used = vec_diff(letters_to_vec(a1), letters_to_vec(a2))
+    return vec_to_alphagram(remaining), wildcards_used
 
 
 def diff_both(a1, a2):
@@ -130,18 +191,11 @@ def diff_both(a1, a2):
     - The alphagram of letters in a1 but not in a2
     - The alphagram of letters in a2 but not in a1
     """
-    diff1 = ''
-    diff2 = ''
-    for letter in set(a2) - set(a1):
-        diff = a2.count(letter) - a1.count(letter)
-        diff2 += letter * diff
-    for letter in sorted(set(a1)):
-        diff = (a1.count(letter) - a2.count(letter))
-        if diff < 0:
-            diff2 += letter * diff
-        else:
-            diff1 += letter * diff
-    return diff1, diff2
+    vec1 = letters_to_vec(a1)
+    vec2 = letters_to_vec(a2)
+    diff1, _ = vec_diff(vec1, vec2)
+    diff2, _ = vec_diff(vec2, vec1)
+    return vec_to_alphagram(diff1), vec_to_alphagram(diff2)
 
 
 def diff_exact(full, part):
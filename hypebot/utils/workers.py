@@ -0,0 +1,192 @@
+"""
+Run slow work without blocking the Discord event loop.
+
+Every command handler runs on the bot's single event loop, so a handler that
+spends a minute anagramming, or waits on a slow website, holds up every
+command in every channel. A WorkerPool runs that work somewhere else and lets
+the handler `await` the result:
+
+- CPU-bound solver calls run in a pool of worker processes, so they don't
+  compete with the event loop for the GIL. The workers are started with
+  'spawn', so each one loads its own copy of the wordlists instead of
+  inheriting the parent's SQLite connections across a fork.
+
+- Blocking I/O, such as the `requests` calls in `external_api`, runs in a
+  pool of threads.
+
+Both pools are started the first time they're needed. Anything that runs in
+the process pool, including its arguments and results, must be picklable,
+which means it should be a module-level function.
+
+A generator function can be run in a worker process with `stream_cpu`, which
+passes each thing it yields back through a queue as soon as it's ready. The
+queue, and any events made with `event()`, belong to a multiprocessing
+Manager, so they can be shared with the workers.
+"""
+import asyncio
+import functools
+import multiprocessing
+import queue as queue_module
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+PROCESS_WORKERS = 2
+THREAD_WORKERS = 8
+
+# The default number of seconds to wait for a result
+DEFAULT_TIMEOUT = 60
+
+# What stream_cpu's worker puts on the queue when the generator is done
+_END_OF_STREAM = '__end_of_stream__'
+
+
+class WorkerPool:
+    def __init__(self, processes=PROCESS_WORKERS, threads=THREAD_WORKERS):
+        self.processes = processes
+        self.threads = threads
+        self._process_pool = None
+        self._thread_pool = None
+        self._manager = None
+        # The futures of work that's been submitted to either pool and
+        # hasn't finished, so that shutdown can cancel the ones that haven't
+        # started
+        self._pending = set()
+
+    def _get_process_pool(self):
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._process_pool
+
+    def _get_thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.threads, thread_name_prefix='hypebot-io'
+            )
+        return self._thread_pool
+
+    def _get_manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.get_context('spawn').Manager()
+        return self._manager
+
+    def event(self):
+        """
+        Make an Event that can be passed to a worker process, so that the
+        worker can find out when it's been set.
+        """
+        return self._get_manager().Event()
+
+    def _submit(self, executor, func, args, kwargs):
+        """
+        Submit a call to one of the pools, and return an asyncio future for
+        its result.
+        """
+        future = executor.submit(functools.partial(func, *args, **kwargs))
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return asyncio.wrap_future(future)
+
+    async def _run_in_executor(self, executor, func, args, kwargs, timeout):
+        return await asyncio.wait_for(
+            self._submit(executor, func, args, kwargs), timeout
+        )
+
+    async def run_cpu(self, func, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """
+        Run a CPU-bound function in a worker process, and return its result.
+
+        Raises asyncio.TimeoutError if it takes more than `timeout` seconds.
+        The worker can't be interrupted, so it finishes the call anyway; give
+        slow functions their own time limit when they have one.
+        """
+        try:
+            return await self._run_in_executor(
+                self._get_process_pool(), func, args, kwargs, timeout
+            )
+        except BrokenProcessPool:
+            # A worker died, which leaves the whole pool unusable. Start a new
+            # one for the next call.
+            self._process_pool = None
+            raise
+
+    async def run_io(self, func, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """
+        Run a function that blocks on I/O in a worker thread, and return its
+        result.
+
+        Raises asyncio.TimeoutError if it takes more than `timeout` seconds.
+        """
+        return await self._run_in_executor(
+            self._get_thread_pool(), func, args, kwargs, timeout
+        )
+
+    async def stream_cpu(self, func, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """
+        Run a CPU-bound generator function in a worker process, yielding
+        each of its values as soon as the worker produces it.
+
+        Raises asyncio.TimeoutError if the generator hasn't finished after
+        `timeout` seconds. As with run_cpu, the worker keeps going anyway,
+        unless it has its own way to be told to stop.
+        """
+        queue = self._get_manager().Queue()
+        future = self._submit(
+            self._get_process_pool(), _stream_into_queue,
+            (queue, func, args, kwargs), {}
+        )
+        end_time = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = end_time - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                # Waiting on the queue blocks, so do it in a thread, with a
+                # timeout of its own so the thread doesn't outlive us.
+                item = await self._run_in_executor(
+                    self._get_thread_pool(), _get_from_queue,
+                    (queue, remaining), {}, remaining + 1
+                )
+                if item == _END_OF_STREAM:
+                    break
+                yield item
+            # Raise any exception from the worker.
+            await future
+        except BrokenProcessPool:
+            self._process_pool = None
+            raise
+
+    def shutdown(self):
+        """
+        Stop the workers, abandoning any work that hasn't started yet.
+        """
+        # Executor.shutdown can only cancel futures itself from Python 3.9.
+        for future in list(self._pending):
+            future.cancel()
+        for pool in (self._process_pool, self._thread_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        if self._manager is not None:
+            self._manager.shutdown()
+        self._process_pool = None
+        self._thread_pool = None
+        self._manager = None
+
+
+def _stream_into_queue(queue, func, args, kwargs):
+    try:
+        for item in func(*args, **kwargs):
+            queue.put(item)
+    finally:
+        queue.put(_END_OF_STREAM)
+
+
+def _get_from_queue(queue, timeout):
+    try:
+        return queue.get(timeout=timeout)
+    except queue_module.Empty:
+        raise asyncio.TimeoutError
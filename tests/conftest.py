@@ -0,0 +1,60 @@
+"""
+Fixtures shared by the tests.
+"""
+import glob
+import itertools
+import os
+import zlib
+
+import pytest
+
+from hypebot.utils.path import data_path, wordlist_path
+
+
+# A small wordlist that the tests build all the files of a real wordlist
+# from. Its name is one that no real wordlist has.
+TINY_WORDLIST_NAME = 'test-tiny'
+TINY_WORDLIST = [
+    ('the', 5000), ('a', 4000), ('to', 3000), ('no', 3000), ('are', 3000),
+    ('on', 2500), ('one', 2000), ('or', 2000), ('like', 2000),
+    ('man', 1800), ('world', 1800), ('more', 1700), ('rest', 1600),
+    ('moon', 1500), ('hello', 1500), ('star', 1400), ('old', 1400),
+    ('room', 1200), ('sea', 1200), ('team', 900), ('stare', 900),
+    ('law', 900), ('wood', 900), ('meat', 800), ('ear', 700), ('mate', 700),
+    ('east', 700), ('low', 600), ('hold', 500), ('astronomer', 500),
+    ('steam', 400), ('dirty', 400), ('rooster', 350), ('roster', 300),
+    ('tram', 300), ('tame', 300), ('tin', 300), ('maroon', 200),
+    ('claw', 200), ('mortar', 150), ('mortars', 120), ('mates', 110),
+    ('tomes', 100), ('leek', 90), ('dormitory', 80), ('clint', 50),
+]
+# ...and every string of two to four of a few letters, with made-up
+# frequencies, so that a text of those letters has lots of anagrams
+TINY_WORDLIST += [
+    (word, 10 + zlib.crc32(word.encode('ascii')) % 1000)
+    for length in (2, 3, 4)
+    for word in map(''.join, itertools.product('aenrst', repeat=length))
+    if word not in dict(TINY_WORDLIST)
+]
+
+
+@pytest.fixture(scope='session')
+def tiny_wordlist():
+    """
+    Build TINY_WORDLIST as a Wordlist, with every file that build_extras
+    makes, and delete the files afterward.
+    """
+    from hypebot.solvertools.wordlist import Wordlist, build_extras
+    with open(wordlist_path(TINY_WORDLIST_NAME + '.txt'), 'w', encoding='utf-8') as out:
+        for text, freq in TINY_WORDLIST:
+            print('%s,%d' % (text, freq), file=out)
+    wordlist = None
+    try:
+        build_extras(TINY_WORDLIST_NAME)
+        wordlist = Wordlist(TINY_WORDLIST_NAME)
+        yield wordlist
+    finally:
+        if wordlist is not None:
+            wordlist.db.close()
+        pattern = data_path(os.path.join('**', TINY_WORDLIST_NAME + '.*'))
+        for path in glob.glob(pattern, recursive=True):
+            os.remove(path)
@@ -0,0 +1,64 @@
+"""
+Tests for anagram searches, on the small word list from conftest.py.
+"""
+import time
+
+import pytest
+
+from hypebot.solvertools.anagram import (
+    SearchDeadline, anagram_double, anagram_single, anagrams
+)
+from hypebot.utils.normalize import slugify
+from hypebot.utils.string import alphagram
+
+
+# A search that would take much longer than the time limits below
+LONG_SEARCH = ('rest stare net rant', 0)
+
+
+def test_single_word_anagrams(tiny_wordlist):
+    found = [text for score, text in anagram_single('steam', wordlist=tiny_wordlist)]
+    assert sorted(found) == ['mates', 'steam']
+
+
+@pytest.mark.parametrize('search', [anagrams, anagram_double])
+def test_anagrams_use_the_same_letters(tiny_wordlist, search):
+    results = search('astronomer', wordlist=tiny_wordlist, quiet=True)
+    assert (24.5, 'astronomer') in results
+    assert 'man rooster' in [text for score, text in results]
+    for score, text in results:
+        assert alphagram(slugify(text)) == alphagram('astronomer')
+
+
+def test_anagrams_are_sorted_and_counted(tiny_wordlist):
+    results = anagrams('tenser', wordlist=tiny_wordlist, count=20, quiet=True)
+    assert len(results) == 20
+    scores = [score for score, text in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_wildcards_add_letters(tiny_wordlist):
+    results = anagrams('astronome', 1, wordlist=tiny_wordlist, quiet=True)
+    assert 'astronomer' in [text for score, text in results]
+    for score, text in results:
+        assert len(slugify(text)) == len('astronome') + 1
+
+
+def test_time_limit_stops_the_search(tiny_wordlist):
+    text, wildcards = LONG_SEARCH
+    start = time.monotonic()
+    anagrams(text, wildcards, wordlist=tiny_wordlist, count=10 ** 6, quiet=True,
+             time_limit=0.5)
+    # Generous, so that a busy machine doesn't make this fail
+    assert time.monotonic() - start < 10
+
+
+def test_cancelled_search_returns_nothing(tiny_wordlist):
+    text, wildcards = LONG_SEARCH
+    deadline = SearchDeadline()
+    deadline.cancel()
+    start = time.monotonic()
+    results = anagrams(text, wildcards, wordlist=tiny_wordlist, quiet=True,
+                       deadline=deadline)
+    assert results == []
+    assert time.monotonic() - start < 10
@@ -0,0 +1,40 @@
+"""
+Parallel anagram searches should get the same results as searches in one
+process, even when they stop early because they've found enough.
+"""
+import pytest
+
+from hypebot.solvertools.anagram import anagram_double, anagrams
+
+
+SEARCHES = [
+    ('astronomer', 0),
+    ('astronome', 1),
+    ('stare rest', 0),
+    ('stare rent', -1),
+    ('tenser', 0),
+]
+
+
+@pytest.mark.parametrize('count', [2, 100])
+@pytest.mark.parametrize('text, wildcards', SEARCHES + [('rest stare net', 0)])
+def test_parallel_anagrams_match_serial(tiny_wordlist, text, wildcards, count):
+    serial = anagrams(text, wildcards, wordlist=tiny_wordlist, count=count, quiet=True)
+    parallel = anagrams(
+        text, wildcards, wordlist=tiny_wordlist, count=count, quiet=True,
+        processes=2
+    )
+    assert serial
+    assert parallel == serial
+
+
+@pytest.mark.parametrize('count', [2, 100])
+@pytest.mark.parametrize('text, wildcards', SEARCHES)
+def test_parallel_anagram_double_matches_serial(tiny_wordlist, text, wildcards, count):
+    serial = anagram_double(text, wildcards, wordlist=tiny_wordlist, count=count, quiet=True)
+    parallel = anagram_double(
+        text, wildcards, wordlist=tiny_wordlist, count=count, quiet=True,
+        processes=2
+    )
+    assert serial
+    assert parallel == serial
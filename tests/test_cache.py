@@ -0,0 +1,130 @@
+"""
+Tests for the caches in hypebot.utils.cache.
+"""
+import pickle
+
+import pytest
+
+from hypebot.solvertools.wordlist import Wordlist
+from hypebot.utils.cache import DiskCache, LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(3)
+    for key in 'abc':
+        cache[key] = key.upper()
+    assert cache.get('a') == 'A'
+    cache['d'] = 'D'
+    assert 'b' not in cache
+    assert [key for key in 'abcd' if key in cache] == ['a', 'c', 'd']
+    # Setting an existing key counts as using it.
+    cache['c'] = 'C2'
+    cache['e'] = 'E'
+    assert [key for key in 'abcde' if key in cache] == ['c', 'd', 'e']
+    assert cache.get('c') == 'C2'
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.stats() == {
+        'size': 3, 'maxsize': 3, 'hits': 2, 'misses': 1, 'evictions': 2
+    }
+
+
+def test_lru_cache_sizes():
+    unbounded = LRUCache(None)
+    for number in range(1000):
+        unbounded[number] = number
+    assert len(unbounded) == 1000
+    assert unbounded.evictions == 0
+
+    disabled = LRUCache(0)
+    disabled['a'] = 1
+    assert len(disabled) == 0
+    assert disabled.get('a') is None
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path / 'results.db'), max_bytes=10000)
+    yield cache
+    if cache._db is not None:
+        cache._db.close()
+
+
+def entry_size(namespace, version, key, value):
+    "How many bytes DiskCache counts for an entry."
+    db_key = repr((namespace, version) + tuple(key))
+    return len(db_key) + len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def test_disk_cache_round_trip(disk_cache):
+    assert disk_cache.get('words', '1', ('crom', 'foo')) is None
+    disk_cache.put('words', '1', ('crom', 'foo'), (1.5, 'FOO'))
+    assert disk_cache.get('words', '1', ('crom', 'foo')) == (1.5, 'FOO')
+    assert disk_cache.get('words', '1', ('crom', 'bar'), 'missing') == 'missing'
+    stats = disk_cache.stats()
+    assert stats['size'] == 1
+    assert stats['bytes'] == entry_size('words', '1', ('crom', 'foo'), (1.5, 'FOO'))
+    assert stats['by_kind'] == {'crom': {'hits': 1, 'misses': 2}}
+
+
+def test_disk_cache_replaces_entries(disk_cache):
+    disk_cache.put('words', '1', ('crom', 'foo'), 'a' * 100)
+    disk_cache.put('words', '1', ('crom', 'foo'), 'b')
+    assert disk_cache.get('words', '1', ('crom', 'foo')) == 'b'
+    assert disk_cache.stats()['bytes'] == entry_size('words', '1', ('crom', 'foo'), 'b')
+
+
+def test_disk_cache_new_version_invalidates(disk_cache):
+    disk_cache.put('words', '1', ('crom', 'foo'), 1)
+    disk_cache.put('other', '1', ('crom', 'foo'), 2)
+    assert disk_cache.get('words', '2', ('crom', 'foo')) is None
+    assert disk_cache.get('words', '1', ('crom', 'foo')) is None
+    assert disk_cache.get('other', '1', ('crom', 'foo')) == 2
+    assert disk_cache.stats()['bytes'] == entry_size('other', '1', ('crom', 'foo'), 2)
+
+
+def test_disk_cache_shared_between_instances(disk_cache):
+    disk_cache.put('words', '1', ('crom', 'foo'), 1)
+    other = DiskCache(disk_cache.path, max_bytes=disk_cache.max_bytes)
+    assert other.get('words', '1', ('crom', 'foo')) == 1
+    other.invalidate('words')
+    assert disk_cache.get('words', '1', ('crom', 'foo')) is None
+    other._db.close()
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    value = 'x' * 900
+    size = entry_size('words', '1', ('crom', 0), value)
+    cache = DiskCache(str(tmp_path / 'results.db'), max_bytes=size * 3.5)
+    for number in range(4):
+        cache.put('words', '1', ('crom', number), value)
+    stats = cache.stats()
+    assert stats['bytes'] <= cache.max_bytes * cache.low_water
+    assert stats['evictions'] == 1
+    assert cache.get('words', '1', ('crom', 0)) is None
+    for number in range(1, 4):
+        assert cache.get('words', '1', ('crom', number)) == value
+
+    # A value too big for the cache isn't kept, and doesn't evict anything
+    cache.put('words', '1', ('crom', 'big'), 'x' * 10000)
+    assert cache.get('words', '1', ('crom', 'big')) is None
+    assert cache.stats()['size'] == 3
+    cache._db.close()
+
+
+def test_wordlist_cached_result(tiny_wordlist, disk_cache):
+    wordlist = Wordlist(tiny_wordlist.name, result_cache=disk_cache)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return ['result']
+
+    try:
+        assert wordlist.cached_result(('test', 'key'), compute) == ['result']
+        assert wordlist.cached_result(('test', 'key'), compute) == ['result']
+        assert len(calls) == 1
+        assert disk_cache.get(
+            wordlist.name, wordlist.build_version(), ('test', 'key')
+        ) == ['result']
+    finally:
+        wordlist.db.close()
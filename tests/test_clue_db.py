@@ -0,0 +1,125 @@
+"""
+Tests for building and updating the clue database, from small source files
+made for each test.
+"""
+import sqlite3
+
+import pytest
+
+from hypebot.solvertools import clue_db
+from hypebot.solvertools.clue_text import keyword_parts, table_columns
+
+
+def write_source(path, clues):
+    path.write_text(
+        'answer,clue\n' + ''.join('%s,%s\n' % clue for clue in clues),
+        encoding='utf-8'
+    )
+    return str(path)
+
+
+def db_contents(db):
+    "Get the clues and keyword parts in a database, ignoring their order."
+    clues = sorted(db.execute("SELECT keyword, text, lengths FROM clues"))
+    parts = sorted(
+        (keyword, slug, round(weight, 6), length)
+        for keyword, slug, weight, length in db.execute("SELECT * FROM keyword_parts")
+    )
+    return clues, parts
+
+
+@pytest.fixture
+def sources(tmp_path):
+    return [
+        write_source(tmp_path / 'one.csv', [
+            ('GRILL', 'cook over a fire'), ('OPEN FIRE', 'campers cook over it')
+        ]),
+        write_source(tmp_path / 'two.csv', [
+            ('GRILL', 'question closely'), ('INTERROGATE', 'question')
+        ]),
+    ]
+
+
+def test_update_matches_rebuild(tmp_path, sources):
+    db = clue_db.update_search_db(sources, clue_db.get_db(str(tmp_path / 'a.db')))
+    clues, parts = db_contents(db)
+    assert ('OPEN FIRE', 'campers cook over it', 'len4 len8') in clues
+    assert ('OPEN FIRE', 'openfire', 1., 8) in parts
+    assert ('OPEN FIRE', 'fire', 0.5, 4) in parts
+
+    # Nothing changed, so nothing is read again.
+    rows = db.execute("SELECT * FROM sources ORDER BY path").fetchall()
+    clue_db.update_search_db(sources, db)
+    assert db.execute("SELECT * FROM sources ORDER BY path").fetchall() == rows
+
+    # Change a source, so that one of its keywords isn't used anymore.
+    write_source(tmp_path / 'one.csv', [('BARBECUE', 'cook over a fire')])
+    clue_db.update_search_db(sources, db)
+    updated = db_contents(db)
+    assert 'OPEN FIRE' not in [keyword for keyword, slug, weight, length in updated[1]]
+
+    rebuilt = clue_db.update_search_db(
+        sources, clue_db.get_db(str(tmp_path / 'b.db')), rebuild=True
+    )
+    assert updated == db_contents(rebuilt)
+    db.close()
+    rebuilt.close()
+
+
+def test_migrate_old_db(tmp_path, sources):
+    path = str(tmp_path / 'old.db')
+    new = clue_db.update_search_db(sources, clue_db.get_db(str(tmp_path / 'new.db')))
+
+    # Make a database like the first version of clue_db.py, with no
+    # `lengths` column and no `length` in keyword_parts.
+    old = sqlite3.connect(path)
+    old.execute("CREATE VIRTUAL TABLE clues USING fts5(keyword, text)")
+    old.execute(
+        "CREATE TABLE sources (path TEXT PRIMARY KEY, hash TEXT, "
+        "first_rowid INT, last_rowid INT)"
+    )
+    old.execute("CREATE TABLE keyword_parts (keyword TEXT, slug TEXT, weight REAL)")
+    old.executemany(
+        "INSERT INTO clues (rowid, keyword, text) VALUES (?, ?, ?)",
+        new.execute("SELECT rowid, keyword, text FROM clues")
+    )
+    old.executemany(
+        "INSERT INTO sources VALUES (?, ?, ?, ?)", new.execute("SELECT * FROM sources")
+    )
+    old.commit()
+    old.close()
+
+    migrated = clue_db.get_db(path)
+    assert 'lengths' in table_columns(migrated, 'clues')
+    assert 'length' in table_columns(migrated, 'keyword_parts')
+    assert db_contents(migrated) == db_contents(new)
+    assert (
+        migrated.execute("SELECT rowid, keyword FROM clues ORDER BY rowid").fetchall()
+        == new.execute("SELECT rowid, keyword FROM clues ORDER BY rowid").fetchall()
+    )
+    # The sources haven't changed, so updating it reads nothing.
+    clue_db.update_search_db(sources, migrated)
+    assert db_contents(migrated) == db_contents(new)
+    migrated.close()
+    new.close()
+
+
+def test_untracked_clues_are_rebuilt(tmp_path, sources):
+    path = str(tmp_path / 'untracked.db')
+    db = sqlite3.connect(path)
+    db.execute("CREATE VIRTUAL TABLE clues USING fts5(keyword, text)")
+    db.execute("INSERT INTO clues (keyword, text) VALUES ('GRILL', 'cook over a fire')")
+    db.commit()
+    db.close()
+
+    db = clue_db.update_search_db(sources, clue_db.get_db(path))
+    new = clue_db.update_search_db(sources, clue_db.get_db(str(tmp_path / 'new.db')))
+    assert db_contents(db) == db_contents(new)
+    db.close()
+    new.close()
+
+
+def test_keyword_parts():
+    assert keyword_parts('OPEN FIRE') == {'openfire': 1., 'open': 0.5, 'fire': 0.5}
+    assert keyword_parts('GRILL') == {'grill': 2.}
+    assert clue_db.keyword_lengths('OPEN FIRE') == 'len4 len8'
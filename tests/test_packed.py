@@ -0,0 +1,49 @@
+"""
+Tests for reading back packed word tables.
+"""
+import itertools
+
+import pytest
+
+from hypebot.solvertools.packed import PackedWordTable, write_packed_table
+
+
+ROWS = [
+    (slug, 1000 + number * 7, '%s (%d)' % (slug.upper(), number))
+    for number, slug in enumerate(
+        ''.join(letters)
+        for length in range(1, 5)
+        for letters in itertools.product('abn', repeat=length)
+    )
+] + [
+    ('', 2 ** 40, ''), ('cafe', 5, 'café'), ('zz' * 300, 1, 'long one')
+]
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 16, 1000])
+def test_packed_round_trip(tmp_path, block_size):
+    path = str(tmp_path / 'words.packed')
+    write_packed_table(path, reversed(ROWS), block_size=block_size)
+    table = PackedWordTable(path)
+    assert len(table) == len(ROWS)
+    assert list(table.iter_slugs()) == sorted(slug for slug, freq, text in ROWS)
+    for slug, freq, text in ROWS:
+        assert table.lookup(slug) == (freq, text)
+    for slug in ['aaaaa', 'abc', 'c', 'nnnc', 'b' * 10, 'zz', 'z' * 599, 'z' * 601]:
+        assert table.lookup(slug) is None
+
+
+def test_empty_packed_table(tmp_path):
+    path = str(tmp_path / 'words.packed')
+    write_packed_table(path, [])
+    table = PackedWordTable(path)
+    assert len(table) == 0
+    assert list(table.iter_slugs()) == []
+    assert table.lookup('a') is None
+
+
+def test_not_a_packed_table(tmp_path):
+    path = tmp_path / 'words.packed'
+    path.write_bytes(b'not a packed table at all')
+    with pytest.raises(ValueError):
+        PackedWordTable(str(path))
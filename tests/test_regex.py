@@ -0,0 +1,90 @@
+"""
+Tests for the regex helpers in hypebot.utils.regex, checked against what
+the regexes actually match among short strings.
+"""
+import itertools
+import re
+import sqlite3
+
+import pytest
+
+from hypebot.utils.regex import (
+    regex_glob, regex_indices, regex_len, regex_positions, regex_slice
+)
+
+
+ALPHABET = 'abcz'
+
+# Every string of up to four letters of ALPHABET
+STRINGS = [
+    ''.join(letters)
+    for length in range(5)
+    for letters in itertools.product(ALPHABET, repeat=length)
+]
+
+FIXED_PATTERNS = ['abc', '.a.', '[ab]z', '[^a]b', '[^ab-y].', 'a[^zc]..', '....', '[a-c]']
+OTHER_PATTERNS = ['ab*', 'a|bc', '(ab)+', 'a?b', 'a{2}', '^ab$', '(a|b)c']
+
+
+def matches(pattern):
+    return [string for string in STRINGS if re.fullmatch(pattern, string)]
+
+
+@pytest.mark.parametrize('pattern', FIXED_PATTERNS + OTHER_PATTERNS)
+def test_regex_len(pattern):
+    lo, hi = regex_len(pattern)
+    for string in matches(pattern):
+        assert lo <= len(string) <= hi
+
+
+@pytest.mark.parametrize('pattern', FIXED_PATTERNS)
+def test_regex_positions(pattern):
+    positions = regex_positions(pattern)
+    fits = [
+        string for string in STRINGS
+        if len(string) == len(positions)
+        and all(
+            letters is None or letter in letters
+            for letter, letters in zip(string, positions)
+        )
+    ]
+    assert fits == matches(pattern)
+
+
+@pytest.mark.parametrize('pattern', OTHER_PATTERNS)
+def test_regex_positions_of_other_patterns(pattern):
+    assert regex_positions(pattern) is None
+
+
+@pytest.mark.parametrize('pattern', FIXED_PATTERNS + ['t?est', 'mo+', 'ab*c', 'a|bc'])
+def test_regex_indices(pattern):
+    indices = regex_indices(pattern, 6)
+    assert len(indices) == 6
+    for start in range(6):
+        for end in range(start, 7):
+            if None in indices[start:end]:
+                assert regex_slice(pattern, start, end) is None
+            else:
+                assert regex_slice(pattern, start, end) == ''.join(indices[start:end])
+    # Every string the pattern matches fits its indices.
+    for string in matches(pattern):
+        for index, letter in enumerate(string):
+            assert indices[index] is not None
+            assert re.fullmatch(indices[index], letter)
+
+
+@pytest.mark.parametrize('pattern', FIXED_PATTERNS)
+def test_regex_glob(pattern):
+    glob = regex_glob(pattern)
+    db = sqlite3.connect(':memory:')
+    globbed = [
+        string for string in STRINGS
+        if db.execute("SELECT ? GLOB ?", (string, glob)).fetchone()[0]
+    ]
+    db.close()
+    assert globbed == matches(pattern)
+
+
+@pytest.mark.parametrize('pattern', OTHER_PATTERNS)
+def test_regex_glob_of_other_patterns(pattern):
+    assert regex_glob(pattern) is None
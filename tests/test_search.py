@@ -0,0 +1,71 @@
+"""
+Tests for clue searches, on a small clue database made for each test.
+"""
+import pytest
+
+from hypebot.solvertools import clue_db, search
+
+
+CLUES = [
+    ('answer', 'clue'),
+    ('BARBECUE', 'grill outdoors'),
+    ('GRILL', 'cook over a fire'),
+    ('GRILL', 'question closely'),
+    ('COOKOUT', 'outdoor party with a grill'),
+    ('OPEN FIRE', 'cook over an open flame'),
+    ('CAMPFIRE', 'fire for cooking at a camp'),
+    ('INTERROGATE', 'question closely, as a suspect'),
+]
+
+
+@pytest.fixture
+def clue_db_path(tmp_path, monkeypatch):
+    "Build a clue database from CLUES, and make searches use it."
+    source = tmp_path / 'clues.csv'
+    source.write_text(
+        '\n'.join('%s,%s' % (answer, clue.replace(',', '')) for answer, clue in CLUES),
+        encoding='utf-8'
+    )
+    path = str(tmp_path / 'search.db')
+    db = clue_db.update_search_db([str(source)], clue_db.get_db(path))
+    db.close()
+    monkeypatch.setattr(search, 'db_path', lambda name: str(tmp_path / name))
+    monkeypatch.setattr(search, 'DB', None)
+    monkeypatch.setattr(search, 'DB_COLUMNS', {})
+    yield path
+    if search.DB is not None:
+        search.DB.close()
+
+
+def ranked_slugs(results):
+    return [slug for slug, score in results]
+
+
+def test_db_rank(clue_db_path):
+    assert ranked_slugs(search.db_rank('cook over a fire'))[0] == 'grill'
+    assert ranked_slugs(search.db_rank('question closely'))[:2] == ['grill', 'interrogate']
+
+
+@pytest.mark.parametrize('length', [4, 5, 8])
+def test_length_doesnt_change_scores(clue_db_path, length):
+    everything = search.db_rank('fire')
+    assert search.db_rank('fire', length=length) == [
+        (slug, score) for slug, score in everything if len(slug) == length
+    ]
+
+
+def test_pattern(clue_db_path):
+    assert ranked_slugs(search.db_rank('fire', pattern='.....')) == ['grill']
+    assert ranked_slugs(search.db_rank('fire', pattern='c.*')) == ['campfire']
+    assert ranked_slugs(search.db_rank('fire', pattern='[^gc].*')) == []
+
+
+def test_db_without_keyword_parts(clue_db_path):
+    db = clue_db.get_db(clue_db_path)
+    with db:
+        db.execute("DROP TABLE keyword_parts")
+    db.close()
+    assert not search.db_has_keyword_parts()
+    # Only whole keywords get credit
+    assert ranked_slugs(search.db_rank('flame')) == ['openfire']
+    assert ranked_slugs(search.db_rank('fire', length=5)) == ['grill']
@@ -0,0 +1,61 @@
+"""
+Tests for the letter-counting helpers in hypebot.utils.string.
+"""
+import itertools
+
+import pytest
+
+from hypebot.utils.string import (
+    LETTERBAG_MAX_COUNT, alphagram, letterbag, letterbag_contains,
+    letterbag_from_vec, letterbag_to_vec, letters_to_vec, multiset_combinations,
+    vec_diff, vec_to_alphagram
+)
+
+
+def test_letterbag_round_trip():
+    for letters in ['', 'a', 'abba', 'zyzzyva', 'z' * LETTERBAG_MAX_COUNT]:
+        vec = letters_to_vec(letters)
+        assert letterbag_to_vec(letterbag(letters)) == vec
+        assert letterbag_from_vec(vec) == letterbag(letters)
+        assert vec_to_alphagram(vec) == alphagram(letters)
+
+
+@pytest.mark.parametrize('letter', ['a', 'm', 'z'])
+def test_letterbag_overflow(letter):
+    with pytest.raises(ValueError):
+        letterbag(letter * (LETTERBAG_MAX_COUNT + 1))
+    with pytest.raises(ValueError):
+        letterbag_from_vec([255] * 26)
+
+
+def test_letterbag_contains_matches_vec_diff():
+    words = ['', 'a', 'aa', 'ab', 'ba', 'abz', 'zz', 'letters', 'tels', 'sell']
+    for word1, word2 in itertools.product(words, repeat=2):
+        remaining, missing = vec_diff(letters_to_vec(word1), letters_to_vec(word2))
+        bag1, bag2 = letterbag(word1), letterbag(word2)
+        assert letterbag_contains(bag1, bag2) == (missing == 0)
+        if missing == 0:
+            assert letterbag_to_vec(bag1 - bag2) == remaining
+
+
+def test_letterbag_contains_full_counts():
+    full = letterbag('q' * LETTERBAG_MAX_COUNT)
+    assert letterbag_contains(full, full)
+    assert letterbag_contains(full, letterbag('q'))
+    assert not letterbag_contains(letterbag('q'), full)
+
+
+def test_vec_diff():
+    remaining, missing = vec_diff(letters_to_vec('letters'), letters_to_vec('sellz'))
+    assert vec_to_alphagram(remaining) == 'ertt'
+    assert missing == 2
+
+
+@pytest.mark.parametrize('letters', ['', 'abc', 'eeer', 'mississippi'])
+def test_multiset_combinations(letters):
+    for size in range(len(letters) + 2):
+        expected = sorted({
+            ''.join(combo)
+            for combo in itertools.combinations(sorted(letters), size)
+        })
+        assert list(multiset_combinations(letters, size)) == expected
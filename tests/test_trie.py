@@ -0,0 +1,57 @@
+"""
+Tests for SlugTrie, against brute-force searches of the same slugs.
+"""
+import itertools
+import random
+
+import pytest
+
+from hypebot.solvertools.trie import SlugTrie
+
+
+SLUGS = [
+    ''.join(letters)
+    for length in range(1, 4)
+    for letters in itertools.product('abz', repeat=length)
+    if random.Random(''.join(letters)).random() < 0.6
+] + ['', 'zzzz', 'abba']
+
+
+@pytest.fixture(scope='module')
+def trie():
+    return SlugTrie(SLUGS)
+
+
+def test_contents(trie):
+    assert len(trie) == len(SLUGS) - 1
+    assert '' not in trie
+    for slug in SLUGS:
+        if slug:
+            assert slug in trie
+    for slug in ['c', 'abbb', 'zzzzz']:
+        assert slug not in trie
+
+
+@pytest.mark.parametrize('prefix', ['', 'a', 'ab', 'abb', 'abba', 'abbab', 'b', 'z', 'zzzz', 'c', '{'])
+def test_prefix_range(trie, prefix):
+    lo, hi = trie.prefix_range(prefix)
+    assert trie.slugs[lo:hi] == sorted(
+        slug for slug in SLUGS if slug and slug.startswith(prefix)
+    )
+
+
+@pytest.mark.parametrize('text', ['abbazzzz', 'zab', 'cab', 'abzbaab'])
+def test_prefix_ends(trie, text):
+    for start in range(len(text) + 1):
+        expected = [
+            end for end in range(start + 1, len(text) + 1) if text[start:end] in SLUGS
+        ]
+        assert list(trie.prefix_ends(text, start)) == expected
+
+
+def test_prefix_ends_resume(trie):
+    text = 'abbazzzz'
+    lo, hi = trie.prefix_range('ab')
+    assert list(trie.prefix_ends(text, 0, resume=(2, lo, hi))) == [
+        end for end in trie.prefix_ends(text, 0) if end > 2
+    ]
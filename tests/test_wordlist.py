@@ -0,0 +1,71 @@
+"""
+Tests for looking words up in a Wordlist, on the small word list from
+conftest.py.
+"""
+import pytest
+
+from hypebot.solvertools import wordlist as wordlist_module
+from hypebot.solvertools.wordlist import Wordlist
+
+
+GREP_PATTERNS = ['.a..', 's[te]..', '[^s]e.', 'r...', '....', 'm.t.s', 'x..']
+
+
+@pytest.fixture
+def scanning_wordlist(tiny_wordlist):
+    "The same wordlist, without its positional grep index."
+    wordlist = Wordlist(tiny_wordlist.name)
+    wordlist._grep_index = lambda length: None
+    yield wordlist
+    wordlist.db.close()
+
+
+@pytest.mark.parametrize('pattern', GREP_PATTERNS)
+def test_grep_index_matches_scan(tiny_wordlist, scanning_wordlist, pattern):
+    indexed = sorted(tiny_wordlist.grep(pattern, count=10 ** 6))
+    scanned = sorted(scanning_wordlist.grep(pattern, count=10 ** 6))
+    assert indexed == scanned
+
+
+def test_grep_ignores_index_of_another_file(tiny_wordlist, monkeypatch):
+    assert tiny_wordlist._grep_index(4) is not None
+    real_path = wordlist_module.grep_index_path
+    monkeypatch.setattr(
+        wordlist_module, 'grep_index_path',
+        lambda name, length: real_path(name, length + 1)
+    )
+    wordlist = Wordlist(tiny_wordlist.name)
+    try:
+        assert wordlist._grep_index(4) is None
+        assert sorted(wordlist.grep('.a..', count=10 ** 6)) == sorted(
+            tiny_wordlist.grep('.a..', count=10 ** 6)
+        )
+    finally:
+        wordlist.db.close()
+
+
+LOOKUP_SLUGS = ['the', 'stare', 'astronomer', 'rest', 'tsar', 'zzz', 'hellothere', 'a']
+
+
+def test_lookup_many_matches_lookup_slug(tiny_wordlist):
+    batched = Wordlist(tiny_wordlist.name)
+    batched.max_query_params = 3
+    try:
+        results = batched.lookup_many(LOOKUP_SLUGS + ['the'])
+        assert results == {
+            slug: tiny_wordlist.lookup_slug(slug) for slug in LOOKUP_SLUGS
+        }
+        # The results are cached, including the misses.
+        assert batched.lookup_many(LOOKUP_SLUGS) == results
+    finally:
+        batched.db.close()
+
+
+def test_cromulence_batch_matches_cromulence(tiny_wordlist):
+    texts = ['the', 'stare', 'astronomer', 'moon rooster', 'sea team', 'xqz', '', 'hello!']
+    cromulences, found_texts = tiny_wordlist.cromulence_batch(texts)
+    assert len(cromulences) == len(found_texts) == len(texts)
+    for text, batch_cromulence, batch_text in zip(texts, cromulences, found_texts):
+        cromulence, found_text = tiny_wordlist.cromulence(text)
+        assert batch_cromulence == pytest.approx(cromulence, abs=0.1)
+        assert batch_text == found_text